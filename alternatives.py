@@ -0,0 +1,107 @@
+import heapq
+
+from solver import distances_to, lookup_nodes, _path_result
+
+# Top-k routes between two nodes. One reverse search from the target gives the exact remaining
+# distance of every node; it guides every later search (removing edges or raising weights only
+# makes paths longer, so it never overestimates) and those searches settle little beyond the route
+
+# Diverse mode multiplies the weight of every edge of a found route by 1 + penalty
+DIVERSE_PENALTY = 0.5
+# Diverse mode gives up after this many searches per requested route (e.g. when every
+# alternative is already found)
+DIVERSE_ATTEMPTS = 3
+
+def _search(graph, start, target_id, remaining, cost, banned_nodes=(), banned_edges=()):
+    # A* from start guided by remaining, cost is the weight per edge id. Returns edge ids or None
+    indptr, heads, _, edge_ids = graph.forward
+    dist = {start: 0.0}
+    pred = {}
+    done = set()
+    heap = [(remaining[start], start)]
+    while heap:
+        _, u = heapq.heappop(heap)
+        if u == target_id:
+            edges = []
+            while u != start:
+                edges.append(pred[u])
+                u = graph.src[pred[u]].item()
+            return edges[::-1]
+        if u in done:
+            continue
+        done.add(u)
+        d = dist[u]
+        for k in range(indptr[u], indptr[u + 1]):
+            v, e = heads[k], edge_ids[k]
+            if v in banned_nodes or e in banned_edges or remaining[v] == float("inf"):
+                continue
+            nd = d + cost[e]
+            if nd < dist.get(v, float("inf")):
+                dist[v] = nd
+                pred[v] = e
+                heapq.heappush(heap, (nd + remaining[v], v))
+    return None
+
+def _yen(graph, source_id, target_id, k, remaining, stats):
+    # Yen's algorithm: every later route leaves an earlier one at some spur node, branching off
+    # along an edge no earlier route with the same prefix took, and never revisits the prefix
+    cost = graph.weight.tolist()
+    first = _search(graph, source_id, target_id, remaining, cost)
+    stats["searches"] += 1
+    routes = [first]
+    candidates, seen = [], {tuple(first)}
+    while len(routes) < k:
+        previous = routes[-1]
+        nodes = [source_id] + graph.dst[previous].tolist()
+        root_cost = 0.0
+        for j in range(len(previous)):
+            root = previous[:j]
+            banned_edges = {route[j] for route in routes if len(route) > j and route[:j] == root}
+            spur = _search(graph, nodes[j], target_id, remaining, cost, set(nodes[:j]), banned_edges)
+            stats["searches"] += 1
+            if spur is not None and tuple(root + spur) not in seen:
+                seen.add(tuple(root + spur))
+                heapq.heappush(candidates, (root_cost + sum(cost[e] for e in spur), len(seen), root + spur))
+            root_cost += cost[previous[j]]
+        if not candidates:
+            break
+        routes.append(heapq.heappop(candidates)[2])
+    return routes
+
+def _diverse(graph, source_id, target_id, k, remaining, penalty, stats):
+    # Penalty method: after each route its edges get heavier, so the next search prefers
+    # different edges. Routes are ranked by how they are found, not by their true weight
+    cost = graph.weight.astype(float).tolist()
+    routes, seen = [], set()
+    for _ in range(k * DIVERSE_ATTEMPTS):
+        route = _search(graph, source_id, target_id, remaining, cost)
+        stats["searches"] += 1
+        if tuple(route) not in seen:
+            seen.add(tuple(route))
+            routes.append(route)
+            if len(routes) == k:
+                break
+        for e in route:
+            cost[e] *= 1 + penalty
+    return routes
+
+def k_shortest_paths(graph, source_node, target_node, k, diverse=False, penalty=DIVERSE_PENALTY, stats=None):
+    # Up to k simple routes as (path, total_weight), shortest first. diverse=True trades the
+    # exact ranking for routes that share fewer edges
+    if graph.has_negative_weights:
+        raise ValueError("K shortest paths need non-negative edge weights")
+    stats = {} if stats is None else stats
+    stats["searches"] = 0
+    source_id, target_id = lookup_nodes(graph, source_node, target_node)
+    if source_id is None or target_id is None:
+        return []
+    remaining = distances_to(graph, target_id)
+    if remaining[source_id] == float("inf"):
+        return []
+    if source_id == target_id:
+        return [([], 0.0)]
+    if diverse:
+        routes = _diverse(graph, source_id, target_id, k, remaining, penalty, stats)
+    else:
+        routes = _yen(graph, source_id, target_id, k, remaining, stats)
+    return [_path_result(graph, route) for route in routes]
@@ -0,0 +1,235 @@
+import io
+import os
+import csv
+import json
+import zlib
+from collections import Counter, OrderedDict
+
+import numpy as np
+from flask import Blueprint, Response, jsonify, request
+
+import graph_store
+from graph_cache import get_graph
+from solver import check_backend, choose_backend, dijkstra_tree, lookup_nodes, shortest_path, _json_default
+from streams import gzip_stream
+
+# Headless batch queries for scripts, on the same engines as the app:
+#
+#   POST /api/paths {"graph": "<handle from /upload>" or "edges": [[source, target, weight], ...],
+#                    "queries": [[source, target], ...], "backend": "auto", "paths": true}
+#
+# Results come back in query order as one JSON document (default), NDJSON lines, CSV, a NumPy .npy
+# array of the weights or an Arrow stream (source, target, weight, path as node labels), picked by
+# "format" or the Accept header. Responses are streamed as they are solved and gzipped when the
+# client accepts it; gzipped request bodies are accepted too
+
+blueprint = Blueprint("api", __name__, url_prefix="/api")
+
+FORMATS = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "npy": "application/x-npy",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+# Queries answered between two writes to the response
+CHUNK_QUERIES = 1024
+# A source asked this many times in one request gets a full search tree shared by its queries
+TREE_QUERIES = 4
+# Search trees kept per request (two arrays of n_nodes each)
+MAX_TREES = 8
+# Larger batches are refused with 413, split them over several requests
+MAX_QUERIES = int(os.environ.get("API_MAX_QUERIES", 100_000))
+
+class BadRequest(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+@blueprint.errorhandler(BadRequest)
+def bad_request(e):
+    return jsonify(error=str(e)), e.status
+
+def _body():
+    data = request.get_data()
+    try:
+        if request.headers.get("Content-Encoding", "") == "gzip":
+            data = zlib.decompress(data, wbits=31)
+        body = json.loads(data)
+    except (zlib.error, ValueError):
+        body = None
+    if not isinstance(body, dict):
+        raise BadRequest("The body must be a JSON object")
+    return body
+
+def _graph(body):
+    if "graph" in body:
+        if graph_store.sessions.version(body["graph"]) is None:
+            raise BadRequest(f"Unknown graph {body['graph']}, upload it again", 404)
+        return get_graph({"session": body["graph"]})
+    if "edges" in body:
+        edges = body["edges"]
+        if not isinstance(edges, list) or not all(
+                isinstance(e, list) and len(e) == 3 and all(isinstance(n, (str, int, float)) for n in e[:2])
+                and isinstance(e[2], (int, float)) and not isinstance(e[2], bool) for e in edges):
+            raise BadRequest('"edges" must be a list of [source, target, weight] rows with numeric weights')
+        # Compiled by content, the same edge list sent again reuses the compiled graph
+        try:
+            return get_graph(edges)
+        except ValueError as e:
+            raise BadRequest(f"Could not compile the edges: {e}")
+    raise BadRequest('Give a "graph" handle or an "edges" list')
+
+def _format(body):
+    fmt = body.get("format") or request.args.get("format")
+    if fmt is None:
+        fmt = next((name for name, mimetype in FORMATS.items() if mimetype in request.headers.get("Accept", "")),
+                   "json")
+    if fmt not in FORMATS:
+        raise BadRequest(f"Unknown format {fmt}, choose from {sorted(FORMATS)}", 406)
+    return fmt
+
+def _tree_path(graph, pred, source_id, target_id):
+    edges = []
+    node = target_id
+    while node != source_id:
+        edges.append(pred[node])
+        node = graph.src[pred[node]].item()
+    return graph.edge_path(edges[::-1])
+
+def solve(graph, queries, backend="auto", paths=True, use_cache=True):
+    # (source, target, path, weight) per query, in order. With the automatic backend on
+    # non-negative weights a source asked often gets one search tree for all of its queries,
+    # every other query goes through shortest_path (and so through the result cache for the exact
+    # backends)
+    counts = Counter(source for source, _ in queries)
+    shared = backend == "auto" and not graph.has_negative_weights
+    trees = OrderedDict()
+    for source, target in queries:
+        source_id, target_id = lookup_nodes(graph, source, target)
+        if shared and counts[source] >= TREE_QUERIES and source_id is not None and target_id is not None:
+            tree = trees.get(source_id)
+            if tree is None:
+                tree = trees[source_id] = dijkstra_tree(graph, source_id)
+                if len(trees) > MAX_TREES:
+                    trees.popitem(last=False)
+            trees.move_to_end(source_id)
+            dist, pred = tree
+            if not np.isfinite(dist[target_id]):
+                yield source, target, None, None
+                continue
+            path = _tree_path(graph, pred, source_id, target_id) if paths else None
+            yield source, target, path, dist[target_id].item()
+            continue
+        path, weight = shortest_path(graph, source, target, backend=backend, use_cache=use_cache)
+        yield source, target, path if paths else None, None if weight is None else float(weight)
+
+def _chunks(results, size=CHUNK_QUERIES):
+    chunk = []
+    for result in results:
+        chunk.append(result)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _json_stream(results, n_queries):
+    yield '{"count": %d, "results": [' % n_queries
+    first = True
+    for chunk in _chunks(results):
+        lines = [json.dumps({"source": s, "target": t, "weight": w, "path": p}, default=_json_default)
+                 for s, t, p, w in chunk]
+        yield ("" if first else ",") + ",".join(lines)
+        first = False
+    yield "]}"
+
+def _ndjson_stream(results):
+    for chunk in _chunks(results):
+        yield "".join(json.dumps({"source": s, "target": t, "weight": w, "path": p}, default=_json_default) + "\n"
+                      for s, t, p, w in chunk)
+
+def _path_nodes(source, path):
+    return [source] + [v for _, v in path]
+
+def _csv_stream(results):
+    # Paths as node labels joined by "->", empty weight and path where there is none
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(["source", "target", "weight", "path"])
+    for chunk in _chunks(results):
+        writer.writerows([s, t, "" if w is None else w, "" if p is None else "->".join(map(str, _path_nodes(s, p)))]
+                         for s, t, p, w in chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def _npy_stream(results, n_queries):
+    # Weights only, inf where there is no path; the header knows the length up front
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(header, {"descr": "<f8", "fortran_order": False, "shape": (n_queries,)})
+    yield header.getvalue()
+    for chunk in _chunks(results):
+        yield np.array([np.inf if w is None else w for _, _, _, w in chunk], dtype="<f8").tobytes()
+
+def _arrow_stream(results):
+    import pyarrow as pa
+
+    schema = pa.schema([("source", pa.string()), ("target", pa.string()), ("weight", pa.float64()),
+                        ("path", pa.list_(pa.string()))])
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for chunk in _chunks(results):
+            writer.write_batch(pa.RecordBatch.from_pydict({
+                "source": [str(s) for s, _, _, _ in chunk],
+                "target": [str(t) for _, t, _, _ in chunk],
+                "weight": [w for _, _, _, w in chunk],
+                "path": [None if p is None else [str(node) for node in _path_nodes(s, p)] for s, _, p, _ in chunk],
+            }, schema=schema))
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    yield sink.getvalue()
+
+@blueprint.route("/paths", methods=["POST"])
+def paths():
+    body = _body()
+    queries = body.get("queries")
+    if not isinstance(queries, list) or not all(
+            isinstance(q, list) and len(q) == 2 and all(isinstance(n, (str, int, float)) for n in q) for q in queries):
+        raise BadRequest('"queries" must be a list of [source, target] pairs')
+    if len(queries) > MAX_QUERIES:
+        raise BadRequest(f"At most {MAX_QUERIES} queries per request, got {len(queries)}", 413)
+    graph = _graph(body)
+    fmt = _format(body)
+    if fmt == "arrow":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise BadRequest("Arrow output needs the optional pyarrow package", 406)
+    # Checked before the response starts, an error raised while streaming would cut it off
+    # after a 200 status
+    backend = body.get("backend", "auto")
+    try:
+        check_backend(graph, choose_backend(graph) if backend == "auto" else backend)
+    except ValueError as e:
+        raise BadRequest(str(e))
+    queries = [tuple(q) for q in queries]
+    results = solve(graph, queries, backend, bool(body.get("paths", fmt != "npy")), bool(body.get("cache", True)))
+    if fmt == "json":
+        stream = _json_stream(results, len(queries))
+    elif fmt == "ndjson":
+        stream = _ndjson_stream(results)
+    elif fmt == "csv":
+        stream = _csv_stream(results)
+    elif fmt == "npy":
+        stream = _npy_stream(results, len(queries))
+    else:
+        stream = _arrow_stream(results)
+
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if "gzip" in request.headers.get("Accept-Encoding", ""):
+        stream = gzip_stream(stream)
+        headers["Content-Encoding"] = "gzip"
+    return Response(stream, mimetype=FORMATS[fmt], headers=headers)
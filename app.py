@@ -1,20 +1,76 @@
+import os
+import re
+import time
+import functools
+import importlib
+from urllib.parse import parse_qs
 import dash
-from dash import dcc, html, Input, Output, State
-import networkx as nx
+from dash.exceptions import PreventUpdate
+from flask import Response, request, redirect, jsonify
+from dash import dcc, html, Input, Output, State, no_update
+import numpy as np
 import pandas as pd
 import dash_bootstrap_components as dbc
 from dash import dash_table
-from cyto_components import cytograph, csv_to_graph_elements
+from cyto_components import ROUTE_COLORS, cytograph, graph_elements, highlight_stylesheet, is_summarized
 # from solver import find_shortest_path_glpk
-from solver import find_shortest_path_ortools
+from solver import BACKEND_MODULES, CompiledGraph, shortest_path, all_pairs, load_backend, one_to_many
+from graph_cache import get_graph
+import graph_store
+from ingest import compile_edges
+import ch_index
+from alternatives import k_shortest_paths
+import dynamic_spt
+import metrics
+import api
+import export
+
+# Shortest path solves run as background jobs when the optional diskcache package is installed,
+# so a hard CP-SAT instance does not hold a web worker and can be cancelled from the page.
+# DiskcacheManager forks a process per job: the graph's persistent CP-SAT model and its solution
+# hints are copied in and discarded with the job, so every solve starts from the model as the web
+# worker last left it. SOLVER_BACKGROUND=0 solves in the web worker instead, keeping that state
+try:
+    import diskcache
+    background_callback_manager = None
+    if os.environ.get("SOLVER_BACKGROUND", "1") != "0":
+        background_callback_manager = dash.DiskcacheManager(
+            diskcache.Cache(os.environ.get("JOB_CACHE_DIR", "./cache")))
+except ImportError:
+    background_callback_manager = None
+
+# CP-SAT returns the best path found so far after SOLVER_MAX_TIME seconds
+SOLVER_MAX_TIME = float(os.environ.get("SOLVER_MAX_TIME", 60))
+SOLVER_WORKERS = int(os.environ["SOLVER_WORKERS"]) if "SOLVER_WORKERS" in os.environ else None
+# Most alternative routes one query may ask for
+MAX_ROUTES = 10
+# Edge table rows per page
+TABLE_PAGE_SIZE = 15
 
 # Initialize the Dash app
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
+app = dash.Dash(
+    __name__, external_stylesheets=[dbc.themes.BOOTSTRAP],
+    background_callback_manager=background_callback_manager,
+)
 server = app.server
+# Headless batch queries under /api
+server.register_blueprint(api.blueprint)
+# Streaming CSV downloads under /export
+server.register_blueprint(export.blueprint)
+
+# Example graphs are read on first click, then shared read-only ("replace" copies the arrays)
+EXAMPLES = {
+    "example_1": r"data/example_2_dg.csv",
+    "example_2": r"data/example_1_dg.csv",
+    "example_3": r"data/example_3_dg.csv",
+}
 
-example_1_df = pd.read_csv(r"data/example_2_dg.csv")
-example_2_df = pd.read_csv(r"data/example_1_dg.csv")
-example_3_df = pd.read_csv(r"data/example_3_dg.csv")
+@functools.cache
+def example_graph(name):
+    return CompiledGraph.from_df(pd.read_csv(EXAMPLES[name]))
+
+# Contraction hierarchies prebuilt with `python ch_index.py <edges.csv>`
+ch_index.load_indexes("indexes")
 
 app.layout = dbc.Container(
     [
@@ -105,6 +161,8 @@ app.layout = dbc.Container(
                     ],
                     style={"margin-bottom": "20px"},
                 ),
+                # Why the last edit did not change the graph
+                html.Div(id="graph-edit-message", style={"color": "#d9534f", "margin-bottom": "10px"}),
             ]
         ),
         dbc.Row(
@@ -133,8 +191,15 @@ app.layout = dbc.Container(
                                 ),
                             ],
                         ),
+                        # Large edge files are uploaded straight to the server
+                        html.A(
+                            "Upload edge file (csv, csv.gz, parquet)",
+                            href="/upload",
+                            style={"margin-left": "10px"},
+                        ),
+                        dcc.Location(id="url", refresh=False),
                         # Cytoscape graph
-                        html.Div(id="graph"),
+                        html.Div(cytograph([]), id="graph"),
                         # Shortest path
                         html.Div(
                             [
@@ -151,13 +216,87 @@ app.layout = dbc.Container(
                                 html.Button(
                                     "Find shortest path", id="shortest-path-btn"
                                 ),
+                                html.Button(
+                                    "Cancel", id="cancel-solve-btn", disabled=True
+                                ),
+                                html.Button(
+                                    "Distances from source", id="distance-overlay-btn"
+                                ),
                             ],
                             style={"display": "flex"},
                         ),
+                        # Optional path constraints
+                        html.Div(
+                            [
+                                dcc.Dropdown(
+                                    id="required-nodes",
+                                    multi=True,
+                                    placeholder="Via nodes",
+                                    style={"width": "200px"},
+                                ),
+                                dcc.Dropdown(
+                                    id="forbidden-nodes",
+                                    multi=True,
+                                    placeholder="Avoid nodes",
+                                    style={"width": "200px"},
+                                ),
+                                dcc.Input(
+                                    id="max-hops",
+                                    type="number",
+                                    min=1,
+                                    step=1,
+                                    placeholder="Max edges",
+                                    style={"width": "120px"},
+                                ),
+                                # Limits on the resource columns of the graph, e.g. "time=90, toll=5"
+                                dcc.Input(
+                                    id="budgets",
+                                    type="text",
+                                    placeholder="Budgets",
+                                    debounce=True,
+                                    style={"width": "200px"},
+                                ),
+                                # Alternative routes, drawn in distinct colors
+                                dcc.Input(
+                                    id="route-count",
+                                    type="number",
+                                    min=1,
+                                    max=MAX_ROUTES,
+                                    step=1,
+                                    placeholder="Routes",
+                                    style={"width": "100px"},
+                                ),
+                                dcc.Checklist(
+                                    id="diverse-routes",
+                                    options=[{"label": "Diverse", "value": "diverse"}],
+                                    value=[],
+                                    style={"margin-left": "5px"},
+                                ),
+                            ],
+                            style={"display": "flex", "margin-top": "5px"},
+                        ),
+                        # Intermediate solutions of a running solve
+                        html.Div(id="shortest-path-progress"),
                         # Shortest path result
                         html.Div(
                             id="shortest-path-result", style={"margin-top": "10px"}
                         ),
+                        # All-pairs distance matrix
+                        html.Div(
+                            [
+                                html.Button("Distance matrix", id="distance-matrix-btn"),
+                                # Streamed by the export routes, the href follows the graph session
+                                html.A(
+                                    html.Button("Download matrix CSV"),
+                                    id="distance-matrix-download-link", download="distance_matrix.csv",
+                                ),
+                            ],
+                            style={"display": "flex", "margin-top": "10px"},
+                        ),
+                        html.Div(
+                            id="distance-matrix-display",
+                            style={"overflow": "scroll", "margin-top": "10px"},
+                        ),
                         html.Div(
                             [
                                 html.Button("Methodology", id="open", n_clicks=0),
@@ -193,11 +332,29 @@ app.layout = dbc.Container(
                     [
                         # Csv table
                         html.Div(
+                            dash_table.DataTable(
+                                id="graph-data-table",
+                                columns=[
+                                    {"name": "source", "id": "source"},
+                                    {"name": "target", "id": "target"},
+                                    {"name": "weight", "id": "weight", "type": "numeric"},
+                                ],
+                                page_current=0,
+                                page_size=TABLE_PAGE_SIZE,
+                                page_action="custom",
+                                sort_action="custom",
+                                sort_mode="single",
+                                sort_by=[],
+                                filter_action="custom",
+                                filter_query="",
+                                style_table={"overflowX": "auto"},
+                            ),
                             id="graph-data-display",
                             style={"overflow": "scroll", "margin-bottom": "10px"},
                         ),
-                        html.Button("Download CSV", id="btn-download", n_clicks=0),
-                        dcc.Download(id="download-dataframe-csv"),
+                        html.A(
+                            html.Button("Download CSV"), id="graph-download-link", download="graph_data.csv"
+                        ),
                     ],
                     width=4,
                 ),
@@ -209,22 +366,42 @@ app.layout = dbc.Container(
             },
         ),
         # Modal structure
-        # Store to hold the graph data in CSV format
-        dcc.Store(id="graph-data-store", data=[]),
+        # The graph itself lives in a server-side session, the store only references it
+        dcc.Store(id="graph-data-store", data=None),
     ]
 )
 
 @app.callback(
-    Output("graph", "children"),
+    Output("cytoscape", "elements"),
+    Output("cytoscape", "layout"),
+    Output("cytoscape", "stylesheet"),
     Input("graph-data-store", "data"),
+    State("shortest-path-source", "value"),
+    State("shortest-path-target", "value"),
 )
-def update_graph_elements(data):
-    elements = csv_to_graph_elements(data)
-    return cytograph(elements)
+def update_graph_elements(data, source, target):
+    graph = get_graph(data)
+    elements, layout = graph_elements(graph, source, target)
+    return elements, layout or {"name": "circle"}, highlight_stylesheet(source, target)
 
 # Add node button
+def edit_graph(data, ops):
+    # (new store value, message) after applying ops to the store's session. The graph stays as
+    # it is when its session is gone (e.g. evicted, or a server restart with in-memory sessions)
+    # or the store rejects the edit (a duplicate edge or an unknown endpoint)
+    old_key = get_graph(data).key
+    try:
+        new_data = graph_store.edit(data, ops)
+    except KeyError:
+        return no_update, "This graph is no longer on the server, load or upload it again"
+    except ValueError as e:
+        return no_update, f"Edit rejected: {e}"
+    ch_index.carry_over(old_key, new_data)
+    return new_data, ""
+
 @app.callback(
     Output("graph-data-store", "data"),
+    Output("graph-edit-message", "children"),
     Input("add-node-button", "n_clicks"),
     State("node-input", "value"),
     State("graph-data-store", "data"),
@@ -232,13 +409,14 @@ def update_graph_elements(data):
 )
 def add_node(n_clicks, node, data):
     if n_clicks > 0 and node:
-        if node not in [entry["source"] for entry in data]:
-            data.append({"source": node, "target": None, "weight": None})
-    return data
+        if node not in get_graph(data).node_id:
+            return edit_graph(data, [("add_node", node)])
+    return data, no_update
 
 # Add edge button
 @app.callback(
     Output("graph-data-store", "data", allow_duplicate=True),
+    Output("graph-edit-message", "children", allow_duplicate=True),
     Input("add-edge-button", "n_clicks"),
     State("source-node-input", "value"),
     State("target-node-input", "value"),
@@ -249,12 +427,13 @@ def add_node(n_clicks, node, data):
 def add_edge(n_clicks, source, target, weight, data):
     if n_clicks > 0:
         if source and target and weight is not None:
-            data.append({"source": source, "target": target, "weight": weight})
-    return data
+            return edit_graph(data, [("add_edge", source, target, weight)])
+    return data, no_update
 
 # Remove node button
 @app.callback(
     Output("graph-data-store", "data", allow_duplicate=True),
+    Output("graph-edit-message", "children", allow_duplicate=True),
     Input("remove-node-button", "n_clicks"),
     State("node-list-remove", "value"),
     State("graph-data-store", "data"),
@@ -262,18 +441,13 @@ def add_edge(n_clicks, source, target, weight, data):
 )
 def remove_node(n_clicks, nodes_to_remove, data):
     if n_clicks > 0 and nodes_to_remove:
-        for node in nodes_to_remove:
-            if node in [entry["source"] for entry in data]:
-                data = [
-                    entry
-                    for entry in data
-                    if entry["source"] != node and entry["target"] != node
-                ]
-    return data
+        return edit_graph(data, [("remove_nodes", nodes_to_remove)])
+    return data, no_update
 
 # Remove edge button
 @app.callback(
     Output("graph-data-store", "data", allow_duplicate=True),
+    Output("graph-edit-message", "children", allow_duplicate=True),
     Input("remove-edge-button", "n_clicks"),
     State("edge-list-remove", "value"),
     State("graph-data-store", "data"),
@@ -281,17 +455,9 @@ def remove_node(n_clicks, nodes_to_remove, data):
 )
 def remove_edge(n_clicks, edges_to_remove, data):
     if n_clicks > 0 and edges_to_remove:
-        for edge in edges_to_remove:
-            source, target = edge.split("->")
-            if {"source": source, "target": target} in [
-                {"source": entry["source"], "target": entry["target"]} for entry in data
-            ]:
-                data = [
-                    entry
-                    for entry in data
-                    if not (entry["source"] == source and entry["target"] == target)
-                ]
-    return data
+        pairs = [edge.split("->") for edge in edges_to_remove]
+        return edit_graph(data, [("remove_edges", pairs)])
+    return data, no_update
 
 # Callback to update edge dropdown options
 @app.callback(
@@ -302,128 +468,453 @@ def remove_edge(n_clicks, edges_to_remove, data):
     Input("graph-data-store", "data"),
 )
 def update_dropdowns(data):
-    nodes = [entry["source"] for entry in data] + [
-        entry["target"] for entry in data if entry["target"]
-    ]
-    nodes = list(set(nodes))
-    nodes.sort()
-
-    edges = [
-        f"{entry['source']}->{entry['target']}" for entry in data if entry["target"]
-    ]
+    graph = get_graph(data)
+    nodes = graph.node_names
+    edges = graph.edge_names
     node_options = [{"label": n, "value": n} for n in nodes]
     edge_options = [{"label": e, "value": e} for e in edges]
     return node_options, node_options, edge_options, node_options
 
-# Callback to display graph data in a table
+# Filter operators of the DataTable query language, by name and symbol
+FILTER_OPERATORS = {
+    "ge": "ge", ">=": "ge", "le": "le", "<=": "le", "ne": "ne", "!=": "ne", "lt": "lt", "<": "lt",
+    "gt": "gt", ">": "gt", "eq": "eq", "=": "eq", "contains": "contains", "datestartswith": "datestartswith",
+}
+# "{column} operator value": the operator is the word or symbol right after the column, so a
+# value may contain operator words and symbols ({source} contains "Pine Bluff"). An "s" or "i"
+# before the operator asks for a case-sensitive or case-insensitive comparison
+FILTER_PART = re.compile(
+    r"^\{(.+?)\}\s+([si]?)(" + "|".join(re.escape(op) for op in sorted(FILTER_OPERATORS, key=len, reverse=True))
+    + r")\s+(.*)$"
+)
+
+def split_filter_part(part):
+    # "{weight} ge 100" or "{source} contains Hou" -> (column, operator, value), case-insensitive
+    # operators come back with their "i" prefix ("icontains")
+    match = FILTER_PART.match(part.strip())
+    if match is None:
+        return None, None, None
+    column, case, operator, value = match.groups()
+    operator = ("i" if case == "i" else "") + FILTER_OPERATORS[operator]
+    value = value.strip()
+    if len(value) > 1 and value[0] == value[-1] and value[0] in "'\"`":
+        value = value[1:-1].replace("\\" + value[0], value[0])
+    else:
+        try:
+            value = float(value)
+        except ValueError:
+            pass
+    return column, operator, value
+
+def filter_mask(df, filter_query):
+    # Rows matching every "&&" part of the query, parts that do not parse are ignored
+    mask = np.ones(len(df), dtype=bool)
+    for part in (filter_query or "").split(" && "):
+        column, operator, value = split_filter_part(part)
+        if column not in df.columns:
+            continue
+        values = df[column]
+        insensitive = operator.startswith("i")
+        operator = operator.removeprefix("i")
+        if operator in ("contains", "datestartswith"):
+            text, value = values.astype(str), str(value)
+            if insensitive:
+                text, value = text.str.lower(), value.lower()
+            mask &= (text.str.contains(value, regex=False) if operator == "contains"
+                     else text.str.startswith(value)).to_numpy()
+            continue
+        if isinstance(value, float):
+            values = pd.to_numeric(values, errors="coerce")
+        else:
+            values = values.astype(str)
+            if insensitive:
+                values, value = values.str.lower(), value.lower()
+        compare = {"eq": values.__eq__, "ne": values.__ne__, "lt": values.__lt__, "le": values.__le__,
+                   "gt": values.__gt__, "ge": values.__ge__}[operator]
+        mask &= compare(value).fillna(False).to_numpy(dtype=bool)
+    return mask
+
+# Callback to display graph data in a table: only the requested page is sent, sorted and
+# filtered on the server through the compiled graph's cached sort orders
 @app.callback(
-    Output("graph-data-display", "children"), Input("graph-data-store", "data")
+    Output("graph-data-table", "data"),
+    Output("graph-data-table", "page_count"),
+    Input("graph-data-store", "data"),
+    Input("graph-data-table", "page_current"),
+    Input("graph-data-table", "page_size"),
+    Input("graph-data-table", "sort_by"),
+    Input("graph-data-table", "filter_query"),
 )
-def display_graph_data(data):
+def display_graph_data(data, page_current=0, page_size=TABLE_PAGE_SIZE, sort_by=None, filter_query=""):
     if not data:
-        return None
-    df = pd.DataFrame(data)
-    return dash_table.DataTable(
-        data=df.to_dict("records"),
-        columns=[{"name": i, "id": i} for i in df.columns],
-        page_action="native",
-        page_size=15,
-        style_table={"overflowX": "auto"},
-        sort_action="native",  # Enable sorting
-    )
+        return [], 1
+    graph = get_graph(data)
+    df = graph.df
+    if sort_by:
+        rows = graph.sort_order(sort_by[0]["column_id"], sort_by[0]["direction"] == "desc")
+    else:
+        rows = np.arange(len(df))
+    if filter_query:
+        rows = rows[filter_mask(df, filter_query)[rows]]
+    page_size = page_size or TABLE_PAGE_SIZE
+    page_count = max(1, -(-len(rows) // page_size))
+    # A page past the end (e.g. after a delete or a narrower filter) shows the last page
+    start = min(page_current or 0, page_count - 1) * page_size
+    page = df.iloc[rows[start:start + page_size]]
+    return page.astype(object).where(page.notna(), None).to_dict("records"), page_count
 
-# Callback to handle CSV download
+# Point the download links at the streaming export of the current graph session
 @app.callback(
-    Output("download-dataframe-csv", "data"),
-    Input("btn-download", "n_clicks"),
-    State("graph-data-store", "data"),
-    prevent_initial_call=True,
+    Output("graph-download-link", "href"),
+    Output("distance-matrix-download-link", "href"),
+    Input("graph-data-store", "data"),
 )
-def download_csv(n_clicks, graph_data_store):
-    if n_clicks > 0:
-        df = pd.DataFrame(graph_data_store)
-        return dcc.send_data_frame(df.to_csv, "graph_data.csv", index=False)
+def download_links(data):
+    if not graph_store.is_session(data):
+        return None, None
+    # The version only keeps browsers from reusing the export of an earlier edit
+    query = f"?v={data['version']}"
+    return (f"/export/{data['session']}/edges.csv{query}",
+            f"/export/{data['session']}/distances.csv{query}")
 
 # Example
 @app.callback(
     Output("graph-data-store", "data", allow_duplicate=True),
     Input("example_1-btn", "n_clicks"),
+    State("graph-data-store", "data"),
     prevent_initial_call=True,
 )
-def example_1(n_clicks):
+def example_1(n_clicks, data):
     if n_clicks is not None and n_clicks > 0:
-        return example_1_df.to_dict("records")
-    return []
+        return graph_store.edit(data, [("replace", example_graph("example_1"))])
+    return data
 
 
 @app.callback(
     Output("graph-data-store", "data", allow_duplicate=True),
     Input("example_2-btn", "n_clicks"),
+    State("graph-data-store", "data"),
     prevent_initial_call=True,
 )
-def example_2(n_clicks):
+def example_2(n_clicks, data):
     if n_clicks is not None and n_clicks > 0:
-        return example_2_df.to_dict("records")
-    return []
+        return graph_store.edit(data, [("replace", example_graph("example_2"))])
+    return data
 
 @app.callback(
     Output("graph-data-store", "data", allow_duplicate=True),
     Input("example_3-btn", "n_clicks"),
+    State("graph-data-store", "data"),
     prevent_initial_call=True,
 )
-def example_3(n_clicks):
+def example_3(n_clicks, data):
     if n_clicks is not None and n_clicks > 0:
-        return example_3_df.to_dict("records")
-    return []
+        return graph_store.edit(data, [("replace", example_graph("example_3"))])
+    return data
 
 @app.callback(
     Output("shortest-path-source", "options"),
     Output("shortest-path-target", "options"),
+    Output("required-nodes", "options"),
+    Output("forbidden-nodes", "options"),
+    Output("budgets", "placeholder"),
     Input("graph-data-store", "data"),
 )
 def update_shortest_path_dropdowns(data):
-    nodes = [entry["source"] for entry in data] + [
-        entry["target"] for entry in data if entry["target"]
-    ]
-    nodes = list(set(nodes))
-    nodes.sort()
-    node_options = [{"label": n, "value": n} for n in nodes]
-    return node_options, node_options
+    graph = get_graph(data)
+    node_options = [{"label": n, "value": n} for n in graph.node_names]
+    # The placeholder names what can be budgeted
+    names = sorted(graph.resources) + ["weight"]
+    budgets = "Budgets, e.g. " + ", ".join(f"{name}=10" for name in names[:2])
+    return node_options, node_options, node_options, node_options, budgets
 
-# Change color when shortest path sorce and target are selected
+# Change color when shortest path sorce and target are selected. Only the stylesheet changes,
+# unless the graph is summarized and the selection changes which part of it is shown
 @app.callback(
-    Output("graph", "children", allow_duplicate=True),
+    Output("cytoscape", "stylesheet", allow_duplicate=True),
+    Output("cytoscape", "elements", allow_duplicate=True),
+    Output("cytoscape", "layout", allow_duplicate=True),
     Input("shortest-path-source", "value"),
     Input("shortest-path-target", "value"),
     State("graph-data-store", "data"),
     prevent_initial_call=True,
 )
 def update_shortest_path_color(source, target, data):
-    elements = csv_to_graph_elements(data, source, target)
-    return cytograph(elements)
+    return highlight(get_graph(data), source, target)
 
-# Find shortest path
+def highlight(graph, source=None, target=None, path=(), alternatives=()):
+    stylesheet = highlight_stylesheet(source, target, path, alternatives)
+    if not is_summarized(graph):
+        return stylesheet, no_update, no_update
+    shown = list(path or ()) + [edge for route in alternatives for edge in route]
+    elements, layout = graph_elements(graph, source, target, shown)
+    return stylesheet, elements, layout
+
+# Color nodes by their distance from the selected source, one search for all of them
 @app.callback(
-    Output("shortest-path-result", "children"),
-    Output("graph", "children", allow_duplicate=True),
-    Input("shortest-path-btn", "n_clicks"),
+    Output("shortest-path-result", "children", allow_duplicate=True),
+    Output("cytoscape", "stylesheet", allow_duplicate=True),
+    Output("cytoscape", "elements", allow_duplicate=True),
+    Output("cytoscape", "layout", allow_duplicate=True),
+    Input("distance-overlay-btn", "n_clicks"),
     State("shortest-path-source", "value"),
-    State("shortest-path-target", "value"),
     State("graph-data-store", "data"),
     prevent_initial_call=True,
 )
-def find_shortest_path(n_clicks, source, target, data):
+def distance_overlay(n_clicks, source, data):
+    graph = get_graph(data)
+    if source is None or source not in graph.node_id:
+        return "Select a source node first", no_update, no_update, no_update
+    try:
+        with metrics.timer("solve", backend="one_to_many"):
+            dist, _ = one_to_many(graph, source)
+    except ValueError as e:
+        return str(e), no_update, no_update, no_update
+    _, elements, layout = highlight(graph, source)
+    # Rules only for the nodes on screen, a summarized graph shows a few hundred of them
+    if elements is no_update:
+        shown = range(graph.n_nodes)
+    else:
+        shown = [graph.node_id[element["data"]["id"]] for element in elements if "source" not in element["data"]]
+    distances = {graph.labels[v]: dist[v].item() for v in shown if np.isfinite(dist[v])}
+    reachable = int(np.isfinite(dist).sum()) - 1
+    farthest = int(np.argmax(np.where(np.isfinite(dist), dist, -1)))
+    message = (
+        f"{reachable} nodes reachable from {source}, farthest {graph.labels[farthest]} at {dist[farthest]:g}"
+        if reachable else f"No node is reachable from {source}"
+    )
+    return message, highlight_stylesheet(source, distances=distances), elements, layout
+
+def find_routes(graph, source, target, count, diverse):
+    # Several routes at once, the first one is the shortest
+    stats = {}
+    start = time.perf_counter()
+    with metrics.timer("solve", backend="diverse" if diverse else "yen"):
+        routes = k_shortest_paths(graph, source, target, min(int(count), MAX_ROUTES), diverse=diverse, stats=stats)
+    if not routes:
+        raise ValueError(f"No path from {source} to {target}")
+    kind = "diverse routes" if diverse else "shortest routes"
+    message = html.Div(
+        [html.Div(f"{len(routes)} {kind} ({stats['searches']} searches, {(time.perf_counter() - start) * 1000:.1f} ms)")]
+        + [html.Div(f"{i + 1}. {path}, Total Weight: {weight}",
+                    style={"color": "red" if i == 0 else ROUTE_COLORS[(i - 1) % len(ROUTE_COLORS)]})
+           for i, (path, weight) in enumerate(routes)]
+    )
+    return message, highlight(graph, source, target, routes[0][0], [path for path, _ in routes[1:]])
+
+def parse_budgets(text):
+    # "time=90, toll<=5" -> {"time": 90.0, "toll": 5.0}; the backend checks the names
+    budgets = {}
+    for part in (text or "").split(","):
+        if not part.strip():
+            continue
+        name, _, value = part.partition("<=") if "<=" in part else part.partition("=")
+        try:
+            budgets[name.strip()] = float(value)
+        except ValueError:
+            raise ValueError(f"Budget {part.strip()} should look like name=number")
+    return budgets
+
+def solve_one(set_progress, graph, source, target, data, required, forbidden, max_hops, budgets=None):
+    # One path, optionally constrained
+    # path, weight = find_shortest_path_glpk(pd.DataFrame(data), source, target)
+    stats = {}
+    constraints = {"required": required or [], "forbidden": forbidden or [], "max_hops": max_hops,
+                   "budgets": parse_budgets(budgets)}
+    # Precomputed contraction hierarchy when there is one for this graph, otherwise the
+    # backend is picked automatically: graph searches for non-negative weights, the network
+    # simplex otherwise (an error with negative cycles), labeling or CP-SAT with constraints
+    backend = "ch" if ch_index.has_index(graph) and not any(constraints.values()) else "auto"
+    # Edited sessions repair the shortest path tree of the source instead of starting over
+    result = None
+    if backend != "ch" and not any(constraints.values()):
+        result = dynamic_spt.shortest_path(data, graph, source, target, stats)
+    on_solution = None if set_progress is None else (
+        lambda objective, bound: set_progress(f"Best path so far: weight {objective:g}, lower bound {bound:g}"))
+    if result is None:
+        result = shortest_path(
+            graph, source, target, backend=backend, stats=stats,
+            max_time=SOLVER_MAX_TIME, workers=SOLVER_WORKERS, on_solution=on_solution, **constraints,
+        )
+    path, weight = result
+    if path is None:
+        raise ValueError(f"No path from {source} to {target}")
+    message = (
+        f"Shortest Path: {path}, Total Weight: {weight} "
+        f"({stats['backend']}: build {stats['build_time'] * 1000:.1f} ms, "
+        f"solve {stats['solve_time'] * 1000:.1f} ms)"
+    )
+    if "reduction" in stats:
+        message += (
+            f", preprocessing removed {stats['reduction']['variables_removed']} variables and "
+            f"{stats['reduction']['constraints_removed']} constraints"
+        )
+    if "fallback" in stats:
+        message += f", solved by CP-SAT ({stats['fallback']})"
+    if stats.get("status") == "FEASIBLE":
+        message += f", time limit reached, optimality gap {stats['gap']:.1%}"
+    return message, highlight(graph, source, target, path)
+
+# Find shortest path
+def find_shortest_path(set_progress, n_clicks, source, target, data, required=None, forbidden=None, max_hops=None,
+                       route_count=None, diverse=None, budgets=None):
+    graph = get_graph(data)
     if n_clicks is not None and n_clicks > 0:
         try:
-            # path, weight = find_shortest_path_glpk(pd.DataFrame(data), source, target)
-            path, weight = find_shortest_path_ortools(pd.DataFrame(data), source, target)
-            message = f"Shortest Path: {path}, Total Weight: {weight}"
-            graph_elelements = csv_to_graph_elements(data, source, target, path)
+            if route_count and route_count > 1 and not (required or forbidden or max_hops or budgets):
+                message, graph_highlight = find_routes(graph, source, target, route_count, bool(diverse))
+            else:
+                message, graph_highlight = solve_one(set_progress, graph, source, target, data, required, forbidden,
+                                                     max_hops, budgets)
+        except ValueError as e:
+            # Bad budgets or waypoints, no path, or a graph the backend cannot solve
+            message = str(e)
+            graph_highlight = highlight(graph)
         except Exception as e:
             message = "No path found"
-            graph_elelements = csv_to_graph_elements(data)
-        return message, cytograph(graph_elelements)
-    return "", cytograph(csv_to_graph_elements(data))
+            graph_highlight = highlight(graph)
+        if set_progress is not None:
+            # Background jobs run in their own process, publish its solver metrics before it exits
+            set_progress("")
+            metrics.flush()
+        return (message, *graph_highlight)
+    return ("", *highlight(graph))
+
+shortest_path_dependencies = [
+    Output("shortest-path-result", "children"),
+    Output("cytoscape", "stylesheet", allow_duplicate=True),
+    Output("cytoscape", "elements", allow_duplicate=True),
+    Output("cytoscape", "layout", allow_duplicate=True),
+    Input("shortest-path-btn", "n_clicks"),
+    State("shortest-path-source", "value"),
+    State("shortest-path-target", "value"),
+    State("graph-data-store", "data"),
+    State("required-nodes", "value"),
+    State("forbidden-nodes", "value"),
+    State("max-hops", "value"),
+    State("route-count", "value"),
+    State("diverse-routes", "value"),
+    State("budgets", "value"),
+]
+if background_callback_manager is not None:
+    app.callback(
+        *shortest_path_dependencies,
+        background=True,
+        progress=[Output("shortest-path-progress", "children")],
+        cancel=[Input("cancel-solve-btn", "n_clicks")],
+        running=[
+            (Output("shortest-path-btn", "disabled"), True, False),
+            (Output("cancel-solve-btn", "disabled"), False, True),
+        ],
+        prevent_initial_call=True,
+    )(find_shortest_path)
+else:
+    # Without a job queue the solve runs inside the request, still bounded by SOLVER_MAX_TIME
+    @app.callback(*shortest_path_dependencies, prevent_initial_call=True)
+    def find_shortest_path_sync(*args):
+        return find_shortest_path(None, *args)
+
+# Larger graphs would not fit a dense matrix in the browser
+MAX_MATRIX_NODES = 500
+
+def distance_matrix_df(graph):
+    # In this thread: the graph is small, and a process pool inside a threaded web worker would
+    # fork it and keep a process per core idle in every worker
+    dist = all_pairs(graph, workers=1)
+    df = pd.DataFrame(dist, index=graph.labels, columns=graph.labels)
+    df = df.loc[graph.node_names, graph.node_names].replace(float("inf"), None)
+    return df.rename_axis("source").reset_index()
+
+# Show all-pairs distances
+@app.callback(
+    Output("distance-matrix-display", "children"),
+    Input("distance-matrix-btn", "n_clicks"),
+    State("graph-data-store", "data"),
+    prevent_initial_call=True,
+)
+def display_distance_matrix(n_clicks, data):
+    graph = get_graph(data)
+    if graph.n_nodes > MAX_MATRIX_NODES:
+        return f"Distance matrix is limited to {MAX_MATRIX_NODES} nodes, download it instead"
+    try:
+        df = distance_matrix_df(graph)
+    except ValueError as e:
+        return str(e)
+    return dash_table.DataTable(
+        data=df.to_dict("records"),
+        columns=[{"name": str(i), "id": str(i)} for i in df.columns],
+        page_action="native",
+        page_size=15,
+        style_table={"overflowX": "auto"},
+    )
+
+UPLOAD_FORM = """<!doctype html>
+<title>Upload edge file</title>
+<form method="post" enctype="multipart/form-data">
+  <input type="file" name="file" accept=".csv,.gz,.parquet,.pq">
+  <button type="submit">Upload</button>
+</form>
+<p>Columns: source, target, weight, and optional numeric resource columns (e.g. time, toll)</p>
+"""
+
+# Stream an uploaded edge file into a server-side graph. Browsers post the form and are sent back
+# to the app with ?graph=<handle>; scripts can post the raw file body and get the handle as JSON
+@server.route("/upload", methods=["GET", "POST"])
+def upload_edges():
+    if request.method == "GET":
+        return UPLOAD_FORM
+    try:
+        if "file" in request.files:
+            upload = request.files["file"]
+            graph = compile_edges(upload.stream, fmt=_upload_format(upload.filename))
+        else:
+            graph = compile_edges(request.stream, fmt=_upload_format(request.args.get("filename", "")))
+    except (ValueError, KeyError) as e:
+        return jsonify(error=str(e)), 400
+    handle = graph_store.edit(None, [("replace", graph)])["session"]
+    if "file" in request.files:
+        return redirect(f"/?graph={handle}")
+    return jsonify(handle=handle, nodes=graph.n_nodes, edges=graph.n_edges)
+
+def _upload_format(filename):
+    if filename.endswith((".parquet", ".pq")):
+        return "parquet"
+    return "csv.gz" if filename.endswith(".gz") else "csv"
+
+# Per-callback latency and response size, phase timers are recorded by the modules themselves
+@server.before_request
+def start_request_metrics():
+    metrics.begin_request()
+
+@server.after_request
+def record_request_metrics(response):
+    if request.path != "/metrics":
+        size = 0 if response.direct_passthrough else response.calculate_content_length() or 0
+        metrics.end_request(_callback_name(), size)
+    return response
+
+def _callback_name():
+    # First output of a Dash callback ("graph-data-store.data"), otherwise the route
+    if request.path.endswith("_dash-update-component"):
+        output = (request.get_json(silent=True) or {}).get("output", "")
+        return output.strip(".").split("...")[0].split("@")[0]
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+@server.route("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+# Load an uploaded graph into the store by handle
+@app.callback(
+    Output("graph-data-store", "data", allow_duplicate=True),
+    Input("url", "search"),
+    prevent_initial_call="initial_duplicate",
+)
+def load_uploaded_graph(search):
+    handle = parse_qs((search or "").lstrip("?")).get("graph", [None])[0]
+    if handle is None or graph_store.sessions.version(handle) is None:
+        raise PreventUpdate
+    return graph_store.session_state(handle)
 
 # Callback to toggle the modal
 @app.callback(
@@ -437,5 +928,22 @@ def toggle_modal(n1, n2, is_open):
         return not is_open
     return is_open
 
+def warm():
+    # Load what every worker would otherwise load on its first requests: the parsed example graphs
+    # (an example click copies one into a session, callbacks then read the session's compiled
+    # graph) and the modules of the lazily imported backends. Run in the gunicorn master with
+    # preload (see gunicorn.conf.py), forked workers share the result
+    for name in EXAMPLES:
+        example_graph(name)
+    for backend in BACKEND_MODULES:
+        load_backend(backend)
+    # Loaded only so the solvers' first use in a worker finds them imported
+    for module in ("ortools.sat.python.cp_model", "ortools.graph.python.min_cost_flow"):
+        importlib.import_module(module)
+
 if __name__ == "__main__":
+    from werkzeug.serving import WSGIRequestHandler
+
+    # Keep-alive for API clients, the development server closes every connection otherwise
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
     app.run_server(debug=False)
@@ -0,0 +1,69 @@
+import numpy as np
+
+from solver import CompiledGraph
+
+# Reproducible synthetic graphs of roughly n_edges edges. Same (n_edges, seed), same graph.
+# Node labels are "n0", "n1", ... and weights are integers, like the example CSVs
+
+def _graph(n_nodes, src, dst, weight):
+    # Drop self loops and repeated (source, target) pairs, the app's graph sessions reject both
+    keep = src != dst
+    src, dst, weight = src[keep], dst[keep], weight[keep]
+    _, first = np.unique(src.astype(np.int64) * n_nodes + dst, return_index=True)
+    first.sort()
+    labels = np.empty(n_nodes, dtype=object)
+    labels[:] = [f"n{i}" for i in range(n_nodes)]
+    return CompiledGraph(labels, src[first].astype(np.int32), dst[first].astype(np.int32),
+                         weight[first].astype(np.int64))
+
+def grid(n_edges, seed=0):
+    # Road-network-like grid: 4-neighbour streets in both directions with random lengths
+    rng = np.random.default_rng(seed)
+    side = max(2, int(np.sqrt(n_edges / 4)))
+    node = np.arange(side * side).reshape(side, side)
+    right = np.stack([node[:, :-1].ravel(), node[:, 1:].ravel()])
+    down = np.stack([node[:-1, :].ravel(), node[1:, :].ravel()])
+    pairs = np.concatenate([right, down], axis=1)
+    src = np.concatenate([pairs[0], pairs[1]])
+    dst = np.concatenate([pairs[1], pairs[0]])
+    length = rng.integers(1, 100, pairs.shape[1])
+    return _graph(side * side, src, dst, np.concatenate([length, length]))
+
+def geometric(n_edges, seed=0, degree=8):
+    # Random geometric graph: points in the unit square joined to nearby points, weight is the
+    # scaled euclidean distance. Points are bucketed into cells in row-major order; every point
+    # links to the next points of its row of cells and to the points of the row of cells below
+    rng = np.random.default_rng(seed)
+    n = max(2, n_edges // degree)
+    xy = rng.random((n, 2))
+    cells = max(1, int(np.sqrt(n / 4)))
+    cx = np.minimum((xy[:, 0] * cells).astype(np.int64), cells - 1)
+    cy = np.minimum((xy[:, 1] * cells).astype(np.int64), cells - 1)
+    cell = cy * cells + cx
+    order = np.lexsort((xy[:, 0], cell))
+    xy, cell = xy[order], cell[order]
+
+    k = degree // 4
+    ids = np.arange(n)
+    below = np.searchsorted(cell, cell + cells)
+    src, dst = [], []
+    for j in range(1, k + 1):
+        for other in (ids + j, below + j - 1):
+            valid = other < n
+            src.append(ids[valid])
+            dst.append(other[valid])
+    src, dst = np.concatenate(src), np.concatenate(dst)
+    length = np.ceil(np.hypot(*(xy[src] - xy[dst]).T) * 1000).astype(np.int64) + 1
+    return _graph(n, np.concatenate([src, dst]), np.concatenate([dst, src]), np.concatenate([length, length]))
+
+def scale_free(n_edges, seed=0, degree=8, exponent=2.5):
+    # Chung-Lu graph with a power-law degree distribution (hubs with many edges, most nodes with few)
+    rng = np.random.default_rng(seed)
+    n = max(2, n_edges // degree)
+    p = (np.arange(1, n + 1) ** (-1 / (exponent - 1)))
+    p /= p.sum()
+    src = rng.choice(n, n_edges, p=p)
+    dst = rng.choice(n, n_edges, p=p)
+    return _graph(n, src, dst, rng.integers(1, 100, n_edges))
+
+GENERATORS = {"grid": grid, "geometric": geometric, "scale_free": scale_free}
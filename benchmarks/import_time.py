@@ -0,0 +1,58 @@
+import os
+import sys
+import argparse
+import subprocess
+
+# Cold import check: python benchmarks/import_time.py. Imports the app in fresh interpreters,
+# prints the slowest modules and exits with 1 when the best import time is over the budget or a
+# module that should load lazily was imported
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Seconds, measured on the machine that checks it
+BUDGET = 2.0
+# Loaded on first use only
+LAZY_MODULES = ("ortools", "networkx", "constrained")
+
+def import_once(module):
+    # Per-module self and cumulative microseconds from -X importtime, plus the loaded top-level packages
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c",
+         f"import sys, {module}; print(','.join(sorted({{name.split('.')[0] for name in sys.modules}})))"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+        env={**os.environ, "METRICS_DIR": ""},
+    )
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        timings.append((int(cumulative), int(own), name.strip()))
+    loaded = set(result.stdout.strip().splitlines()[-1].split(","))
+    return timings, loaded
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the cold import time of the app")
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--budget", type=float, default=BUDGET, help="seconds")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    runs = [import_once(args.module) for _ in range(args.repeat)]
+    timings, loaded = min(runs, key=lambda run: next(t for t in run[0] if t[2] == args.module)[0])
+    total = next(t for t in timings if t[2] == args.module)[0] / 1e6
+    for cumulative, own, name in sorted(timings, reverse=True)[:args.top]:
+        print(f"  {name:50s} {cumulative / 1000:9.1f} ms  (self {own / 1000:.1f} ms)")
+    print(f"import {args.module}: {total:.3f} s, budget {args.budget:.3f} s")
+
+    failed = False
+    if total > args.budget:
+        print("OVER BUDGET")
+        failed = True
+    for name in sorted(loaded & set(LAZY_MODULES)):
+        print(f"EAGER IMPORT {name}")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import os
+import sys
+import gzip
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Load test for the headless API: python benchmarks/load_client.py --local. Sends batches of
+# random queries to /api/paths over keep-alive connections (one per client thread) and prints the
+# p50/p99 request latency, requests and queries per second. Without --handle a generated graph is
+# uploaded first; --local serves the app in this process instead of using --url
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import numpy as np
+import requests
+
+from benchmarks.generators import GENERATORS
+
+def serve_locally():
+    import logging
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    import app
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
+    server = make_server("127.0.0.1", 0, app.server, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+def upload(url, graph):
+    lines = ["source,target,weight"] + [
+        f"{graph.labels[s]},{graph.labels[t]},{w}" for s, t, w in zip(graph.src, graph.dst, graph.weight)
+    ]
+    response = requests.post(f"{url}/upload", data="\n".join(lines).encode())
+    response.raise_for_status()
+    return response.json()["handle"]
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) * 1000 if values else float("nan")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure latency and throughput of /api/paths")
+    parser.add_argument("--url", default="http://127.0.0.1:8050")
+    parser.add_argument("--local", action="store_true", help="serve the app in this process")
+    parser.add_argument("--handle", help="graph handle from /upload, default uploads a generated graph")
+    parser.add_argument("--generator", choices=sorted(GENERATORS), default="grid")
+    parser.add_argument("--size", type=float, default=1e4, help="edges of the generated graph")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=16, help="queries per request")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--format", default="json", choices=["json", "ndjson", "npy", "arrow"])
+    parser.add_argument("--no-paths", action="store_true", help="ask for weights only")
+    parser.add_argument("--gzip", action="store_true", help="gzip request and response bodies")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    url = serve_locally() if args.local else args.url.rstrip("/")
+    graph = GENERATORS[args.generator](int(args.size), seed=args.seed)
+    handle = args.handle or upload(url, graph)
+    labels = graph.labels.tolist()
+    rng = np.random.default_rng(args.seed)
+    batches = [
+        [[labels[s], labels[t]] for s, t in rng.integers(0, len(labels), (args.queries, 2))]
+        for _ in range(args.requests)
+    ]
+
+    sessions = threading.local()
+    headers = {"Content-Type": "application/json", "Accept-Encoding": "gzip" if args.gzip else "identity"}
+    if args.gzip:
+        headers["Content-Encoding"] = "gzip"
+
+    def send(queries):
+        session = getattr(sessions, "session", None)
+        if session is None:
+            session = sessions.session = requests.Session()
+        body = json.dumps({"graph": handle, "queries": queries, "format": args.format,
+                           "paths": not args.no_paths}).encode()
+        start = time.perf_counter()
+        response = session.post(f"{url}/api/paths", data=gzip.compress(body) if args.gzip else body,
+                                headers=headers)
+        response.raise_for_status()
+        response.content
+        return time.perf_counter() - start
+
+    send(batches[0])  # warm the compiled graph and the connection
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        latencies = list(pool.map(send, batches))
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.requests} requests x {args.queries} queries, {args.concurrency} clients, {args.format}"
+          f"{' gzip' if args.gzip else ''}, graph {graph.n_nodes} nodes / {graph.n_edges} edges")
+    print(f"  latency p50 {percentile(latencies, 50):.1f} ms  p99 {percentile(latencies, 99):.1f} ms")
+    print(f"  {args.requests / elapsed:.1f} requests/s  {args.requests * args.queries / elapsed:.1f} queries/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import tracemalloc
+
+# Run from anywhere: python benchmarks/run.py --sizes 1e3,1e4,1e5. Exits with 1 when a case is
+# slower or uses more memory than benchmarks/baseline.json allows
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import numpy as np
+import ortools
+from plotly.io.json import to_json_plotly
+
+import app
+from alternatives import k_shortest_paths
+import constrained  # registers the constrained path backends
+import graph_store
+from ch_index import CHIndex
+from cyto_components import csv_to_graph_elements, graph_elements
+from export import edges_csv
+from graph_cache import get_graph
+from solver import (
+    BACKENDS, CONSTRAINED_BACKENDS, dijkstra_tree, find_shortest_path_ortools, nearest_facility, one_to_many,
+    shortest_path,
+)
+from benchmarks.generators import GENERATORS
+
+BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+# Largest graph (edges) each case runs on, beyond it a single run takes minutes
+LIMITS = {
+    "ortools_build": 10_000, "ortools_solve": 10_000, "ch_build": 10_000, "ch_query": 10_000,
+    "constrained_cpsat": 1_000,
+    "csv_to_graph_elements": 100_000, "callback_display_graph_data": 1_000_000,
+}
+# Differences below this many seconds (or bytes) are noise, never a regression
+MIN_DELTA = {"seconds": 0.002, "peak_mb": 1.0}
+
+class Context:
+    # One generated graph with a hard query (source to its farthest reachable node)
+    def __init__(self, graph):
+        self.graph = graph
+        dist, _ = dijkstra_tree(graph, 0)
+        reachable = np.where(np.isfinite(dist), dist, -1)
+        self.source = graph.labels[0]
+        self.target = graph.labels[int(np.argmax(reachable))]
+        self.path, _ = shortest_path(graph, self.source, self.target, use_cache=False)
+        # Constrained query: avoid the middle of the shortest path within a few more edges than it has
+        self.constraints = {"forbidden": [self.path[len(self.path) // 2][0]], "max_hops": len(self.path) + 4}
+        self.data = graph_store.edit(None, [("replace", graph)])
+        get_graph(self.data)
+        self.index = None
+        self.edited = None
+        self.added = 0
+
+    def ch(self):
+        if self.index is None:
+            self.index = CHIndex.build(self.graph)
+        return self.index
+
+    def add_node(self):
+        # Edits go to a session of their own, the other cases keep seeing the generated graph
+        if self.edited is None:
+            self.edited = graph_store.edit(None, [("replace", self.graph)])
+        self.added += 1
+        self.edited, _ = app.add_node(1, f"bench-{self.added}", self.edited)
+
+def _ortools(ctx, phase):
+    stats = {}
+    find_shortest_path_ortools(ctx.graph.df, ctx.source, ctx.target, stats)
+    return stats[phase]
+
+def _callback(name):
+    def run(ctx):
+        to_json_plotly(getattr(app, name)(ctx.data, *([None, None] if name == "update_graph_elements" else [])))
+    return run
+
+def cases():
+    # name -> function(ctx). A function may return its own phase time instead of being timed whole
+    found = {
+        "ortools_build": lambda ctx: _ortools(ctx, "build_time"),
+        "ortools_solve": lambda ctx: _ortools(ctx, "solve_time"),
+        "ch_build": lambda ctx: CHIndex.build(ctx.graph),
+        "ch_query": lambda ctx: ctx.ch().query(ctx.source, ctx.target),
+        "csv_to_graph_elements": lambda ctx: csv_to_graph_elements(
+            ctx.graph.records, ctx.source, ctx.target, ctx.path),
+        "graph_elements": lambda ctx: graph_elements(ctx.graph, ctx.source, ctx.target, ctx.path),
+        "store_replace": lambda ctx: graph_store.edit(None, [("replace", ctx.graph)]),
+        "store_compile": lambda ctx: graph_store.sessions.compile(ctx.data["session"]),
+        "callback_add_node": lambda ctx: ctx.add_node(),
+        # Streamed download, peak memory should not grow with the graph
+        "export_edges_csv": lambda ctx: sum(len(part) for part in edges_csv(ctx.graph)),
+    }
+    for backend in BACKENDS:
+        if backend not in ("ortools", "ch") and backend not in CONSTRAINED_BACKENDS:
+            found[f"backend_{backend}"] = (
+                lambda ctx, backend=backend: shortest_path(ctx.graph, ctx.source, ctx.target, backend=backend,
+                                                           use_cache=False))
+    for backend in ("labeling", "cpsat"):
+        found[f"constrained_{backend}"] = (
+            lambda ctx, backend=backend: shortest_path(ctx.graph, ctx.source, ctx.target, backend=backend,
+                                                       **ctx.constraints))
+    found["k_shortest_10"] = lambda ctx: k_shortest_paths(ctx.graph, ctx.source, ctx.target, 10)
+    found["k_diverse_10"] = lambda ctx: k_shortest_paths(ctx.graph, ctx.source, ctx.target, 10, diverse=True)
+    found["one_to_many"] = lambda ctx: one_to_many(ctx.graph, ctx.source)
+    found["nearest_facility_16"] = lambda ctx: nearest_facility(
+        ctx.graph, ctx.graph.labels[::max(1, ctx.graph.n_nodes // 16)])
+    for name in ("update_graph_elements", "update_dropdowns", "display_graph_data"):
+        found[f"callback_{name}"] = _callback(name)
+    return found
+
+def measure(func, ctx, repeat):
+    # Best and median wall time over repeat runs, then one more run under tracemalloc for the
+    # Python-side peak (numpy buffers included, memory inside CP-SAT is not seen)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        phase = func(ctx)
+        elapsed = time.perf_counter() - start
+        times.append(phase if isinstance(phase, float) else elapsed)
+    tracemalloc.start()
+    func(ctx)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": min(times), "median_seconds": statistics.median(times), "peak_mb": peak / 2**20}
+
+def run(generators, sizes, repeat, only=None):
+    results = {}
+    for name in generators:
+        for size in sizes:
+            graph = GENERATORS[name](size)
+            ctx = Context(graph)
+            print(f"{name} {size}: {graph.n_nodes} nodes, {graph.n_edges} edges", flush=True)
+            for case, func in cases().items():
+                if (only and case not in only) or size > LIMITS.get(case, float("inf")):
+                    continue
+                if case == "ch_query":
+                    ctx.ch()
+                result = measure(func, ctx, repeat)
+                result.update(nodes=graph.n_nodes, edges=graph.n_edges)
+                results[f"{name}/{size}/{case}"] = result
+                print(f"  {case:32s} {result['seconds'] * 1000:10.2f} ms {result['peak_mb']:10.1f} MB", flush=True)
+    return results
+
+def compare(results, baseline, tolerance):
+    # Cases slower or hungrier than baseline * (1 + tolerance), cases missing from the baseline pass
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for metric, delta in MIN_DELTA.items():
+            if result[metric] > base[metric] * (1 + tolerance) and result[metric] - base[metric] > delta:
+                regressions.append(f"{key} {metric}: {base[metric]:.4f} -> {result[metric]:.4f}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark solver backends, element generation and store callbacks")
+    parser.add_argument("--generators", default=",".join(GENERATORS))
+    parser.add_argument("--sizes", default="1e3,1e4", help="approximate edge counts, up to 1e7")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cases", default=None, help="comma separated case names, all by default")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    sizes = [int(float(size)) for size in args.sizes.split(",")]
+    only = set(args.cases.split(",")) if args.cases else None
+    results = run(args.generators.split(","), sizes, args.repeat, only)
+    meta = {
+        "python": platform.python_version(), "numpy": np.__version__, "ortools": ortools.__version__,
+        "machine": platform.machine(), "processor": platform.processor(), "cpus": os.cpu_count(),
+    }
+    with open(args.output, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=1)
+    print(f"Wrote {args.output}")
+
+    if args.update_baseline:
+        # Timings are machine specific, refresh the baseline on the machine that checks it
+        with open(args.baseline, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=1)
+        print(f"Updated {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+import os
+import sys
+import glob
+import heapq
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from graph_cache import get_graph
+from ingest import graph_key
+from solver import CompiledGraph, register_backend
+
+# Number of nodes a witness search may settle before a shortcut is added anyway
+WITNESS_LIMIT = 64
+# Number of indexes kept in memory
+MAX_INDEXES = 8
+
+def _csr(tails, heads, weights, n_nodes):
+    # Plain-list CSR adjacency (offsets, heads, weights) grouped by tail
+    order = np.argsort(tails, kind="stable")
+    ptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tails, minlength=n_nodes), out=ptr[1:])
+    return ptr.tolist(), heads[order].tolist(), weights[order].tolist()
+
+def _witness_search(out, source, avoid, max_dist):
+    # Bounded Dijkstra from source that skips the node being contracted
+    dist = {source: 0.0}
+    heap = [(0.0, source)]
+    settled = 0
+    while heap and settled < WITNESS_LIMIT:
+        d, u = heapq.heappop(heap)
+        if d > dist[u]:
+            continue
+        if d > max_dist:
+            break
+        settled += 1
+        for v, (w, _) in out[u].items():
+            if v == avoid:
+                continue
+            nd = d + w
+            if nd < dist.get(v, float("inf")):
+                dist[v] = nd
+                heapq.heappush(heap, (nd, v))
+    return dist
+
+def _shortcuts(out, inc, node):
+    # Shortcuts (u, w, weight) needed to keep distances exact once node is removed
+    shortcuts = []
+    if not inc[node] or not out[node]:
+        return shortcuts
+    max_out = max(w for w, _ in out[node].values())
+    for u, (w_in, _) in inc[node].items():
+        dist = _witness_search(out, u, node, w_in + max_out)
+        for w, (w_out, _) in out[node].items():
+            if w == u:
+                continue
+            weight = w_in + w_out
+            if dist.get(w, float("inf")) > weight:
+                shortcuts.append((u, w, weight))
+    return shortcuts
+
+class CHIndex:
+    # Contraction hierarchy of one graph. Every edge, original or shortcut, is kept once with the
+    # contracted node it bypasses (mid, -1 for original edges) so paths can be unpacked
+    def __init__(self, key, labels, rank, tails, heads, weights, mids):
+        self.key = key
+        self.labels = labels
+        self.node_id = {label: i for i, label in enumerate(labels)}
+        self.rank = rank
+        self.tails, self.heads, self.weights, self.mids = tails, heads, weights, mids
+        n = len(labels)
+
+        # Forward searches climb edges u->w with rank[w] > rank[u], backward searches climb edges
+        # u->w with rank[u] > rank[w] from their head
+        upward = rank[tails] < rank[heads]
+        self.up = _csr(tails[upward], heads[upward], weights[upward], n)
+        self.down = _csr(heads[~upward], tails[~upward], weights[~upward], n)
+        self.edges = {
+            (u, w): (weight, mid)
+            for u, w, weight, mid in zip(tails.tolist(), heads.tolist(), weights.tolist(), mids.tolist())
+        }
+
+    @classmethod
+    def build(cls, graph, order=None):
+        # order: node labels in contraction order, e.g. from a previous index of the same graph.
+        # Without it nodes are contracted by edge difference with lazy priority updates
+        if graph.has_negative_weights:
+            raise ValueError("Contraction hierarchies need non-negative edge weights")
+        n = graph.n_nodes
+
+        # Keep the lightest of parallel edges, self loops never lie on a shortest path
+        out = [dict() for _ in range(n)]
+        inc = [dict() for _ in range(n)]
+        for u, v, w in zip(graph.src.tolist(), graph.dst.tolist(), graph.weight.tolist()):
+            if u != v and w < out[u].get(v, (float("inf"),))[0]:
+                out[u][v] = (w, -1)
+                inc[v][u] = (w, -1)
+
+        deleted_neighbors = [0] * n
+
+        def priority(node):
+            removed = len(inc[node]) + len(out[node])
+            return len(_shortcuts(out, inc, node)) - removed + deleted_neighbors[node]
+
+        if order is None:
+            heap = [(priority(node), node) for node in range(n)]
+            heapq.heapify(heap)
+        else:
+            # Nodes the previous order does not know yet are contracted last
+            known = [graph.node_id[label] for label in order if label in graph.node_id]
+            rest = sorted(set(range(n)) - set(known))
+            heap = [(i, node) for i, node in enumerate(known + rest)]
+
+        rank = np.zeros(n, dtype=np.int64)
+        tails, heads, weights, mids = [], [], [], []
+        contracted = 0
+        while heap:
+            prio, node = heapq.heappop(heap)
+            if order is None and heap:
+                # Lazy update: re-queue the node if its priority got worse than the next candidate
+                current = priority(node)
+                if current > heap[0][0]:
+                    heapq.heappush(heap, (current, node))
+                    continue
+            shortcuts = _shortcuts(out, inc, node)
+
+            # Edges of the contracted node stay in the hierarchy, pointing to higher ranks
+            rank[node] = contracted
+            contracted += 1
+            for v, (w, mid) in out[node].items():
+                tails.append(node), heads.append(v), weights.append(w), mids.append(mid)
+                del inc[v][node]
+                deleted_neighbors[v] += 1
+            for u, (w, mid) in inc[node].items():
+                tails.append(u), heads.append(node), weights.append(w), mids.append(mid)
+                del out[u][node]
+                deleted_neighbors[u] += 1
+            out[node], inc[node] = {}, {}
+            for u, w, weight in shortcuts:
+                if weight < out[u].get(w, (float("inf"),))[0]:
+                    out[u][w] = (weight, node)
+                    inc[w][u] = (weight, node)
+
+        return cls(
+            graph.key, graph.labels, rank, np.array(tails, dtype=np.int64), np.array(heads, dtype=np.int64),
+            np.array(weights, dtype=np.float64), np.array(mids, dtype=np.int64),
+        )
+
+    @property
+    def order(self):
+        return self.labels[np.argsort(self.rank)]
+
+    def save(self, path):
+        numeric = all(isinstance(label, (int, np.integer)) for label in self.labels)
+        np.savez_compressed(
+            path, key=np.array(self.key or ""), labels=np.asarray(self.labels, dtype=str),
+            numeric=np.array(numeric), rank=self.rank, tails=self.tails, heads=self.heads,
+            weights=self.weights, mids=self.mids,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            labels = f["labels"].astype(np.int64) if f["numeric"] else f["labels"]
+            return cls(
+                str(f["key"]) or None, np.asarray(labels.tolist(), dtype=object), f["rank"],
+                f["tails"], f["heads"], f["weights"], f["mids"],
+            )
+
+    def _unpack(self, u, w):
+        # Expand a hierarchy edge into original edges
+        stack, edges = [(u, w)], []
+        while stack:
+            a, b = stack.pop()
+            mid = self.edges[(a, b)][1]
+            if mid < 0:
+                edges.append((a, b))
+            else:
+                stack.append((mid, b))
+                stack.append((a, mid))
+        return edges
+
+    def query(self, source_node, target_node):
+        source_id = self.node_id.get(source_node)
+        target_id = self.node_id.get(target_node)
+        if source_id is None or target_id is None:
+            return None, None
+
+        # Upward search from both ends, each side stops once its queue passes the best meeting point
+        sides = [(self.up, {source_id: 0.0}, {}, [(0.0, source_id)]),
+                 (self.down, {target_id: 0.0}, {}, [(0.0, target_id)])]
+        best, meeting = float("inf"), None
+        while True:
+            live = [i for i in (0, 1) if sides[i][3] and sides[i][3][0][0] < best]
+            if not live:
+                break
+            side = min(live, key=lambda i: sides[i][3][0][0])
+            (indptr, heads, weights), dist, pred, heap = sides[side]
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            other = sides[1 - side][1]
+            if u in other and d + other[u] < best:
+                best, meeting = d + other[u], u
+            for k in range(indptr[u], indptr[u + 1]):
+                v = heads[k]
+                nd = d + weights[k]
+                if nd < dist.get(v, float("inf")):
+                    dist[v] = nd
+                    pred[v] = u
+                    heapq.heappush(heap, (nd, v))
+        if meeting is None:
+            return None, None
+
+        # Hierarchy edges source -> meeting -> target, then unpacked into original edges
+        up_chain, node = [], meeting
+        while node in sides[0][2]:
+            up_chain.append((sides[0][2][node], node))
+            node = sides[0][2][node]
+        up_chain.reverse()
+        down_chain, node = [], meeting
+        while node in sides[1][2]:
+            down_chain.append((node, sides[1][2][node]))
+            node = sides[1][2][node]
+        path = []
+        for u, w in up_chain + down_chain:
+            path.extend((self.labels[a], self.labels[b]) for a, b in self._unpack(u, w))
+        return path, best
+
+# Indexes by graph content hash, most recently used last
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+def add_index(index):
+    with _lock:
+        _indexes[index.key] = index
+        _indexes.move_to_end(index.key)
+        while len(_indexes) > MAX_INDEXES:
+            _indexes.popitem(last=False)
+
+def get_index(key):
+    with _lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+        return index
+
+def has_index(graph):
+    return graph.key is not None and get_index(graph.key) is not None
+
+def load_indexes(directory="indexes"):
+    # Register every index saved by the command line below
+    for path in sorted(glob.glob(os.path.join(directory, "*.npz"))):
+        add_index(CHIndex.load(path))
+
+def carry_over(old_key, data):
+    # Called after an edit: the index of the previous graph is dropped and rebuilt in the
+    # background for the edited graph, reusing its contraction order
+    with _lock:
+        previous = _indexes.pop(old_key, None)
+    if previous is None:
+        return
+
+    def rebuild():
+        graph = get_graph(data)
+        if not graph.has_negative_weights:
+            add_index(CHIndex.build(graph, order=previous.order))
+
+    threading.Thread(target=rebuild, daemon=True).start()
+
+@register_backend("ch")
+def _solve_ch(graph, source_node, target_node, stats=None, **options):
+    index = get_index(graph.key) if graph.key is not None else None
+    if index is None:
+        index = CHIndex.build(graph)
+        if graph.key is not None:
+            add_index(index)
+    return index.query(source_node, target_node)
+
+if __name__ == "__main__":
+    # Offline preprocessing: python ch_index.py data/example_3_dg.csv [output directory]
+    csv_path = sys.argv[1]
+    directory = sys.argv[2] if len(sys.argv) > 2 else "indexes"
+    records = pd.read_csv(csv_path).to_dict("records")
+    graph = CompiledGraph.from_records(records)
+    graph.key = graph_key(graph)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{graph.key}.npz")
+    CHIndex.build(graph).save(path)
+    print(f"Saved {path}")
@@ -0,0 +1,225 @@
+import time
+import heapq
+
+import numpy as np
+from ortools.sat.python import cp_model
+
+import metrics
+from solver import distances_to, lookup_nodes, optimality_gap, register_backend
+
+# Constrained shortest paths: resource budgets ({"time": 90, "toll": 5}, on graph.resources or on
+# "weight"), required waypoints, forbidden nodes and a hop limit. Paths are simple (no node twice).
+# The labeling search is used for few resources and non-negative costs, CP-SAT for everything else
+# and whenever labeling cannot prove its answer
+
+# Largest number of budgets the labeling search takes on
+LABELING_MAX_RESOURCES = 3
+# Labels the labeling search may create before it gives up in favor of CP-SAT
+MAX_LABELS = 200_000
+# Fractional resources are scaled to integers for CP-SAT (coefficients rounded up, budgets down)
+RESOURCE_SCALE = 1000
+
+def _resource(graph, name):
+    if name == "weight":
+        return graph.weight
+    if name not in graph.resources:
+        raise ValueError(f"Unknown resource {name}, the graph has {sorted(graph.resources) + ['weight']}")
+    return graph.resources[name]
+
+def _node_ids(graph, labels):
+    missing = [label for label in labels if label not in graph.node_id]
+    if missing:
+        raise ValueError(f"Unknown node {missing[0]}")
+    return [graph.node_id[label] for label in labels]
+
+def _labeling(graph, source_id, target_id, budgets, required, forbidden, max_hops, stats):
+    # Label-setting search over (node, waypoints visited) with one label per non-dominated
+    # (cost, resources, hops) vector, expanded in order of cost plus a lower bound to the target.
+    # Exact over walks: returns the edge ids, or None when there is no walk. Raises
+    # OverflowError past MAX_LABELS
+    names = list(budgets)
+    limits = [budgets[name] for name in names]
+    resources = [_resource(graph, name).tolist() for name in names]
+    bound = distances_to(graph, target_id, graph.weight)
+    resource_bounds = [distances_to(graph, target_id, _resource(graph, name)) for name in names]
+    hop_bound = distances_to(graph, target_id, np.ones(graph.n_edges)) if max_hops is not None else None
+    bit = {node: 1 << i for i, node in enumerate(required)}
+    done = (1 << len(required)) - 1
+    banned = set(forbidden)
+
+    indptr, heads, weights, edge_ids = graph.forward
+    # label: (cost, hops, resources, node, mask, parent label, edge)
+    start = (0.0, 0, (0.0,) * len(names), source_id, bit.get(source_id, 0), -1, -1)
+    labels = [start]
+    alive = [True]
+    front = {(source_id, start[4]): [0]}
+    heap = [(bound[source_id], 0)]
+    while heap:
+        _, i = heapq.heappop(heap)
+        if not alive[i]:
+            continue
+        cost, hops, used, u, mask, _, _ = labels[i]
+        if u == target_id and mask == done:
+            stats["labels"] = len(labels)
+            edges = []
+            while labels[i][5] >= 0:
+                edges.append(labels[i][6])
+                i = labels[i][5]
+            return edges[::-1]
+        for k in range(indptr[u], indptr[u + 1]):
+            v = heads[k]
+            if v in banned or bound[v] == float("inf"):
+                continue
+            e = edge_ids[k]
+            new_hops = hops + 1
+            if max_hops is not None and new_hops + hop_bound[v] > max_hops:
+                continue
+            new_used = tuple(r + resource[e] for r, resource in zip(used, resources))
+            if any(r + lb[v] > limit for r, lb, limit in zip(new_used, resource_bounds, limits)):
+                continue
+            new_cost = cost + weights[k]
+            new_mask = mask | bit.get(v, 0)
+
+            # Dominance among labels at the same node with the same waypoints visited
+            ids = front.setdefault((v, new_mask), [])
+            if any(labels[j][0] <= new_cost and labels[j][1] <= new_hops
+                   and all(a <= b for a, b in zip(labels[j][2], new_used)) for j in ids):
+                continue
+            kept = []
+            for j in ids:
+                if new_cost <= labels[j][0] and new_hops <= labels[j][1] and all(
+                        a <= b for a, b in zip(new_used, labels[j][2])):
+                    alive[j] = False
+                else:
+                    kept.append(j)
+            kept.append(len(labels))
+            front[(v, new_mask)] = kept
+            labels.append((new_cost, new_hops, new_used, v, new_mask, i, e))
+            alive.append(True)
+            if len(labels) > MAX_LABELS:
+                raise OverflowError("Label limit reached")
+            heapq.heappush(heap, (new_cost + bound[v], len(labels) - 1))
+    stats["labels"] = len(labels)
+    return None
+
+def _cpsat(graph, source_id, target_id, budgets, required, forbidden, max_hops, stats, max_time=None, workers=None):
+    # Flow formulation with one unit from source to target, every node entered at most once and
+    # Miller-Tucker-Zemlin position variables: the position grows by at least one along every chosen
+    # edge, so chosen edges cannot form a cycle, detached from the path or attached to it.
+    # Returns the edge ids, or None when no path meets the constraints
+    banned = set(forbidden)
+    src, dst = graph.src.tolist(), graph.dst.tolist()
+    edges = [e for e in range(graph.n_edges)
+             if src[e] != dst[e] and src[e] not in banned and dst[e] not in banned
+             and dst[e] != source_id and src[e] != target_id]
+    model = cp_model.CpModel()
+    x = {e: model.NewBoolVar(f"x{e}") for e in edges}
+    out_edges, in_edges = {}, {}
+    for e in edges:
+        out_edges.setdefault(src[e], []).append(x[e])
+        in_edges.setdefault(dst[e], []).append(x[e])
+
+    nodes = set(out_edges) | set(in_edges) | {source_id, target_id}
+    position = {v: model.NewIntVar(0, len(nodes) - 1, f"p{v}") for v in nodes}
+    model.Add(position[source_id] == 0)
+    for v in nodes:
+        supply = (v == source_id) - (v == target_id)
+        model.Add(sum(out_edges.get(v, [])) - sum(in_edges.get(v, [])) == supply)
+        model.Add(sum(in_edges.get(v, [])) <= 1)
+    for v in required:
+        if v != source_id:
+            model.Add(sum(in_edges.get(v, [])) == 1)
+    for e in edges:
+        model.Add(position[dst[e]] >= position[src[e]] + 1).OnlyEnforceIf(x[e])
+
+    if max_hops is not None:
+        model.Add(sum(x.values()) <= int(max_hops))
+    for name, limit in budgets.items():
+        resource = _resource(graph, name)
+        scale = 1 if np.all(np.mod(resource, 1) == 0) and float(limit).is_integer() else RESOURCE_SCALE
+        coeffs = np.ceil(resource * scale).astype(np.int64).tolist()
+        model.Add(sum(coeffs[e] * x[e] for e in edges) <= int(np.floor(limit * scale)))
+    model.Minimize(sum(graph.weight[e].item() * x[e] for e in edges))
+
+    solver = cp_model.CpSolver()
+    if max_time is not None:
+        solver.parameters.max_time_in_seconds = float(max_time)
+    if workers is not None:
+        solver.parameters.num_workers = int(workers)
+    status = solver.Solve(model)
+    metrics.record_cpsat(solver, solver.StatusName(status))
+    stats.update(status=solver.StatusName(status), branches=solver.NumBranches(), conflicts=solver.NumConflicts())
+    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        return None
+    stats.update(best_bound=solver.BestObjectiveBound(), gap=optimality_gap(solver, status))
+    used = [e for e in edges if solver.Value(x[e])]
+    # Chosen edges form one simple path, order them from the source
+    next_edge = {src[e]: e for e in used}
+    ordered, node = [], source_id
+    while node != target_id:
+        ordered.append(next_edge[node])
+        node = dst[ordered[-1]]
+    return ordered
+
+def _prepare(graph, source_node, target_node, budgets, required, forbidden):
+    source_id, target_id = lookup_nodes(graph, source_node, target_node)
+    required = _node_ids(graph, required or ())
+    forbidden = _node_ids(graph, forbidden or ())
+    if set(forbidden) & ({source_id, target_id} | set(required)):
+        raise ValueError("A forbidden node is also the source, the target or a waypoint")
+    for name in budgets or {}:
+        _resource(graph, name)
+    return source_id, target_id, required, forbidden
+
+def _result(graph, edges, stats, start):
+    stats["solve_time"] = time.perf_counter() - start
+    if edges is None:
+        return None, None
+    return graph.edge_path(edges), float(graph.weight[edges].sum()) if edges else 0.0
+
+def _is_simple(graph, edges, source_id):
+    nodes = [source_id] + graph.dst[edges].tolist()
+    return len(set(nodes)) == len(nodes)
+
+@register_backend("labeling", constrained=True)
+def _solve_labeling(graph, source_node, target_node, stats=None, budgets=None, required=(), forbidden=(),
+                    max_hops=None, **options):
+    # Labeling first; its best walk is the answer when it is a simple path, otherwise CP-SAT decides
+    stats = {} if stats is None else stats
+    source_id, target_id, required, forbidden = _prepare(graph, source_node, target_node, budgets, required, forbidden)
+    if source_id is None or target_id is None:
+        return None, None
+    budgets = budgets or {}
+    start = time.perf_counter()
+    negative = graph.has_negative_weights or any(np.any(_resource(graph, name) < 0) for name in budgets)
+    if not negative:
+        try:
+            edges = _labeling(graph, source_id, target_id, budgets, required, forbidden, max_hops, stats)
+            if edges is None or _is_simple(graph, edges, source_id):
+                return _result(graph, edges, stats, start)
+            stats["fallback"] = "walk revisits a node"
+        except OverflowError:
+            stats["fallback"] = "label limit"
+    else:
+        stats["fallback"] = "negative costs"
+    edges = _cpsat(graph, source_id, target_id, budgets, required, forbidden, max_hops, stats,
+                   options.get("max_time"), options.get("workers"))
+    return _result(graph, edges, stats, start)
+
+@register_backend("cpsat", constrained=True)
+def _solve_cpsat(graph, source_node, target_node, stats=None, budgets=None, required=(), forbidden=(),
+                 max_hops=None, max_time=None, workers=None, **options):
+    stats = {} if stats is None else stats
+    source_id, target_id, required, forbidden = _prepare(graph, source_node, target_node, budgets, required, forbidden)
+    if source_id is None or target_id is None:
+        return None, None
+    start = time.perf_counter()
+    edges = _cpsat(graph, source_id, target_id, budgets or {}, required, forbidden, max_hops, stats, max_time, workers)
+    return _result(graph, edges, stats, start)
+
+@register_backend("constrained", constrained=True)
+def _solve_constrained(graph, source_node, target_node, stats=None, budgets=None, **options):
+    # Labeling for a few budgets, straight to CP-SAT with more
+    if len(budgets or {}) <= LABELING_MAX_RESOURCES:
+        return _solve_labeling(graph, source_node, target_node, stats, budgets=budgets, **options)
+    return _solve_cpsat(graph, source_node, target_node, stats, budgets=budgets, **options)
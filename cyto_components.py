@@ -1,39 +1,106 @@
+import numpy as np
 import dash_cytoscape as cyto
 
-def cytograph(elements):
+import metrics
+
+# Graphs with more elements than this are summarized on the server before rendering
+MAX_ELEMENTS = 1500
+# Neighborhood depth shown around the shortest path or the selected endpoints
+HOPS = 2
+
+BASE_STYLESHEET = [
+    {"selector": "node", "style": {"label": "data(label)"}},
+                {"selector": ".source-node", "style": {"background-color": "green"}},  # Source node style
+        {"selector": ".target-node", "style": {"background-color": "red"}},    # Target node style
+        {"selector": ".normal-node", "style": {"background-color": "gray"}},
+    {
+        "selector": "edge",
+        "style": {
+            "curve-style": "bezier",
+            "target-arrow-shape": "triangle",
+            "label": "data(label)",
+            "text-rotation": "autorotate",
+            "font-size": "14px",
+            "line-color": "#0074D9",
+            "target-arrow-color": "#0074D9",
+            "text-margin-y": -10,
+        },
+    },
+]
+
+def cytograph(elements, layout=None, stylesheet=None):
     return cyto.Cytoscape(
+        id="cytoscape",
         elements = elements,
-        layout={"name": "circle"},
-        stylesheet=[
-            {"selector": "node", "style": {"label": "data(label)"}},
-                        {"selector": ".source-node", "style": {"background-color": "green"}},  # Source node style
-                {"selector": ".target-node", "style": {"background-color": "red"}},    # Target node style
-                {"selector": ".normal-node", "style": {"background-color": "gray"}},
-            {
-                "selector": "edge",
-                "style": {
-                    "curve-style": "bezier",
-                    "target-arrow-shape": "triangle",
-                    "label": "data(label)",
-                    "text-rotation": "autorotate",
-                    "font-size": "14px",
-                    "line-color": "#0074D9",
-                    "target-arrow-color": "#0074D9",
-                    "text-margin-y": -10,
-                },
-            },
-        ],
+        layout=layout or {"name": "circle"},
+        stylesheet=stylesheet or BASE_STYLESHEET,
         style={'width': '100%', 'height': '500px'},
 )
 
-def csv_to_graph_elements(data, source_node=None, target_node=None, shortest_path=[]):
+def _quote(label):
+    # Cytoscape selector string literal
+    return '"' + str(label).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+# Colors of alternative routes, the shortest path stays red
+ROUTE_COLORS = ["#FF851B", "#2ECC40", "#B10DC9", "#39CCCC", "#F012BE", "#85144b", "#3D9970", "#FFDC00", "#001f3f"]
+
+# Node colors of the distance overlay, nearest to farthest (RGB)
+NEAR_COLOR = (255, 220, 0)
+FAR_COLOR = (133, 20, 75)
+
+def _distance_rules(distances):
+    # distances: label -> distance of the reachable nodes. Each node is shaded between NEAR_COLOR
+    # and FAR_COLOR and labeled with its distance, unreachable nodes keep their style
+    if not distances:
+        return []
+    farthest = max(distances.values()) or 1.0
+    rules = []
+    for label, distance in distances.items():
+        t = distance / farthest
+        color = "#" + "".join(f"{round(a + (b - a) * t):02x}" for a, b in zip(NEAR_COLOR, FAR_COLOR))
+        rules.append({
+            "selector": f"node[id = {_quote(label)}]",
+            "style": {"background-color": color, "label": f"{label} ({distance:g})"},
+        })
+    return rules
+
+def highlight_stylesheet(source_node=None, target_node=None, shortest_path=(), alternatives=(), distances=None):
+    # Highlighting as stylesheet rules appended to the base style: only these rules travel to the
+    # browser, the elements and their layout stay untouched. Later rules win, so on edges shared by
+    # several routes the better route's color shows
+    rules = _distance_rules(distances)
+    for i, route in reversed(list(enumerate(alternatives or ()))):
+        color = ROUTE_COLORS[i % len(ROUTE_COLORS)]
+        for source, target in route:
+            rules.append({
+                "selector": f"edge[source = {_quote(source)}][target = {_quote(target)}]",
+                "style": {"line-color": color},
+            })
+    if source_node is not None:
+        rules.append({"selector": f"node[id = {_quote(source_node)}]", "style": {"background-color": "green"}})
+    if target_node is not None:
+        rules.append({"selector": f"node[id = {_quote(target_node)}]", "style": {"background-color": "red"}})
+    for source, target in shortest_path or ():
+        rules.append({
+            "selector": f"edge[source = {_quote(source)}][target = {_quote(target)}]",
+            "style": {"line-color": "red"},
+        })
+    return BASE_STYLESHEET + rules
+
+def is_summarized(graph, max_elements=None):
+    return graph.n_nodes + graph.n_edges > (max_elements or MAX_ELEMENTS)
+
+@metrics.timed("elements")
+def csv_to_graph_elements(data, source_node=None, target_node=None, shortest_path=[], nodes=None):
     elements = []
+    shortest_path = set(shortest_path or [])
     
-    # Get all the nodes
-    nodes = set(
-        [entry["source"] for entry in data]
-        + [entry["target"] for entry in data if entry["target"]]
-    )
+    # Get all the nodes, unless the caller already has them from the compiled graph
+    if nodes is None:
+        nodes = set(
+            [entry["source"] for entry in data]
+            + [entry["target"] for entry in data if entry["target"]]
+        )
 
     # Add nodes with styles if they match source_node or target_node
     for node in nodes:
@@ -76,4 +143,74 @@ def csv_to_graph_elements(data, source_node=None, target_node=None, shortest_pat
                         "weight": entry["weight"],
                     }
                 })
-    return elements
\ No newline at end of file
+    return elements
+
+def _neighborhood(graph, focus, hops, max_nodes):
+    # Breadth-first rings around the focus nodes in both edge directions, capped at max_nodes
+    rings = [list(dict.fromkeys(focus))[:max_nodes]]
+    seen = set(rings[0])
+    for _ in range(hops):
+        ring = []
+        for node in rings[-1]:
+            neighbors = np.concatenate([graph.dst[graph.out_edges(node)], graph.src[graph.in_edges(node)]])
+            for v in neighbors.tolist():
+                if v not in seen and len(seen) < max_nodes:
+                    seen.add(v)
+                    ring.append(v)
+        if not ring:
+            break
+        rings.append(ring)
+    return rings
+
+def _ring_positions(rings, spacing=120):
+    # Concentric circles, one per ring, so the browser can skip running a layout
+    positions = {}
+    for depth, ring in enumerate(rings):
+        radius = spacing * depth if len(rings[0]) > 1 or depth else 0
+        radius = max(radius, spacing * len(ring) / (2 * np.pi))
+        for i, node in enumerate(ring):
+            angle = 2 * np.pi * i / len(ring)
+            positions[node] = {"x": float(radius * np.cos(angle)), "y": float(radius * np.sin(angle))}
+    return positions
+
+@metrics.timed("elements")
+def graph_elements(graph, source_node=None, target_node=None, shortest_path=[], max_elements=MAX_ELEMENTS, hops=HOPS):
+    # Elements and layout for a compiled graph. Small graphs are sent whole; large ones are cut down
+    # to the shortest path (or selected endpoints, or the best connected nodes) plus a few hops
+    # around it, with positions computed here, so payload and layout time stay bounded
+    if not is_summarized(graph, max_elements):
+        return csv_to_graph_elements(graph.records, source_node, target_node, shortest_path, nodes=graph.labels), None
+
+    path = set(shortest_path or [])
+    focus = [graph.node_id[node] for edge in shortest_path or [] for node in edge]
+    focus += [graph.node_id[node] for node in (source_node, target_node) if node in graph.node_id]
+    if not focus:
+        degree = np.bincount(np.concatenate([graph.src, graph.dst]), minlength=graph.n_nodes)
+        focus = np.argsort(-degree, kind="stable")[:max_elements // 10].tolist()
+    rings = _neighborhood(graph, focus, hops, max_elements // 3)
+    positions = _ring_positions(rings)
+
+    # Edges between the shown nodes, path edges first, within the remaining element budget.
+    # Path colors come from highlight_stylesheet
+    shown = np.zeros(graph.n_nodes, dtype=bool)
+    shown[list(positions)] = True
+    edges = np.flatnonzero(shown[graph.src] & shown[graph.dst])
+    on_path = np.array([(graph.labels[graph.src[e]], graph.labels[graph.dst[e]]) in path for e in edges], dtype=bool)
+    edges = np.concatenate([edges[on_path], edges[~on_path]])[:max_elements - len(positions)]
+
+    elements = []
+    for node, position in positions.items():
+        label = graph.labels[node]
+        if label == source_node:
+            classes = "source-node"
+        elif label == target_node:
+            classes = "target-node"
+        else:
+            classes = "normal-node"
+        elements.append({"data": {"id": label, "label": label}, "classes": classes, "position": position})
+    for e in edges.tolist():
+        source, target = graph.labels[graph.src[e]], graph.labels[graph.dst[e]]
+        weight = graph.weight[e].item()
+        element = {"data": {"source": source, "target": target, "label": f"{weight}", "weight": weight}}
+        elements.append(element)
+    return elements, {"name": "preset"}
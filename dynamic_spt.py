@@ -0,0 +1,239 @@
+import os
+import glob
+import heapq
+import hashlib
+import pickle
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import graph_store
+import metrics
+from solver import dijkstra_tree
+
+# Shortest path trees of edited graph sessions, one per (session, source), repaired after further
+# edits instead of recomputed. Graphs that were only loaded never get a tree: their queries go
+# through solver.shortest_path (backend choice, result cache, CH). Trees are pickled to TREE_DIR so
+# background jobs and every worker process share them, and kept in memory while in use
+TREE_DIR = os.environ.get("SPT_CACHE_DIR", os.path.join("cache", "trees"))
+# Tree files kept on disk, least recently written are removed first
+MAX_TREES = 64
+# Trees kept in memory by each process
+MEMORY_TREES = 8
+# A repair touching more than this share of the nodes recomputes the whole tree instead
+REPAIR_LIMIT = 0.1
+
+def _tree_path(sid, source_node):
+    name = hashlib.blake2b(f"{sid}\x1f{source_node!r}".encode(), digest_size=16).hexdigest()
+    return os.path.join(TREE_DIR, f"{name}.pkl")
+
+_trees = OrderedDict()
+_lock = threading.Lock()
+
+def _load(sid, source_node):
+    # The newest tree of this process or, when another process wrote a newer one, the file
+    path = _tree_path(sid, source_node)
+    with _lock:
+        tree = _trees.get(path)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return tree
+    if tree is not None and tree["mtime"] >= mtime:
+        return tree
+    try:
+        with open(path, "rb") as f:
+            tree = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return tree
+    tree["mtime"] = mtime
+    _remember(path, tree)
+    return tree
+
+def _remember(path, tree):
+    with _lock:
+        _trees[path] = tree
+        _trees.move_to_end(path)
+        while len(_trees) > MEMORY_TREES:
+            _trees.popitem(last=False)
+
+def _save(sid, source_node, tree):
+    os.makedirs(TREE_DIR, exist_ok=True)
+    path = _tree_path(sid, source_node)
+    # Write then rename, concurrent readers never see a partial file
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump(tree, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+    tree["mtime"] = os.path.getmtime(path)
+    _remember(path, tree)
+    files = sorted(glob.glob(os.path.join(TREE_DIR, "*.pkl")), key=os.path.getmtime)
+    for old in files[:-MAX_TREES]:
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+
+def _full_tree(graph, source_id):
+    dist, pred = dijkstra_tree(graph, source_id)
+    parent = np.where(pred >= 0, graph.src[np.maximum(pred, 0)], -1)
+    return dist, parent
+
+def _descendants(parent, roots):
+    # Nodes whose tree path runs through one of the roots, roots included
+    n = len(parent)
+    has_parent = parent >= 0
+    children_of = parent[has_parent]
+    child_ids = np.flatnonzero(has_parent)
+    order = np.argsort(children_of, kind="stable")
+    children = child_ids[order]
+    ptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(children_of, minlength=n), out=ptr[1:])
+
+    seen = np.zeros(n, dtype=bool)
+    stack = [root for root in roots if not seen[root]]
+    seen[stack] = True
+    while stack:
+        node = stack.pop()
+        for child in children[ptr[node]:ptr[node + 1]].tolist():
+            if not seen[child]:
+                seen[child] = True
+                stack.append(child)
+    return np.flatnonzero(seen)
+
+def _affected(tree, ops):
+    # Old node ids whose distance may have grown (removed tree edges and nodes, with their subtrees)
+    # and labels of heads of inserted edges, whose distance may have shrunk.
+    # None when the edits cannot be repaired locally
+    removed_edges, removed_nodes, heads = [], [], []
+    for op, *args in ops:
+        if op == "add_edge":
+            heads.append(args[1])
+        elif op == "add_edges":
+            heads.extend(target for _, target, _ in args[0])
+        elif op == "remove_edges":
+            removed_edges.extend(args[0])
+        elif op == "remove_nodes":
+            removed_nodes.extend(args[0])
+        elif op != "add_node":
+            return None
+
+    index = pd.Index(tree["labels"])
+    parent = tree["parent"]
+    roots = index.get_indexer(removed_nodes) if removed_nodes else np.empty(0, dtype=np.int64)
+    if removed_edges:
+        tails = index.get_indexer([source for source, _ in removed_edges])
+        targets = index.get_indexer([target for _, target in removed_edges])
+        # Only removed tree edges matter, any other edge was not on a shortest path
+        on_tree = (tails >= 0) & (targets >= 0)
+        on_tree[on_tree] = parent[targets[on_tree]] == tails[on_tree]
+        roots = np.concatenate([roots, targets[on_tree]])
+    return _descendants(parent, roots[roots >= 0].tolist()), heads
+
+def _repair(graph, tree, ops, source_id):
+    # Ramalingam-Reps style batch repair on the edited graph. Affected nodes lose their distance,
+    # they and the heads of inserted edges are seeded from their in-edges, then a Dijkstra pass
+    # propagates every improvement. Returns None when a full recompute is cheaper
+    changes = _affected(tree, ops)
+    if changes is None:
+        return None
+    affected, inserted = changes
+    if len(affected) + len(inserted) > REPAIR_LIMIT * graph.n_nodes:
+        return None
+
+    # Carry the old tree over to the new node numbering, removed nodes map to -1
+    new_id = pd.Index(graph.labels).get_indexer(tree["labels"])
+    dist = np.full(graph.n_nodes, np.inf)
+    parent = np.full(graph.n_nodes, -1, dtype=np.int64)
+    kept = new_id >= 0
+    kept[affected] = False
+    dist[new_id[kept]] = tree["dist"][kept]
+    old_parent = tree["parent"][kept]
+    parent[new_id[kept]] = np.where(old_parent >= 0, new_id[np.maximum(old_parent, 0)], -1)
+    if dist[source_id] != 0.0:
+        return None
+
+    seeds = set(new_id[affected][new_id[affected] >= 0].tolist())
+    seeds.update(graph.node_id[label] for label in inserted if label in graph.node_id)
+    dist, parent = dist.tolist(), parent.tolist()
+    in_ptr, tails, in_weights, _ = graph.backward
+    heap = []
+    for v in seeds:
+        for k in range(in_ptr[v], in_ptr[v + 1]):
+            nd = dist[tails[k]] + in_weights[k]
+            if nd < dist[v]:
+                dist[v] = nd
+                parent[v] = tails[k]
+        if dist[v] < float("inf"):
+            heap.append((dist[v], v))
+    heapq.heapify(heap)
+
+    indptr, heads, weights, _ = graph.forward
+    while heap:
+        d, u = heapq.heappop(heap)
+        if d > dist[u]:
+            continue
+        for k in range(indptr[u], indptr[u + 1]):
+            v = heads[k]
+            nd = d + weights[k]
+            if nd < dist[v]:
+                dist[v] = nd
+                parent[v] = u
+                heapq.heappush(heap, (nd, v))
+    return np.array(dist), np.array(parent, dtype=np.int64)
+
+def _edited(sid, version):
+    # The graph's last version came from an edit, not from loading a graph into the session
+    ops = graph_store.sessions.changes(sid, version - 1, version)
+    return bool(ops) and all(op[0] != "replace" for op in ops)
+
+def shortest_path(data, graph, source_node, target_node, stats=None):
+    # Path query on an edited graph session through its tree from source_node. Returns None when
+    # the caller should solve it instead: not a session, negative weights, or no tree to reuse
+    if not graph_store.is_session(data) or graph.version is None or graph.has_negative_weights:
+        return None
+    source_id = graph.node_id.get(source_node)
+    target_id = graph.node_id.get(target_node)
+    if source_id is None or target_id is None:
+        return None
+
+    with metrics.timer("solve", backend="dynamic"):
+        return _query(data["session"], graph, source_node, source_id, target_id, stats)
+
+def _query(sid, graph, source_node, source_id, target_id, stats):
+    start = time.perf_counter()
+    # The version the graph was compiled from: the session may have moved on since
+    version = graph.version
+    tree = _load(sid, source_node)
+    if tree is not None and tree["version"] == version:
+        mode = "cached"
+    else:
+        result = None
+        if tree is not None and tree["version"] < version:
+            ops = graph_store.sessions.changes(sid, tree["version"], version)
+            if ops is not None:
+                result = _repair(graph, tree, ops, source_id)
+        if result is not None:
+            mode = "repaired"
+        elif _edited(sid, version):
+            # Edited sessions usually get edited again, the full tree pays off with the next repair
+            mode = "full"
+            result = _full_tree(graph, source_id)
+        else:
+            return None
+        tree = {"version": version, "labels": graph.labels, "dist": result[0], "parent": result[1]}
+        _save(sid, source_node, tree)
+    if stats is not None:
+        stats.update(backend=f"dynamic ({mode})", build_time=0.0, solve_time=time.perf_counter() - start)
+
+    if not np.isfinite(tree["dist"][target_id]):
+        return None, None
+    path, node = [], target_id
+    parent, labels = tree["parent"], graph.labels
+    while node != source_id:
+        path.append((labels[parent[node]], labels[node]))
+        node = parent[node]
+    path.reverse()
+    return path, tree["dist"][target_id].item()
@@ -0,0 +1,103 @@
+import io
+import os
+import csv
+
+import numpy as np
+import pandas as pd
+from flask import Blueprint, Response, jsonify, request
+
+import graph_store
+from graph_cache import get_graph
+from solver import dijkstra_tree, _check_batch
+from streams import gzip_stream
+
+# CSV downloads of a graph session, written straight from the compiled edge arrays a chunk of
+# rows at a time, so memory stays flat however large the graph is:
+#
+#   GET /export/<handle>/edges.csv       source, target, weight (+ resources), isolated nodes last
+#   GET /export/<handle>/distances.csv   all-pairs distance matrix, one search per row
+#
+# ?gzip=1 downloads a .csv.gz file, otherwise the transfer is gzipped when the client accepts it.
+# Batch path results stream the same way from /api/paths with "format": "csv"
+
+blueprint = Blueprint("export", __name__, url_prefix="/export")
+
+# Rows formatted per write
+CHUNK_ROWS = 50_000
+# The distance matrix has n_nodes^2 cells and takes one search per row, larger graphs get a 413
+MAX_DISTANCE_NODES = int(os.environ.get("EXPORT_MAX_DISTANCE_NODES", 5_000))
+
+def edges_csv(graph, chunk_rows=CHUNK_ROWS):
+    resources = sorted(graph.resources)
+    yield ",".join(["source", "target", "weight"] + resources) + "\n"
+    for start in range(0, graph.n_edges, chunk_rows):
+        end = start + chunk_rows
+        chunk = pd.DataFrame({"source": graph.labels[graph.src[start:end]],
+                              "target": graph.labels[graph.dst[start:end]],
+                              "weight": graph.weight[start:end]})
+        for name in resources:
+            chunk[name] = graph.resources[name][start:end]
+        yield chunk.to_csv(header=False, index=False)
+    # Nodes without any edge, as rows without a target (like graph.df)
+    for start in range(0, graph.n_nodes, chunk_rows):
+        end = min(start + chunk_rows, graph.n_nodes)
+        degree = np.diff(graph.out_ptr[start:end + 1]) + np.diff(graph.in_ptr[start:end + 1])
+        isolated = pd.DataFrame({"source": graph.labels[start:end][degree == 0]},
+                                columns=["source", "target", "weight"] + resources)
+        if len(isolated):
+            yield isolated.to_csv(header=False, index=False)
+
+def distances_csv(graph, chunk_rows=64):
+    # Rows and columns in node name order like the distance matrix table, empty where there is no
+    # path. Only one row of the matrix is held at a time
+    order = np.array([graph.node_id[name] for name in graph.node_names], dtype=np.int64)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(["source"] + graph.node_names)
+    for i, source_id in enumerate(order.tolist(), 1):
+        dist, _ = dijkstra_tree(graph, source_id)
+        writer.writerow([graph.labels[source_id]] + ["" if np.isinf(d) else d for d in dist[order].tolist()])
+        if i % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def csv_response(stream, filename):
+    # Streamed attachment; ?gzip=1 downloads it compressed, otherwise the transfer is compressed
+    # when the client accepts gzip
+    headers = {"Vary": "Accept-Encoding"}
+    mimetype = "text/csv"
+    if request.args.get("gzip") == "1":
+        stream, filename, mimetype = gzip_stream(stream), filename + ".gz", "application/gzip"
+    elif "gzip" in request.headers.get("Accept-Encoding", ""):
+        stream = gzip_stream(stream)
+        headers["Content-Encoding"] = "gzip"
+    headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return Response(stream, mimetype=mimetype, headers=headers)
+
+def _session_graph(handle):
+    if graph_store.sessions.version(handle) is None:
+        return None
+    return get_graph({"session": handle})
+
+@blueprint.route("/<handle>/edges.csv")
+def export_edges(handle):
+    graph = _session_graph(handle)
+    if graph is None:
+        return jsonify(error=f"Unknown graph {handle}"), 404
+    return csv_response(edges_csv(graph), "graph_data.csv")
+
+@blueprint.route("/<handle>/distances.csv")
+def export_distances(handle):
+    graph = _session_graph(handle)
+    if graph is None:
+        return jsonify(error=f"Unknown graph {handle}"), 404
+    if graph.n_nodes > MAX_DISTANCE_NODES:
+        return jsonify(error=f"The distance matrix export is limited to {MAX_DISTANCE_NODES} nodes, "
+                             f"this graph has {graph.n_nodes}"), 413
+    try:
+        _check_batch(graph)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return csv_response(distances_csv(graph), "distance_matrix.csv")
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import graph_store
+import metrics
+from ingest import graph_key
+from solver import CompiledGraph
+
+def store_key(data):
+    # Content hash of the graph-data-store records, identical stores share one compiled graph
+    payload = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+class GraphCache:
+    # LRU of compiled graphs bounded by entry count and idle time (seconds)
+    def __init__(self, maxsize=16, ttl=900):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Callbacks fire concurrently on every store change, only one of them should compile a
+        # given graph while other graphs compile alongside: key -> [lock, threads using it]
+        self._building = {}
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries[key] = (time.monotonic(), entry[1])
+            self._entries.move_to_end(key)
+            self.hits += 1
+            metrics.inc("graph_cache_hits_total")
+            return entry[1]
+
+    def get(self, data):
+        key = store_key(data)
+
+        def build():
+            # Looked up by the record hash, but keyed like every other graph (result cache, CH)
+            graph = CompiledGraph.from_records(data)
+            graph.key = graph_key(graph)
+            return graph
+        return self.get_or_build(key, build)
+
+    def get_or_build(self, key, build):
+        graph = self._lookup(key)
+        if graph is not None:
+            return graph
+
+        with self._lock:
+            building = self._building.setdefault(key, [threading.Lock(), 0])
+            building[1] += 1
+        try:
+            with building[0]:
+                graph = self._lookup(key)
+                if graph is not None:
+                    return graph
+                with metrics.timer("compile"):
+                    graph = build()
+                with self._lock:
+                    self.misses += 1
+                    self._entries[key] = (time.monotonic(), graph)
+                    self._evict()
+                    metrics.set_gauge("graph_cache_entries", len(self._entries))
+                metrics.inc("graph_cache_misses_total")
+                metrics.set_gauge("graph_nodes", graph.n_nodes)
+                metrics.set_gauge("graph_edges", graph.n_edges)
+            return graph
+        finally:
+            with self._lock:
+                building[1] -= 1
+                if building[1] == 0:
+                    del self._building[key]
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [k for k, (used, _) in self._entries.items() if now - used > self.ttl]:
+            del self._entries[key]
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+graph_cache = GraphCache(
+    maxsize=int(os.environ.get("GRAPH_CACHE_SIZE", 16)),
+    ttl=float(os.environ.get("GRAPH_CACHE_TTL", 900)),
+)
+
+def get_graph(data):
+    # Store data is a {"session", "version"} reference to a server-side graph session, plain
+    # record lists (e.g. from API callers) are compiled by content
+    if graph_store.is_session(data):
+        sid = data["session"]
+        version = graph_store.sessions.version(sid)
+        if version is None:
+            return graph_cache.get([])
+        return graph_cache.get_or_build((sid, version), lambda: graph_store.sessions.compile(sid))
+    return graph_cache.get(data or [])
@@ -0,0 +1,444 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+import numpy as np
+import pandas as pd
+
+from ingest import GrowableArray, graph_key
+from solver import CompiledGraph
+
+# Graphs live on the server in editing sessions. The browser store only holds
+# {"session": id, "version": n}; callbacks send small edit operations and bump the version.
+# Operations: ("add_node", label), ("add_edge", source, target, weight),
+# ("add_edges", [(source, target, weight), ...]), ("remove_nodes", labels),
+# ("remove_edges", [(source, target), ...]), ("replace", CompiledGraph).
+# Adding an edge between unknown nodes or a second (source, target) edge raises ValueError.
+# Resources of a replacing graph (graph.resources) are kept, edges added later cost 0 of each.
+# Both backends keep the last LOG_SIZE versions of operations, see changes(). Compiled graphs
+# carry the version they were compiled from as graph.version
+
+# Sessions kept by the in-memory backend
+MAX_SESSIONS = int(os.environ.get("MAX_SESSIONS", 256))
+# Sessions kept in the SQLite file, the least recently created or edited ones go first
+MAX_DB_SESSIONS = int(os.environ.get("MAX_DB_SESSIONS", 4096))
+# Versions of edit operations kept per session for incremental consumers (see changes())
+LOG_SIZE = 64
+
+def _finish(graph, version):
+    graph.key = graph_key(graph)
+    graph.version = version
+    return graph
+
+def _loggable(ops):
+    # The log only needs to know that a replace happened, not the replacing graph
+    return [("replace",) if op[0] == "replace" else tuple(op) for op in ops]
+
+class MemorySession:
+    # Columnar edit state: append-only node and edge arrays with alive masks, plus hash indexes
+    # ((source, target) -> edge ids, node -> incident edge ids) over the alive edges
+    def __init__(self):
+        self.version = 0
+        self.lock = threading.Lock()
+        self.log = deque(maxlen=LOG_SIZE)
+        self._reset()
+
+    def _reset(self):
+        self.labels = []
+        self.node_id = {}
+        self.node_alive = GrowableArray(bool)
+        self.src = GrowableArray(np.int32)
+        self.dst = GrowableArray(np.int32)
+        self.weight = GrowableArray(np.float64)
+        self.edge_alive = GrowableArray(bool)
+        self.resources = {}
+        self._pairs = None
+        self._incident = None
+
+    def checkpoint(self):
+        # Enough to undo a batch: appends are cut back to these sizes, the alive masks copied and
+        # the objects a replace swaps out kept
+        return {
+            "labels": self.labels, "n_labels": len(self.labels), "node_id": self.node_id,
+            "arrays": [(name, getattr(self, name), getattr(self, name).size)
+                       for name in ("node_alive", "src", "dst", "weight", "edge_alive")],
+            "resources": [(name, values, values.size) for name, values in self.resources.items()],
+            "node_alive": self.node_alive.view().copy(), "edge_alive": self.edge_alive.view().copy(),
+        }
+
+    def rollback(self, saved):
+        labels = saved["labels"]
+        for label in labels[saved["n_labels"]:]:
+            del saved["node_id"][label]
+        del labels[saved["n_labels"]:]
+        self.labels, self.node_id = labels, saved["node_id"]
+        for name, array, size in saved["arrays"]:
+            array.size = size
+            setattr(self, name, array)
+        self.resources = {}
+        for name, values, size in saved["resources"]:
+            values.size = size
+            self.resources[name] = values
+        self.node_alive.view()[:] = saved["node_alive"]
+        self.edge_alive.view()[:] = saved["edge_alive"]
+        # Rebuilt from the restored arrays on the next edit
+        self._pairs = self._incident = None
+
+    def _index(self):
+        # Built on the first edit (uploads never pay for it unless edited), then kept up to date
+        if self._pairs is None:
+            self._pairs, self._incident = {}, {}
+            edges = np.flatnonzero(self.edge_alive.view())
+            self._link(edges.tolist(), self.src.view()[edges].tolist(), self.dst.view()[edges].tolist())
+
+    def _link(self, edges, sources, targets):
+        for e, u, v in zip(edges, sources, targets):
+            self._pairs.setdefault((u, v), []).append(e)
+            self._incident.setdefault(u, set()).add(e)
+            self._incident.setdefault(v, set()).add(e)
+
+    def _unlink(self, edges):
+        # Drop edges from both indexes and the alive mask in one pass
+        src, dst = self.src.view(), self.dst.view()
+        for e in edges:
+            u, v = int(src[e]), int(dst[e])
+            self._pairs[(u, v)].remove(e)
+            if not self._pairs[(u, v)]:
+                del self._pairs[(u, v)]
+            self._incident[u].discard(e)
+            self._incident[v].discard(e)
+        self.edge_alive.view()[list(edges)] = False
+
+    def _alive_node(self, label):
+        node = self.node_id.get(label)
+        if node is None or not self.node_alive.view()[node]:
+            raise ValueError(f"Unknown node {label}")
+        return node
+
+    def add_node(self, label):
+        node = self.node_id.get(label)
+        if node is None:
+            self.node_id[label] = len(self.labels)
+            self.labels.append(label)
+            self.node_alive.extend([True])
+        else:
+            self.node_alive.view()[node] = True
+
+    def add_edge(self, source, target, weight):
+        self.add_edges([(source, target, weight)])
+
+    def add_edges(self, edges):
+        # Validate the whole batch first: endpoints must exist and (source, target) must be new
+        self._index()
+        pairs = [(self._alive_node(source), self._alive_node(target)) for source, target, _ in edges]
+        seen = set()
+        for (u, v), (source, target, _) in zip(pairs, edges):
+            if (u, v) in self._pairs or (u, v) in seen:
+                raise ValueError(f"Edge {source}->{target} already exists")
+            seen.add((u, v))
+
+        first = self.src.size
+        self.src.extend([u for u, _ in pairs])
+        self.dst.extend([v for _, v in pairs])
+        self.weight.extend([weight for _, _, weight in edges])
+        self.edge_alive.extend(np.ones(len(edges), dtype=bool))
+        for values in self.resources.values():
+            values.extend(np.zeros(len(edges)))
+        self._link(range(first, first + len(edges)), [u for u, _ in pairs], [v for _, v in pairs])
+
+    def remove_nodes(self, labels):
+        self._index()
+        nodes = [self.node_id[label] for label in set(labels) if label in self.node_id]
+        edges = set()
+        for node in nodes:
+            edges |= self._incident.get(node, set())
+        self._unlink(edges)
+        self.node_alive.view()[nodes] = False
+
+    def remove_edges(self, pairs):
+        self._index()
+        edges = set()
+        for source, target in pairs:
+            key = (self.node_id.get(source), self.node_id.get(target))
+            edges.update(self._pairs.get(key, ()))
+        self._unlink(edges)
+
+    def replace(self, graph):
+        self._reset()
+        self.labels = list(graph.labels)
+        self.node_id = dict(graph.node_id)
+        self.node_alive.extend(np.ones(graph.n_nodes, dtype=bool))
+        self.src.extend(graph.src)
+        self.dst.extend(graph.dst)
+        self.weight.extend(graph.weight)
+        self.edge_alive.extend(np.ones(graph.n_edges, dtype=bool))
+        for name, values in graph.resources.items():
+            self.resources[name] = GrowableArray(np.float64)
+            self.resources[name].extend(values)
+
+    def compile(self):
+        # Renumber the alive nodes 0..n-1 and keep the alive edges in insertion order
+        node_alive = self.node_alive.view()
+        new_id = np.cumsum(node_alive) - 1
+        edges = self.edge_alive.view()
+        labels = np.empty(int(node_alive.sum()), dtype=object)
+        labels[:] = [label for label, alive in zip(self.labels, node_alive.tolist()) if alive]
+        weight = self.weight.view()[edges]
+        if np.all(np.mod(weight, 1) == 0):
+            weight = weight.astype(np.int64)
+        graph = CompiledGraph(
+            labels, new_id[self.src.view()[edges]].astype(np.int32),
+            new_id[self.dst.view()[edges]].astype(np.int32), weight,
+        )
+        graph.resources = {name: values.view()[edges] for name, values in self.resources.items()}
+        return _finish(graph, self.version)
+
+class MemoryBackend:
+    # Sessions of this process only: use the SQLite backend when several workers serve the app
+    def __init__(self, maxsize=MAX_SESSIONS):
+        self.maxsize = maxsize
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, sid):
+        with self._lock:
+            session = self._sessions.get(sid)
+            if session is not None:
+                self._sessions.move_to_end(sid)
+            return session
+
+    def create(self):
+        sid = uuid.uuid4().hex
+        with self._lock:
+            self._sessions[sid] = MemorySession()
+            while len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+        return sid
+
+    def version(self, sid):
+        session = self._get(sid)
+        return None if session is None else session.version
+
+    def apply(self, sid, ops):
+        session = self._get(sid)
+        if session is None:
+            raise KeyError(f"Unknown graph session {sid}")
+        with session.lock:
+            # A batch applies whole or not at all. Single operations validate before they change
+            # anything, a failing later operation of a batch rolls back the earlier ones
+            saved = session.checkpoint() if len(ops) > 1 else None
+            try:
+                for op, *args in ops:
+                    getattr(session, op)(*args)
+            except Exception:
+                if saved is not None:
+                    session.rollback(saved)
+                raise
+            session.version += 1
+            session.log.append((session.version, _loggable(ops)))
+            return session.version
+
+    def changes(self, sid, since, until=None):
+        # Operations applied after version `since` up to `until` (the current version by default),
+        # None when the log no longer reaches back that far
+        session = self._get(sid)
+        if session is None:
+            return None
+        with session.lock:
+            until = session.version if until is None else until
+            log = [(version, ops) for version, ops in session.log if since < version <= until]
+            if len(log) != until - since:
+                return None
+            return [op for _, ops in log for op in ops]
+
+    def compile(self, sid):
+        session = self._get(sid)
+        if session is None:
+            raise KeyError(f"Unknown graph session {sid}")
+        with session.lock:
+            return session.compile()
+
+class SQLiteBackend:
+    # Sessions in a local SQLite file, shared by every worker process on the machine
+    def __init__(self, path, maxsize=MAX_DB_SESSIONS):
+        self.path = path
+        self.maxsize = maxsize
+        self._local = threading.local()
+        with self._connect() as db:
+            db.executescript("""
+                PRAGMA journal_mode = WAL;
+                CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, version INTEGER NOT NULL, used REAL);
+                CREATE TABLE IF NOT EXISTS nodes (session TEXT, label TEXT, PRIMARY KEY (session, label));
+                CREATE TABLE IF NOT EXISTS edges (
+                    id INTEGER PRIMARY KEY, session TEXT, source TEXT, target TEXT, weight NUMERIC,
+                    resources TEXT
+                );
+                CREATE INDEX IF NOT EXISTS edges_by_session ON edges (session, source, target);
+                CREATE INDEX IF NOT EXISTS edges_by_target ON edges (session, target);
+                CREATE TABLE IF NOT EXISTS ops (session TEXT, version INTEGER, ops TEXT, PRIMARY KEY (session, version));
+            """)
+            # Files created before edges had resources and sessions a use time (those sort first)
+            if "resources" not in [row[1] for row in db.execute("PRAGMA table_info(edges)")]:
+                db.execute("ALTER TABLE edges ADD COLUMN resources TEXT")
+            if "used" not in [row[1] for row in db.execute("PRAGMA table_info(sessions)")]:
+                db.execute("ALTER TABLE sessions ADD COLUMN used REAL")
+            db.execute("CREATE INDEX IF NOT EXISTS sessions_by_use ON sessions (used)")
+
+    def _connect(self):
+        # One connection per thread and process: sqlite3 connections are not thread-safe and one
+        # inherited through a fork (gunicorn preload) must not be used by the child
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = self._local.db = sqlite3.connect(self.path, timeout=30)
+            self._local.pid = os.getpid()
+        return db
+
+    def create(self):
+        sid = uuid.uuid4().hex
+        with self._connect() as db:
+            db.execute("INSERT INTO sessions VALUES (?, 0, ?)", (sid, time.time()))
+            excess = db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] - self.maxsize
+            if excess > 0:
+                self._evict(db, excess)
+        return sid
+
+    def _evict(self, db, count):
+        # Drop the least recently created or edited sessions with their rows
+        old = [(row[0],) for row in db.execute("SELECT id FROM sessions ORDER BY used LIMIT ?", (count,))]
+        for table, column in (("nodes", "session"), ("edges", "session"), ("ops", "session"), ("sessions", "id")):
+            db.executemany(f"DELETE FROM {table} WHERE {column} = ?", old)
+
+    def version(self, sid):
+        row = self._connect().execute("SELECT version FROM sessions WHERE id = ?", (sid,)).fetchone()
+        return None if row is None else row[0]
+
+    def apply(self, sid, ops):
+        # One transaction, a failing operation rolls back the whole batch and the version bump
+        with self._connect() as db:
+            if db.execute("UPDATE sessions SET version = version + 1, used = ? WHERE id = ?",
+                          (time.time(), sid)).rowcount == 0:
+                raise KeyError(f"Unknown graph session {sid}")
+            for op, *args in ops:
+                getattr(self, "_" + op)(db, sid, *args)
+            version = db.execute("SELECT version FROM sessions WHERE id = ?", (sid,)).fetchone()[0]
+            db.execute("INSERT INTO ops VALUES (?, ?, ?)", (sid, version, json.dumps(_loggable(ops), default=str)))
+            db.execute("DELETE FROM ops WHERE session = ? AND version <= ?", (sid, version - LOG_SIZE))
+            return version
+
+    def changes(self, sid, since, until=None):
+        db = self._connect()
+        version = self.version(sid)
+        if version is None:
+            return None
+        until = version if until is None else until
+        rows = db.execute(
+            "SELECT ops FROM ops WHERE session = ? AND version > ? AND version <= ? ORDER BY version",
+            (sid, since, until),
+        ).fetchall()
+        if len(rows) != until - since:
+            return None
+        return [tuple(op) for row in rows for op in json.loads(row[0])]
+
+    def _add_node(self, db, sid, label):
+        db.execute("INSERT OR IGNORE INTO nodes VALUES (?, ?)", (sid, label))
+
+    def _add_edge(self, db, sid, source, target, weight):
+        self._add_edges(db, sid, [(source, target, weight)])
+
+    def _add_edges(self, db, sid, edges):
+        # Endpoints must exist and (source, target) must be new, checked through the indexes
+        for source, target, _ in edges:
+            for label in (source, target):
+                if db.execute("SELECT 1 FROM nodes WHERE session = ? AND label = ?", (sid, label)).fetchone() is None:
+                    raise ValueError(f"Unknown node {label}")
+            if db.execute(
+                "SELECT 1 FROM edges WHERE session = ? AND source = ? AND target = ?", (sid, source, target)
+            ).fetchone() is not None:
+                raise ValueError(f"Edge {source}->{target} already exists")
+        if len({(source, target) for source, target, _ in edges}) < len(edges):
+            raise ValueError("Duplicate edges in one batch")
+        db.executemany("INSERT INTO edges (session, source, target, weight) VALUES (?, ?, ?, ?)",
+                       [(sid, source, target, weight) for source, target, weight in edges])
+
+    def _remove_nodes(self, db, sid, labels):
+        db.executemany("DELETE FROM nodes WHERE session = ? AND label = ?", [(sid, label) for label in labels])
+        # Two statements so each side uses its own index
+        db.executemany("DELETE FROM edges WHERE session = ? AND source = ?", [(sid, label) for label in labels])
+        db.executemany("DELETE FROM edges WHERE session = ? AND target = ?", [(sid, label) for label in labels])
+
+    def _remove_edges(self, db, sid, pairs):
+        db.executemany("DELETE FROM edges WHERE session = ? AND source = ? AND target = ?",
+                       [(sid, source, target) for source, target in pairs])
+
+    def _replace(self, db, sid, graph):
+        db.execute("DELETE FROM nodes WHERE session = ?", (sid,))
+        db.execute("DELETE FROM edges WHERE session = ?", (sid,))
+        db.executemany("INSERT INTO nodes VALUES (?, ?)", ((sid, label) for label in graph.labels.tolist()))
+        labels = graph.labels
+        # Resources as one JSON object per edge, NULL (no resources) for the edges of most graphs
+        names = sorted(graph.resources)
+        resources = ([json.dumps(dict(zip(names, row))) for row in zip(*[graph.resources[n].tolist() for n in names])]
+                     if names else [None] * graph.n_edges)
+        db.executemany(
+            "INSERT INTO edges (session, source, target, weight, resources) VALUES (?, ?, ?, ?, ?)",
+            zip([sid] * graph.n_edges, labels[graph.src].tolist(), labels[graph.dst].tolist(), graph.weight.tolist(),
+                resources),
+        )
+
+    def compile(self, sid):
+        # One read transaction, so the version matches the rows even while another worker edits
+        with self._connect() as db:
+            db.execute("BEGIN")
+            version = self.version(sid)
+            nodes = [row[0] for row in db.execute("SELECT label FROM nodes WHERE session = ? ORDER BY rowid", (sid,))]
+            edges = pd.read_sql_query(
+                "SELECT source, target, weight, resources FROM edges WHERE session = ? ORDER BY id", db, params=(sid,)
+            )
+        labels = np.empty(len(nodes), dtype=object)
+        labels[:] = nodes
+        node_id = {label: i for i, label in enumerate(nodes)}
+        src = edges["source"].map(node_id).to_numpy(dtype=np.int32)
+        dst = edges["target"].map(node_id).to_numpy(dtype=np.int32)
+        graph = CompiledGraph(labels, src, dst, edges["weight"].to_numpy())
+        stored = edges["resources"]
+        if stored.notna().any():
+            # Edges added after the replace have none, they cost 0 of each resource
+            rows = [json.loads(row) if row else {} for row in stored.tolist()]
+            names = sorted({name for row in rows for name in row})
+            graph.resources = {name: np.array([row.get(name, 0.0) for row in rows], dtype=np.float64)
+                               for name in names}
+        return _finish(graph, version)
+
+def _backend():
+    # GRAPH_SESSION_DB names a SQLite file shared by every worker process (gunicorn.conf.py sets it
+    # when it starts several workers), otherwise sessions live in this process only
+    path = os.environ.get("GRAPH_SESSION_DB")
+    if not path:
+        return MemoryBackend()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    return SQLiteBackend(path)
+
+sessions = _backend()
+
+def is_session(data):
+    return isinstance(data, dict) and "session" in data
+
+def session_state(sid):
+    return {"session": sid, "version": sessions.version(sid)}
+
+def edit(data, ops):
+    # Apply ops to the store's session (a new one when the store has none) and return the new
+    # store value. An unknown session raises KeyError: its graph is gone and editing an empty
+    # one instead would lose it silently. Only a leading "replace" needs nothing from it
+    sid = data["session"] if is_session(data) else None
+    if sid is not None and sessions.version(sid) is None:
+        if not ops or ops[0][0] != "replace":
+            raise KeyError(f"Unknown graph session {sid}")
+        sid = None
+    if sid is None:
+        sid = sessions.create()
+    return {"session": sid, "version": sessions.apply(sid, ops)}
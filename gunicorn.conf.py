@@ -0,0 +1,31 @@
+import gc
+import os
+
+# gunicorn app:server picks this file up from the working directory
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8050")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+# Threaded workers keep idle API connections open between requests (sync workers close them)
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 30))
+
+# A request may land on any worker, so graph sessions must live where all of them see them
+if workers > 1:
+    os.environ.setdefault("GRAPH_SESSION_DB", os.path.join("cache", "sessions.sqlite"))
+
+# GUNICORN_PRELOAD=1 imports the app once in the master and warms its read-only caches (example
+# graphs, CH indexes, lazily imported backends) before forking, so workers boot instantly and
+# share those pages copy-on-write. Restarting a worker then no longer pays the imports either
+preload_app = os.environ.get("GUNICORN_PRELOAD", "") == "1"
+
+def when_ready(server):
+    if not preload_app:
+        return
+    import app
+
+    app.warm()
+    # Objects created so far are never collected in the workers, so the collector does not
+    # touch (and copy) their pages
+    gc.freeze()
+    server.log.info("Warmed shared caches before forking workers")
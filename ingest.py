@@ -0,0 +1,120 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from solver import CompiledGraph
+
+# Rows parsed per chunk, bounds the transient DataFrame memory
+CHUNK_ROWS = 200_000
+
+def read_chunks(source, fmt=None, chunksize=CHUNK_ROWS):
+    # Yield source/target/weight DataFrames (plus any other columns, resource candidates) from a
+    # csv, csv.gz or parquet path or file object. fmt is inferred from the file name when not given
+    name = source if isinstance(source, str) else getattr(source, "name", "") or ""
+    fmt = fmt or ("parquet" if name.endswith((".parquet", ".pq")) else "csv")
+    if fmt == "parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Parquet upload needs the optional pyarrow package")
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        compression = "gzip" if fmt == "csv.gz" or name.endswith(".gz") else "infer"
+        if not isinstance(source, str) and compression == "infer":
+            compression = None
+        # Node names are text in the app, keep numeric-looking names as strings
+        yield from pd.read_csv(
+            source, dtype={"source": str, "target": str}, chunksize=chunksize, compression=compression,
+        )
+
+class GrowableArray:
+    # Typed append-only array that doubles its capacity, avoids holding per-chunk copies
+    def __init__(self, dtype):
+        self.data = np.empty(1024, dtype=dtype)
+        self.size = 0
+
+    def extend(self, values):
+        end = self.size + len(values)
+        if end > len(self.data):
+            grown = np.empty(max(end, 2 * len(self.data)), dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        self.data[self.size:end] = values
+        self.size = end
+
+    def view(self):
+        return self.data[:self.size]
+
+    def array(self):
+        # Shrink in place instead of copying the used part
+        self.data.resize(self.size, refcheck=False)
+        return self.data
+
+def graph_key(graph):
+    # Content hash of a compiled graph, the one key of result cache entries and CH indexes.
+    # Independent of how the graph was built: nodes are renumbered by first appearance along the
+    # edge list, weights are hashed as float64 and isolated nodes by sorted label, so an upload,
+    # a session compile and a CSV read by from_df of the same edges agree
+    ends = np.column_stack([graph.src, graph.dst]).ravel()
+    seen, first = np.unique(ends, return_index=True)
+    order = seen[np.argsort(first)]
+    canonical = np.empty(graph.n_nodes, dtype=np.int64)
+    canonical[order] = np.arange(len(order))
+    isolated = np.setdiff1d(np.arange(graph.n_nodes), seen)
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update("\x1f".join(map(str, graph.labels[order])).encode())
+    digest.update(b"\x1e" + "\x1f".join(sorted(map(str, graph.labels[isolated]))).encode())
+    for array in (canonical[graph.src], canonical[graph.dst], np.asarray(graph.weight, dtype=np.float64)):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+def compile_edges(source, fmt=None, chunksize=CHUNK_ROWS):
+    # Stream an edge file into a CompiledGraph: int32 node ids, int64 weights when every weight
+    # is integral and float64 otherwise (full precision, as from_df keeps them). Node labels are
+    # mapped to ids chunk by chunk. Other columns that are numeric on every edge become resources
+    # (as in CompiledGraph.from_df)
+    node_id = {}
+    src, dst = GrowableArray(np.int32), GrowableArray(np.int32)
+    weights = GrowableArray(np.float64)
+    integral = True
+    resources = None
+
+    for chunk in read_chunks(source, fmt, chunksize):
+        if not {"source", "target", "weight"} <= set(chunk.columns):
+            raise ValueError("The edge file needs source, target and weight columns")
+        if resources is None:
+            resources = {name: GrowableArray(np.float64) for name in chunk.columns
+                         if name not in ("source", "target", "weight")}
+        chunk = chunk[chunk["source"].notna()]
+        is_edge = (chunk["source"].notna() & chunk["target"].notna()).to_numpy()
+        sources = chunk["source"].to_numpy()
+        targets = chunk["target"].to_numpy()[is_edge]
+
+        # Factorize inside the chunk, then translate the chunk's unique labels to global ids
+        codes, uniques = pd.factorize(np.concatenate([sources, targets]))
+        ids = np.fromiter((node_id.setdefault(label, len(node_id)) for label in uniques), np.int32, len(uniques))
+        codes = ids[codes]
+        src.extend(codes[:len(sources)][is_edge])
+        dst.extend(codes[len(sources):])
+
+        chunk_weights = pd.to_numeric(chunk["weight"][is_edge]).to_numpy(dtype=np.float64)
+        integral = integral and bool(np.all(np.mod(chunk_weights, 1) == 0))
+        weights.extend(chunk_weights)
+        for name in list(resources):
+            values = pd.to_numeric(chunk[name][is_edge], errors="coerce").to_numpy(dtype=np.float64)
+            if np.isnan(values).any():
+                del resources[name]
+            else:
+                resources[name].extend(values)
+
+    weight = weights.array()
+    weight = weight.astype(np.int64) if integral else weight
+    labels = np.empty(len(node_id), dtype=object)
+    labels[:] = list(node_id)
+    graph = CompiledGraph(labels, src.array(), dst.array(), weight)
+    graph.resources = {name: values.array() for name, values in (resources or {}).items()}
+    graph.key = graph_key(graph)
+    return graph
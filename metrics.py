@@ -0,0 +1,305 @@
+import os
+import glob
+import json
+import time
+import uuid
+import fcntl
+import atexit
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+# Counters, gauges and histograms of this process, rendered in the Prometheus text format.
+# Gunicorn workers and background solve jobs are separate processes: each one writes its values
+# to METRICS_DIR and /metrics adds them up, values of exited processes are folded into one file.
+# METRICS_DIR="" keeps the metrics of the serving process only
+METRICS_DIR = os.environ.get("METRICS_DIR", os.path.join("cache", "metrics"))
+# Requests slower than PROFILE_SLOW_MS are profiled into PROFILE_DIR, unset turns profiling off.
+# PROFILER=pyinstrument writes html reports instead of cProfile .prof files
+PROFILE_SLOW_MS = os.environ.get("PROFILE_SLOW_MS")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join("cache", "profiles"))
+PROFILER = os.environ.get("PROFILER", "cprofile")
+# Seconds between two writes of this process's values to METRICS_DIR
+FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", 5))
+PREFIX = "shortest_path_"
+# Histogram buckets in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0, float("inf"))
+
+HELP = {
+    "callback_seconds": "Dash callback and route latency, JSON serialization included",
+    "response_bytes_total": "Response body bytes",
+    "phase_seconds": "Time spent per phase (compile, dataframe, model_build, solve, elements, other)",
+    "cpsat_solves_total": "CP-SAT solves by status",
+    "cpsat_branches_total": "CP-SAT search branches",
+    "cpsat_conflicts_total": "CP-SAT conflicts",
+    "cpsat_wall_seconds": "CP-SAT wall time",
+    "result_cache_hits_total": "Queries answered from the result cache",
+    "unsolved_total": "Exact solves that ended without a path, by backend and status",
+    "graph_cache_hits_total": "Compiled graph cache hits",
+    "graph_cache_misses_total": "Compiled graph cache misses",
+    "graph_nodes": "Nodes of the last compiled graph",
+    "graph_edges": "Edges of the last compiled graph",
+    "graph_cache_entries": "Compiled graphs held in memory",
+}
+
+_lock = threading.Lock()
+# Request threads of one process share its snapshot file
+_flush_lock = threading.Lock()
+_local = threading.local()
+
+def _reset():
+    global _counters, _gauges, _histograms, _process, _flusher
+    _counters, _gauges, _histograms = {}, {}, {}
+    _process = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    # Threads do not survive a fork, a child starts its own flusher
+    _flusher = None
+
+_reset()
+# A forked job or worker starts from zero, otherwise its parent's values would be counted twice
+os.register_at_fork(after_in_child=_reset)
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * len(BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram[i] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+@contextmanager
+def timer(phase, **labels):
+    # Phase time, nested phases are observed too but only outermost ones count toward the request
+    depth = getattr(_local, "depth", 0)
+    _local.depth = depth + 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _local.depth = depth
+        observe("phase_seconds", elapsed, phase=phase, **labels)
+        if depth == 0:
+            _local.phases = getattr(_local, "phases", 0.0) + elapsed
+
+def timed(phase):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(phase):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record_cpsat(solver, status_name):
+    inc("cpsat_solves_total", status=status_name)
+    inc("cpsat_branches_total", solver.NumBranches())
+    inc("cpsat_conflicts_total", solver.NumConflicts())
+    observe("cpsat_wall_seconds", solver.WallTime())
+
+def begin_request():
+    _local.start = time.perf_counter()
+    _local.phases = 0.0
+    _local.profiler = _start_profiler()
+
+def end_request(name, size):
+    # Latency of one request; whatever no phase accounts for (mostly JSON serialization and Dash
+    # dispatch) is observed as the "other" phase
+    elapsed = time.perf_counter() - _local.start
+    observe("callback_seconds", elapsed, callback=name)
+    observe("phase_seconds", max(elapsed - _local.phases, 0.0), phase="other")
+    inc("response_bytes_total", size, callback=name)
+    _stop_profiler(_local.profiler, elapsed, name)
+    _start_flusher()
+
+def _start_flusher():
+    # Values are written every FLUSH_SECONDS by a thread of their own instead of on every request,
+    # and once more when the process exits. /metrics reads the serving process from memory
+    global _flusher
+    if _flusher is not None or not METRICS_DIR:
+        return
+    with _lock:
+        if _flusher is not None:
+            return
+        _flusher = threading.Thread(target=_flush_loop, daemon=True)
+    _flusher.start()
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_SECONDS)
+        flush()
+
+def _start_profiler():
+    if PROFILE_SLOW_MS is None:
+        return None
+    if PROFILER == "pyinstrument":
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+    else:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    return profiler
+
+def _stop_profiler(profiler, elapsed, name):
+    if profiler is None:
+        return
+    if PROFILER == "pyinstrument":
+        profiler.stop()
+    else:
+        profiler.disable()
+    if elapsed * 1000 < float(PROFILE_SLOW_MS):
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stem = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{int(elapsed * 1000)}ms-"
+                        + "".join(c if c.isalnum() else "_" for c in name)[:60])
+    if PROFILER == "pyinstrument":
+        with open(stem + ".html", "w") as f:
+            f.write(profiler.output_html())
+    else:
+        profiler.dump_stats(stem + ".prof")
+
+def _snapshot():
+    with _lock:
+        return {
+            "counters": [[name, labels, value] for (name, labels), value in _counters.items()],
+            "gauges": [[name, labels, value] for (name, labels), value in _gauges.items()],
+            "histograms": [[name, labels, list(values)] for (name, labels), values in _histograms.items()],
+        }
+
+def flush():
+    # Publish this process's values for /metrics of the other processes
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"{_process}.json")
+    with _flush_lock:
+        with open(path + ".tmp", "w") as f:
+            json.dump(_snapshot(), f)
+        os.replace(path + ".tmp", path)
+
+atexit.register(flush)
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _add(total, snapshot, gauges=True):
+    for name, labels, value in snapshot["counters"]:
+        key = _key(name, dict(labels))
+        total["counters"][key] = total["counters"].get(key, 0) + value
+    for name, labels, values in snapshot["histograms"]:
+        key = _key(name, dict(labels))
+        current = total["histograms"].get(key)
+        total["histograms"][key] = values if current is None else [a + b for a, b in zip(current, values)]
+    if gauges:
+        for name, labels, value in snapshot["gauges"]:
+            total["gauges"][_key(name, dict(labels))] = value
+
+def _collect():
+    # Own values from memory, other live processes from their files. Files of exited processes
+    # are folded into retired.json (counters and histograms only, their gauges are stale)
+    total = {"counters": {}, "gauges": {}, "histograms": {}}
+    _add(total, _snapshot())
+    if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+        return total, {}
+    gauges_by_pid = {}
+    with open(os.path.join(METRICS_DIR, "merge.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        retired_path = os.path.join(METRICS_DIR, "retired.json")
+        retired = {"counters": {}, "gauges": {}, "histograms": {}}
+        if os.path.exists(retired_path):
+            with open(retired_path) as f:
+                _add(retired, json.load(f), gauges=False)
+        folded = []
+        for path in glob.glob(os.path.join(METRICS_DIR, "*-*.json")):
+            process = os.path.basename(path)[:-len(".json")]
+            if process == _process:
+                continue
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            pid = int(process.split("-")[0])
+            if _alive(pid):
+                _add(total, snapshot, gauges=False)
+                gauges_by_pid[pid] = snapshot["gauges"]
+            else:
+                _add(retired, snapshot, gauges=False)
+                folded.append(path)
+        if folded:
+            with open(retired_path + ".tmp", "w") as f:
+                json.dump({
+                    "counters": [[n, list(l), v] for (n, l), v in retired["counters"].items()],
+                    "gauges": [],
+                    "histograms": [[n, list(l), v] for (n, l), v in retired["histograms"].items()],
+                }, f)
+            os.replace(retired_path + ".tmp", retired_path)
+            for path in folded:
+                os.remove(path)
+        for key, value in retired["counters"].items():
+            total["counters"][key] = total["counters"].get(key, 0) + value
+        for key, values in retired["histograms"].items():
+            current = total["histograms"].get(key)
+            total["histograms"][key] = values if current is None else [a + b for a, b in zip(current, values)]
+    return total, gauges_by_pid
+
+def _format_labels(labels, **extra):
+    pairs = list(labels) + sorted((k, str(v)) for k, v in extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+def render():
+    # Prometheus text exposition format
+    total, gauges_by_pid = _collect()
+    lines = []
+    typed = set()
+
+    def header(name, kind):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# HELP {PREFIX}{name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+    for (name, labels), value in sorted(total["counters"].items()):
+        header(name, "counter")
+        lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+    # Gauges describe one process each
+    for (name, labels), value in sorted(total["gauges"].items()):
+        header(name, "gauge")
+        lines.append(f"{PREFIX}{name}{_format_labels(labels, pid=os.getpid())} {value}")
+    for pid, gauges in sorted(gauges_by_pid.items()):
+        for name, labels, value in gauges:
+            header(name, "gauge")
+            lines.append(f"{PREFIX}{name}{_format_labels([tuple(label) for label in labels], pid=pid)} {value}")
+    for (name, labels), values in sorted(total["histograms"].items()):
+        header(name, "histogram")
+        for bound, count in zip(BUCKETS, values):
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, le=le)} {count}")
+        lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {values[-2]}")
+        lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {values[-1]}")
+    return "\n".join(lines) + "\n"
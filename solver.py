@@ -54,52 +54,997 @@
 
 #     return path, total_weight
 
+import time
+import os
+import heapq
+import json
+import sqlite3
+import importlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import cached_property
 import pandas as pd
 import numpy as np
-from ortools.sat.python import cp_model
-
-def find_shortest_path_ortools(df, source_node, target_node):
-    # Initialize OR-Tools CP-SAT model
-    model = cp_model.CpModel()
-
-    # Extract all unique points
-    all_points = list(set(df['source']).union(set(df['target'])))
-    n_points = len(all_points)
-    n_paths = len(df)
-
-    # Decision variables: x[p] is 1 if path p is used, 0 otherwise
-    x = [model.NewIntVar(0, 1, f'x[{p}]') for p in range(n_paths)]
-
-    # Objective function: Minimize the total distance
-    model.Minimize(sum(x[p] * df['weight'].iloc[p] for p in range(n_paths)))
-
-    # Constraints: Ensure the source and target nodes have exactly one path leaving/entering
-    model.Add(sum(x[p] for p in range(n_paths) if df['source'].iloc[p] == source_node) == 1)
-    model.Add(sum(x[p] for p in range(n_paths) if df['target'].iloc[p] == target_node) == 1)
-
-    # Constraints: Flow conservation for all middle nodes
-    middle_points = [point for point in all_points if point not in [source_node, target_node]]
-    for node in middle_points:
-        sum_in = sum(x[p] for p in range(n_paths) if df['target'].iloc[p] == node)
-        sum_out = sum(x[p] for p in range(n_paths) if df['source'].iloc[p] == node)
-        model.Add(sum_in == sum_out)
-
-    # Solve the model
-    solver = cp_model.CpSolver()
-    status = solver.Solve(model)
-
-    # Extract and return the solution
-    if status in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
-        path = []
-        total_weight = solver.ObjectiveValue()
-        for p in range(n_paths):
-            if solver.Value(x[p]) == 1:
-                path.append((df['source'].iloc[p], df['target'].iloc[p]))
-
-        return path, total_weight
+
+import metrics
+
+# OR-Tools is imported where a model is built or solved, not here: web workers that only run
+# graph searches never load it
+
+def _incidence(ids, n_nodes):
+    # Group edge indices by node id: the edges of node i are order[ptr[i]:ptr[i + 1]]
+    order = np.argsort(ids, kind="stable")
+    ptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(ids, minlength=n_nodes), out=ptr[1:])
+    return order, ptr
+
+class CompiledGraph:
+    # Edge list with integer node ids and CSR incidence, shared by every backend
+    def __init__(self, labels, src, dst, weight):
+        self.labels = labels
+        self.node_id = {label: i for i, label in enumerate(labels)}
+        self.src = src
+        self.dst = dst
+        self.weight = weight
+        self.out_order, self.out_ptr = _incidence(src, len(labels))
+        self.in_order, self.in_ptr = _incidence(dst, len(labels))
+        # Content hash, set by whoever compiled the graph
+        self.key = None
+        # Session version the graph was compiled from (graph_store), None for other graphs
+        self.version = None
+        # Extra per-edge costs by name (e.g. time, toll), budgets of constrained paths refer to them
+        self.resources = {}
+        self._sort_orders = {}
+
+    @classmethod
+    def from_df(cls, df):
+        # Rows without a target only declare an isolated node, they are not edges
+        is_edge = (df['source'].notna() & df['target'].notna()).to_numpy()
+        sources = df['source'].to_numpy()[is_edge]
+        targets = df['target'].to_numpy()[is_edge]
+        weights = pd.to_numeric(df['weight'][is_edge]).to_numpy(dtype=np.float64)
+
+        # Factorize node labels into integer ids once, isolated nodes come last
+        isolated = df['source'][~is_edge & df['source'].notna().to_numpy()].to_numpy()
+        codes, labels = pd.factorize(np.concatenate([sources, targets, isolated]))
+        n_edges = len(sources)
+        src = codes[:n_edges].astype(np.int32)
+        dst = codes[n_edges:2 * n_edges].astype(np.int32)
+        graph = cls(np.asarray(labels, dtype=object), src, dst, weights)
+        # Numeric columns besides source/target/weight become edge resources
+        for column in df.columns.difference(['source', 'target', 'weight']):
+            values = pd.to_numeric(df[column][is_edge], errors='coerce').to_numpy(dtype=np.float64)
+            if not np.isnan(values).any():
+                graph.resources[column] = values
+        graph.df = df
+        return graph
+
+    def __getstate__(self):
+        # Ship only the edge arrays (e.g. to pool workers), incidence and caches are rebuilt lazily
+        return {"labels": self.labels, "src": self.src, "dst": self.dst, "weight": self.weight, "key": self.key,
+                "version": self.version, "resources": self.resources}
+
+    def __setstate__(self, state):
+        self.__init__(state["labels"], state["src"], state["dst"], state["weight"])
+        self.key = state["key"]
+        self.version = state.get("version")
+        self.resources = state.get("resources", {})
+
+    @classmethod
+    def from_records(cls, records):
+        return cls.from_df(pd.DataFrame(records, columns=['source', 'target', 'weight']))
+
+    @property
+    def n_nodes(self):
+        return len(self.labels)
+
+    @property
+    def n_edges(self):
+        return len(self.src)
+
+    @cached_property
+    def has_negative_weights(self):
+        return bool(np.any(self.weight < 0))
+
+    @cached_property
+    @metrics.timed("dataframe")
+    def df(self):
+        # source/target/weight records, isolated nodes as rows without a target
+        edges = pd.DataFrame({'source': self.labels[self.src], 'target': self.labels[self.dst], 'weight': self.weight})
+        isolated = np.setdiff1d(np.arange(self.n_nodes), np.concatenate([self.src, self.dst]))
+        if len(isolated) == 0:
+            return edges
+        nodes = pd.DataFrame({'source': self.labels[isolated], 'target': None, 'weight': None})
+        return pd.concat([edges, nodes], ignore_index=True)
+
+    @cached_property
+    def records(self):
+        # The df rows as store records (None for missing values), shared: copy before editing
+        return self.df.astype(object).where(self.df.notna(), None).to_dict('records')
+
+    @cached_property
+    def node_names(self):
+        return sorted(self.labels)
+
+    @cached_property
+    def edge_names(self):
+        return [f"{self.labels[u]}->{self.labels[v]}" for u, v in zip(self.src.tolist(), self.dst.tolist())]
+
+    @cached_property
+    def flow_model(self):
+        return FlowModel(self)
+
+    @cached_property
+    def network_flow(self):
+        return NetworkFlow(self)
+
+    @cached_property
+    def has_negative_cycle(self):
+        # Bellman-Ford from a virtual source joined to every node: distances still dropping after
+        # n rounds mean a cycle of negative total weight
+        if not self.has_negative_weights:
+            return False
+        dist = np.zeros(self.n_nodes)
+        for _ in range(self.n_nodes):
+            relaxed = dist.copy()
+            np.minimum.at(relaxed, self.dst, dist[self.src] + self.weight)
+            if np.array_equal(relaxed, dist):
+                return False
+            dist = relaxed
+        return True
+
+    @cached_property
+    def forward(self):
+        # CSR adjacency as plain lists (offsets, heads, weights, edge ids), fastest for heap loops
+        return (self.out_ptr.tolist(), self.dst[self.out_order].tolist(),
+                self.weight[self.out_order].tolist(), self.out_order.tolist())
+
+    @cached_property
+    def backward(self):
+        return (self.in_ptr.tolist(), self.src[self.in_order].tolist(),
+                self.weight[self.in_order].tolist(), self.in_order.tolist())
+
+    def sort_order(self, column, descending=False):
+        # Positions of the df rows sorted by a column (stable, missing values last), computed once
+        # per graph and column: every edit compiles a new graph
+        key = (column, descending)
+        order = self._sort_orders.get(key)
+        if order is None:
+            order = self._sort_orders[key] = np.asarray(self.df[column].reset_index(drop=True).sort_values(
+                ascending=not descending, kind="stable", na_position="last").index)
+        return order
+
+    def out_edges(self, node):
+        return self.out_order[self.out_ptr[node]:self.out_ptr[node + 1]]
+
+    def in_edges(self, node):
+        return self.in_order[self.in_ptr[node]:self.in_ptr[node + 1]]
+
+    def edge_path(self, edge_ids):
+        # Map edge ids back to (source, target) label pairs
+        return [(self.labels[self.src[e]], self.labels[self.dst[e]]) for e in edge_ids]
+
+def _add_linear(proto, var_ids, coeffs, lb, ub):
+    # Append sum(coeffs * x[var_ids]) in [lb, ub] straight to the model proto
+    ct = proto.constraints.add()
+    ct.linear.vars.extend(var_ids)
+    ct.linear.coeffs.extend(coeffs)
+    ct.linear.domain.extend([lb, ub])
+    return ct
+
+def _set_objective(proto, weights):
+    # CP-SAT takes integer objective coefficients, fall back to the floating point objective otherwise
+    if np.all(np.mod(weights, 1) == 0):
+        proto.objective.vars.extend(range(len(weights)))
+        proto.objective.coeffs.extend(weights.astype(np.int64).tolist())
     else:
-        print(f'Solution Status: {solver.StatusName(status)}')
+        proto.floating_point_objective.vars.extend(range(len(weights)))
+        proto.floating_point_objective.coeffs.extend(weights.astype(np.float64).tolist())
+
+class FlowModel:
+    # Persistent CP-SAT min-cost flow model of one graph. Edge variables, objective and the flow
+    # rows are built once; a query only rewrites the right-hand sides (the supply vector)
+    @metrics.timed("model_build")
+    def __init__(self, graph):
+        from ortools.sat import cp_model_pb2
+        from ortools.sat.python import cp_model
+
+        self.graph = graph
+        self.model = cp_model.CpModel()
+        proto = self.model.Proto()
+
+        # Decision variables: x[p] is 1 if path p is used, 0 otherwise
+        proto.variables.extend([cp_model_pb2.IntegerVariableProto(domain=[0, 1])] * graph.n_edges)
+
+        # Objective function: Minimize the total distance
+        _set_objective(proto, graph.weight)
+
+        # Constraints: out - in == supply[i] for every node, row i belongs to node i
+        for node in range(graph.n_nodes):
+            sum_out = graph.out_edges(node).tolist()
+            sum_in = graph.in_edges(node).tolist()
+            _add_linear(proto, sum_out + sum_in, [1] * len(sum_out) + [-1] * len(sum_in), 0, 0)
+        self.supply = np.zeros(graph.n_nodes, dtype=np.int64)
+        self._hinted = False
+        self._lock = threading.Lock()
+
+    def set_supply(self, supply):
+        # Only rows whose right-hand side changed are rewritten
+        proto = self.model.Proto()
+        for node in np.flatnonzero(supply != self.supply).tolist():
+            proto.constraints[node].linear.domain[:] = [int(supply[node])] * 2
+        self.supply = supply.copy()
+
+    def hint(self, solution):
+        # Seed the next solve with a previous assignment, CP-SAT repairs it when infeasible
+        hint = self.model.Proto().solution_hint
+        if not self._hinted:
+            hint.vars.extend(range(self.graph.n_edges))
+            self._hinted = True
+        hint.values[:] = solution
+
+    def solve_supply(self, supply, stats=None, max_time=None, workers=None, on_solution=None):
+        # Returns the status name, the ids of the used edges and the objective value.
+        # With max_time the best path found so far is returned as FEASIBLE, stats then hold its
+        # gap to the best bound. on_solution(objective, bound) is called for every improving solution
+        from ortools.sat.python import cp_model
+
+        with self._lock:
+            start = time.perf_counter()
+            self.set_supply(supply)
+            build_time = time.perf_counter() - start
+
+            solver = cp_model.CpSolver()
+            if max_time is not None:
+                solver.parameters.max_time_in_seconds = float(max_time)
+            if workers is not None:
+                solver.parameters.num_workers = int(workers)
+            if on_solution is not None:
+                status = solver.Solve(self.model, _solution_stream(on_solution))
+            else:
+                status = solver.Solve(self.model)
+            solve_time = time.perf_counter() - start - build_time
+
+            metrics.record_cpsat(solver, solver.StatusName(status))
+            if stats is not None:
+                stats["build_time"] = stats.get("build_time", 0.0) + build_time
+                stats.update(
+                    solve_time=solve_time, status=solver.StatusName(status), branches=solver.NumBranches(),
+                    conflicts=solver.NumConflicts(), wall_time=solver.WallTime(),
+                )
+            if status not in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
+                return solver.StatusName(status), None, None
+            if stats is not None:
+                stats.update(best_bound=solver.BestObjectiveBound(), gap=optimality_gap(solver, status))
+            solution = list(solver.ResponseProto().solution)
+            self.hint(solution)
+            return solver.StatusName(status), np.flatnonzero(np.asarray(solution) == 1), solver.ObjectiveValue()
+
+    def solve(self, source_node, target_node, stats=None, **options):
+        source_id = self.graph.node_id.get(source_node)
+        target_id = self.graph.node_id.get(target_node)
+        if source_id is None or target_id is None:
+            return "INFEASIBLE", None, None
+
+        # Net flow of one unit leaves the source and enters the target, flow is conserved everywhere
+        # else (net rather than raw counts, so detached cycles cannot fake a path)
+        supply = np.zeros(self.graph.n_nodes, dtype=np.int64)
+        supply[source_id] += 1
+        supply[target_id] -= 1
+        return self.solve_supply(supply, stats, **options)
+
+def _solution_stream(on_solution):
+    # CP-SAT callback reporting every improving solution while the search goes on
+    from ortools.sat.python import cp_model
+
+    class SolutionStream(cp_model.CpSolverSolutionCallback):
+        def on_solution_callback(self):
+            on_solution(self.ObjectiveValue(), self.BestObjectiveBound())
+    return SolutionStream()
+
+def optimality_gap(solver, status):
+    # Relative optimality gap of the returned solution, 0 once it is proven optimal
+    if solver.StatusName(status) == "OPTIMAL":
+        return 0.0
+    objective = solver.ObjectiveValue()
+    return abs(objective - solver.BestObjectiveBound()) / max(abs(objective), 1e-9)
+
+# Fractional weights are scaled by this and rounded for the integer network simplex
+COST_SCALE = 10**6
+
+class NetworkFlow:
+    # The same unit-supply min-cost flow as FlowModel (one arc of capacity 1 per edge, balance
+    # rows per node), solved by OR-Tools' network simplex in polynomial time. Arcs are added once
+    # per graph, a query only moves the supply of one unit to its source and target. Each solve
+    # still starts from scratch, SimpleMinCostFlow keeps no basis between solves
+    def __init__(self, graph):
+        from ortools.graph.python import min_cost_flow
+
+        self.graph = graph
+        self.scale = 1 if np.all(np.mod(graph.weight, 1) == 0) else COST_SCALE
+        self.flow = min_cost_flow.SimpleMinCostFlow()
+        self.arcs = self.flow.add_arcs_with_capacity_and_unit_cost(
+            graph.src.astype(np.int32), graph.dst.astype(np.int32), np.ones(graph.n_edges, dtype=np.int64),
+            np.rint(graph.weight * self.scale).astype(np.int64),
+        )
+        # Isolated nodes past the last edge endpoint still need a supply slot
+        if graph.n_nodes:
+            self.flow.set_node_supply(graph.n_nodes - 1, 0)
+        self.supplied = []
+        self._lock = threading.Lock()
+
+    def solve(self, source_id, target_id, stats=None):
+        # Returns the status name and the ids of the edges carrying flow (None unless OPTIMAL)
+        with self._lock:
+            start = time.perf_counter()
+            for node in self.supplied:
+                self.flow.set_node_supply(node, 0)
+            self.flow.set_node_supply(source_id, 1)
+            self.flow.set_node_supply(target_id, -1)
+            self.supplied = [source_id, target_id]
+            status = self.flow.solve()
+            if stats is not None:
+                stats.update(solve_time=time.perf_counter() - start, status=status.name)
+            if status != self.flow.OPTIMAL:
+                return status.name, None
+            return status.name, self.arcs[self.flow.flows(self.arcs) > 0].tolist()
+
+def _simple_path(graph, edges, source_id, target_id):
+    # Walk the flow-carrying edges from the source to the target, cutting out any zero weight
+    # cycles the flow passes through (with no negative cycles an optimal flow has no other kind)
+    out = {}
+    for e in edges:
+        out.setdefault(int(graph.src[e]), []).append(e)
+    path, position, node = [], {source_id: 0}, source_id
+    while node != target_id:
+        e = out[node].pop()
+        node = int(graph.dst[e])
+        if node in position:
+            del path[position[node]:]
+            position = {int(graph.src[edge]): i for i, edge in enumerate(path)}
+            position[node] = len(path)
+            continue
+        path.append(e)
+        position[node] = len(path)
+    return path
+
+# Nodes with more out-edges than this are not searched for two-edge detours that dominate an edge
+DOMINANCE_DEGREE = 32
+
+def reduce_graph(graph, source_id, target_id):
+    # Smaller graph with the same shortest source -> target path, for the CP-SAT model (one variable
+    # per edge, one row per node). Returns the reduced graph, the original edge ids behind every
+    # reduced edge (in path order) and how many edges each step removed.
+    # Exact unless the graph has negative cycles, where the shortest path is not defined anyway
+    n = graph.n_nodes
+    counts = dict.fromkeys(["self_loops", "endpoint_edges", "parallel", "unreachable", "dominated", "contracted"], 0)
+    out = [dict() for _ in range(n)]
+    inc = [dict() for _ in range(n)]
+
+    def add(u, v, weight, chain):
+        # Keep the lighter of parallel edges
+        if u == v:
+            counts["self_loops"] += 1
+        elif v == source_id or u == target_id:
+            counts["endpoint_edges"] += 1
+        elif v in out[u] and out[u][v][0] <= weight:
+            counts["parallel"] += 1
+        else:
+            if v in out[u]:
+                counts["parallel"] += 1
+            out[u][v] = inc[v][u] = (weight, chain)
+
+    def remove(u, v):
+        del out[u][v], inc[v][u]
+
+    for e, (u, v, weight) in enumerate(zip(graph.src.tolist(), graph.dst.tolist(), graph.weight.tolist())):
+        add(u, v, weight, (e,))
+
+    # Nodes on a source -> target path are reachable from the source and reach the target
+    def reach(start, adjacency):
+        seen, stack = {start}, [start]
+        while stack:
+            for v in adjacency[stack.pop()]:
+                if v not in seen:
+                    seen.add(v)
+                    stack.append(v)
+        return seen
+    keep = reach(source_id, out) & reach(target_id, inc)
+    for u in range(n):
+        for v in [v for v in out[u] if u not in keep or v not in keep]:
+            remove(u, v)
+            counts["unreachable"] += 1
+
+    # An edge is dominated when a two-edge detour through another node is strictly shorter
+    for u in keep:
+        if len(out[u]) > DOMINANCE_DEGREE:
+            continue
+        for v, (weight, _) in list(out[u].items()):
+            if any(x in inc[v] and out[u][x][0] + inc[v][x][0] < weight for x in out[u] if x != v):
+                remove(u, v)
+                counts["dominated"] += 1
+
+    # Contract chain nodes: one way through (u -> v -> w), or a two-way street between two neighbors
+    candidates = [v for v in keep if v != source_id and v != target_id]
+    while candidates:
+        v = candidates.pop()
+        ins, outs = set(inc[v]), set(out[v])
+        if len(ins) == 1 and len(outs) == 1:
+            pairs = [(next(iter(ins)), next(iter(outs)))]
+        elif len(ins) == 2 and ins == outs:
+            u, w = ins
+            pairs = [(u, w), (w, u)]
+        else:
+            continue
+        through = [(u, w, inc[v][u][0] + out[v][w][0], inc[v][u][1] + out[v][w][1]) for u, w in pairs]
+        for u in ins:
+            remove(u, v)
+        for w in outs:
+            remove(v, w)
+        counts["contracted"] += 1
+        for u, w, weight, chain in through:
+            add(u, w, weight, chain)
+        candidates.extend(x for x in ins | outs if x != source_id and x != target_id)
+
+    nodes = sorted({source_id, target_id} | {u for u in keep if out[u] or inc[u]})
+    new_id = {u: i for i, u in enumerate(nodes)}
+    edges = [(u, v, weight, chain) for u in nodes for v, (weight, chain) in out[u].items()]
+    reduced = CompiledGraph(
+        graph.labels[nodes], np.array([new_id[u] for u, _, _, _ in edges], dtype=np.int32),
+        np.array([new_id[v] for _, v, _, _ in edges], dtype=np.int32),
+        np.array([weight for _, _, weight, _ in edges], dtype=graph.weight.dtype),
+    )
+    counts.update(variables_removed=graph.n_edges - reduced.n_edges, constraints_removed=n - reduced.n_nodes)
+    return reduced, [chain for _, _, _, chain in edges], counts
+
+# Shortest path backends: name -> function(graph, source_node, target_node, stats, **options) returning
+# (path, total_weight). Options a backend does not use (e.g. max_time) are ignored, except the
+# CONSTRAINT_OPTIONS: only backends registered with constrained=True may receive those
+BACKENDS = {}
+CONSTRAINED_BACKENDS = set()
+# Backends living in other modules, imported (and so registered) on first use
+BACKEND_MODULES = {"ch": "ch_index", "labeling": "constrained", "cpsat": "constrained", "constrained": "constrained"}
+
+def load_backend(name):
+    if name not in BACKENDS and name in BACKEND_MODULES:
+        importlib.import_module(BACKEND_MODULES[name])
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name}, choose from {sorted(set(BACKENDS) | set(BACKEND_MODULES))}")
+    return BACKENDS[name]
+
+def register_backend(name, constrained=False):
+    def decorator(func):
+        BACKENDS[name] = func
+        if constrained:
+            CONSTRAINED_BACKENDS.add(name)
+        return func
+    return decorator
+
+@register_backend("ortools")
+def _solve_ortools(graph, source_node, target_node, stats=None, max_time=None, workers=None, on_solution=None,
+                   reduce=False):
+    # By default the graph's persistent model answers every query with only the supply swapped
+    # and earlier solutions as hints. reduce=True builds a per-query model of the reduced graph
+    # instead: worth it for inputs with many dead ends, chains and parallel edges, a net loss on
+    # most others (building it walks every edge in Python and discards the persistent model)
+    start = time.perf_counter()
+    source_id, target_id = lookup_nodes(graph, source_node, target_node)
+    chains = None
+    if reduce and source_id is not None and target_id is not None:
+        reduced, chains, counts = reduce_graph(graph, source_id, target_id)
+        model = FlowModel(reduced)
+        if stats is not None:
+            stats["reduction"] = counts
+    else:
+        model = graph.flow_model
+    if stats is not None:
+        stats["build_time"] = stats.get("build_time", 0.0) + time.perf_counter() - start
+
+    status, used, total_weight = model.solve(
+        source_node, target_node, stats, max_time=max_time, workers=workers, on_solution=on_solution
+    )
+    if used is None:
+        metrics.inc("unsolved_total", backend="ortools", status=status)
+        return None, None
+    if chains is not None:
+        used = [e for reduced_edge in used.tolist() for e in chains[reduced_edge]]
+    # A solution cut short by max_time may also route flow around cycles off the path: only the
+    # source -> target walk is returned, weighed by its own edges
+    return _path_result(graph, _simple_path(graph, [int(e) for e in used], source_id, target_id))
+
+@register_backend("min_cost_flow")
+def _solve_min_cost_flow(graph, source_node, target_node, stats=None, **options):
+    # Exact for negative weights too, as long as no cycle has a negative total weight
+    source_id, target_id = lookup_nodes(graph, source_node, target_node)
+    if source_id is None or target_id is None:
+        return None, None
+    if source_id == target_id:
+        return [], 0.0
+    if graph.has_negative_cycle:
+        raise ValueError(NEGATIVE_CYCLE)
+    start = time.perf_counter()
+    model = graph.network_flow
+    if stats is not None:
+        stats["build_time"] = stats.get("build_time", 0.0) + time.perf_counter() - start
+    status, used = model.solve(source_id, target_id, stats)
+    if used is None:
+        metrics.inc("unsolved_total", backend="min_cost_flow", status=status)
+        return None, None
+    return _path_result(graph, _simple_path(graph, used, source_id, target_id))
+
+def find_shortest_path_ortools(df, source_node, target_node, stats=None):
+    start = time.perf_counter()
+    graph = CompiledGraph.from_df(df)
+    if stats is not None:
+        stats["build_time"] = time.perf_counter() - start
+    return _solve_ortools(graph, source_node, target_node, stats)
+
+def _trace(graph, pred, node):
+    # Follow predecessor edges back to the search root
+    edges = []
+    while node in pred:
+        edge = pred[node]
+        edges.append(edge)
+        node = int(graph.src[edge])
+    edges.reverse()
+    return edges
+
+def _trace_tree(graph, pred, node):
+    # _trace over a search tree's predecessor array (-1 at the root and unreached nodes)
+    edges = []
+    while pred[node] >= 0:
+        edge = int(pred[node])
+        edges.append(edge)
+        node = int(graph.src[edge])
+    edges.reverse()
+    return edges
+
+def _path_result(graph, edges):
+    return graph.edge_path(edges), float(graph.weight[edges].sum()) if edges else 0.0
+
+def _astar(graph, source_id, target_id, heuristic):
+    indptr, heads, weights, edge_ids = graph.forward
+    dist = {source_id: 0.0}
+    pred = {}
+    done = set()
+    heap = [(heuristic(source_id), source_id)]
+    while heap:
+        _, u = heapq.heappop(heap)
+        if u == target_id:
+            return _trace(graph, pred, u)
+        if u in done:
+            continue
+        done.add(u)
+        d = dist[u]
+        for k in range(indptr[u], indptr[u + 1]):
+            v = heads[k]
+            nd = d + weights[k]
+            if nd < dist.get(v, float("inf")):
+                dist[v] = nd
+                pred[v] = edge_ids[k]
+                heapq.heappush(heap, (nd + heuristic(v), v))
+    return None
+
+def lookup_nodes(graph, source_node, target_node):
+    return graph.node_id.get(source_node), graph.node_id.get(target_node)
+
+@register_backend("dijkstra")
+def _solve_dijkstra(graph, source_node, target_node, stats=None, **options):
+    return _solve_astar(graph, source_node, target_node, stats, heuristic=lambda node: 0.0)
+
+@register_backend("astar")
+def _solve_astar(graph, source_node, target_node, stats=None, heuristic=None, **options):
+    # heuristic(node_id) must never overestimate the remaining distance to the target
+    source_id, target_id = lookup_nodes(graph, source_node, target_node)
+    if source_id is None or target_id is None:
         return None, None
+    edges = _astar(graph, source_id, target_id, heuristic or (lambda node: 0.0))
+    if edges is None:
+        return None, None
+    return _path_result(graph, edges)
+
+@register_backend("bidirectional")
+def _solve_bidirectional(graph, source_node, target_node, stats=None, **options):
+    source_id, target_id = lookup_nodes(graph, source_node, target_node)
+    if source_id is None or target_id is None:
+        return None, None
+    if source_id == target_id:
+        return [], 0.0
+
+    # Alternate a forward search from the source and a backward search from the target
+    searches = [
+        (graph.forward, {source_id: 0.0}, {}, set(), [(0.0, source_id)]),
+        (graph.backward, {target_id: 0.0}, {}, set(), [(0.0, target_id)]),
+    ]
+    best, meeting = float("inf"), None
+    while searches[0][4] and searches[1][4]:
+        # Stop once no path through an unsettled node can beat the best meeting point
+        if searches[0][4][0][0] + searches[1][4][0][0] >= best:
+            break
+        side = 0 if len(searches[0][4]) <= len(searches[1][4]) else 1
+        (indptr, heads, weights, edge_ids), dist, pred, done, heap = searches[side]
+        other_dist = searches[1 - side][1]
+        d, u = heapq.heappop(heap)
+        if u in done:
+            continue
+        done.add(u)
+        for k in range(indptr[u], indptr[u + 1]):
+            v = heads[k]
+            nd = d + weights[k]
+            if nd < dist.get(v, float("inf")):
+                dist[v] = nd
+                pred[v] = edge_ids[k]
+                heapq.heappush(heap, (nd, v))
+            if v in other_dist and nd + other_dist[v] < best:
+                best, meeting = nd + other_dist[v], v
+    if meeting is None:
+        return None, None
+
+    # Forward half is traced from the source, backward half walks successor edges to the target
+    edges = _trace(graph, searches[0][2], meeting)
+    node, backward_pred = meeting, searches[1][2]
+    while node in backward_pred:
+        edge = backward_pred[node]
+        edges.append(edge)
+        node = int(graph.dst[edge])
+    return _path_result(graph, edges)
+
+NEGATIVE_CYCLE = "The graph has a negative cycle, shortest paths are not defined"
+
+# Options of constrained backends (see constrained.py)
+CONSTRAINT_OPTIONS = ("budgets", "required", "forbidden", "max_hops")
+
+def choose_backend(graph, constrained=False):
+    # Combinatorial searches need non-negative weights, the network simplex takes negative weights.
+    # With a negative cycle there is no shortest walk, so no backend is chosen (ValueError). Side
+    # constraints go to constrained.py, which picks labeling or CP-SAT itself (its paths are simple,
+    # so negative cycles are fine there)
+    if constrained:
+        return "constrained"
+    if graph.has_negative_cycle:
+        raise ValueError(NEGATIVE_CYCLE)
+    if graph.has_negative_weights:
+        return "min_cost_flow"
+    return "bidirectional"
+
+# Backends that are wrong or fail on negative edge weights
+NON_NEGATIVE_BACKENDS = {"dijkstra", "astar", "bidirectional", "ch"}
+
+def check_backend(graph, backend):
+    # ValueError when backend cannot answer unconstrained queries on graph, before any query runs
+    load_backend(backend)
+    if graph.has_negative_cycle:
+        raise ValueError(NEGATIVE_CYCLE)
+    if backend in NON_NEGATIVE_BACKENDS and graph.has_negative_weights:
+        raise ValueError(f"Backend {backend} needs non-negative edge weights, use min_cost_flow")
+
+def _json_default(value):
+    # numpy scalars from the graph arrays
+    return value.item()
+
+# Cache hits whose use time is written in one transaction
+TOUCH_BATCH = 256
+
+class ResultCache:
+    # Solved queries in a local SQLite file shared by every worker process, keyed by
+    # (graph content hash, source, target, backend). An edited graph gets a new hash, so its old
+    # entries are never hit again and age out through the least recently used eviction
+    def __init__(self, path, maxsize=100_000):
+        self.path = path
+        self.maxsize = maxsize
+        self._local = threading.local()
+        self._puts = 0
+        self._touched = {}
+        self._touch_lock = threading.Lock()
+        with self._connect() as db:
+            db.executescript("""
+                PRAGMA journal_mode = WAL;
+                CREATE TABLE IF NOT EXISTS results (
+                    graph TEXT, source TEXT, target TEXT, backend TEXT, path TEXT, weight,
+                    used REAL, PRIMARY KEY (graph, source, target, backend)
+                );
+                CREATE INDEX IF NOT EXISTS results_by_use ON results (used);
+            """)
+
+    def _connect(self):
+        # One connection per thread and process: sqlite3 connections are not thread-safe and one
+        # inherited through a fork (gunicorn preload) must not be used by the child
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = self._local.db = sqlite3.connect(self.path, timeout=30)
+            self._local.pid = os.getpid()
+        return db
+
+    def _row_key(self, key, source_node, target_node, backend):
+        # Labels are stored as JSON so numeric and text names do not collide
+        return key, json.dumps(source_node, default=_json_default), json.dumps(target_node, default=_json_default), backend
+
+    def get(self, key, source_node, target_node, backend):
+        # (path, total_weight) of a stored query or None, (None, None) is a stored "no path".
+        # A read only: hits are remembered and their use times written with the next batch
+        row_key = self._row_key(key, source_node, target_node, backend)
+        row = self._connect().execute(
+            "SELECT path, weight FROM results WHERE graph = ? AND source = ? AND target = ? AND backend = ?",
+            row_key,
+        ).fetchone()
+        if row is None:
+            return None
+        with self._touch_lock:
+            self._touched[row_key] = time.time()
+            full = len(self._touched) >= TOUCH_BATCH
+        if full:
+            with self._connect() as db:
+                self._write_touched(db)
+        if row[0] is None:
+            return None, None
+        return [tuple(edge) for edge in json.loads(row[0])], row[1]
+
+    def _write_touched(self, db):
+        with self._touch_lock:
+            touched, self._touched = self._touched, {}
+        db.executemany(
+            "UPDATE results SET used = ? WHERE graph = ? AND source = ? AND target = ? AND backend = ?",
+            [(used, *row_key) for row_key, used in touched.items()],
+        )
+
+    def put(self, key, source_node, target_node, backend, path, total_weight):
+        path = None if path is None else json.dumps(path, default=_json_default)
+        # weight has no column affinity so integer weights come back as integers
+        weight = total_weight.item() if isinstance(total_weight, np.generic) else total_weight
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (*self._row_key(key, source_node, target_node, backend), path, weight, time.time()),
+            )
+            self._write_touched(db)
+            # Counting is a table scan, trim every few hundred writes instead of on each one
+            self._puts += 1
+            if self._puts % 256 == 0:
+                self._evict(db)
+
+    def _evict(self, db):
+        excess = db.execute("SELECT COUNT(*) FROM results").fetchone()[0] - self.maxsize
+        if excess > 0:
+            db.execute("DELETE FROM results WHERE rowid IN (SELECT rowid FROM results ORDER BY used LIMIT ?)", (excess,))
+
+    def clear(self):
+        with self._connect() as db:
+            db.execute("DELETE FROM results")
+
+# Only the CP-SAT and network simplex backends are slow enough for a lookup (and a write on every
+# miss) to pay off, the combinatorial searches answer faster than SQLite does
+CACHED_BACKENDS = {"ortools", "min_cost_flow"}
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+def get_result_cache():
+    # Opened on first use, importing the solver creates no file. RESULT_CACHE_DB="" turns it off
+    global _result_cache
+    path = os.environ.get("RESULT_CACHE_DB", os.path.join("cache", "results.sqlite"))
+    if not path:
+        return None
+    with _result_cache_lock:
+        if _result_cache is None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            _result_cache = ResultCache(path, maxsize=int(os.environ.get("RESULT_CACHE_SIZE", 100_000)))
+    return _result_cache
+
+def shortest_path(graph, source_node, target_node, backend="auto", cross_check=False, stats=None,
+                  use_cache=True, **options):
+    # graph is a CompiledGraph or a source/target/weight DataFrame, options go to the backend.
+    # CP-SAT and network simplex queries on graphs with a content key are answered from the result
+    # cache when the query was solved before
+    start = time.perf_counter()
+    if isinstance(graph, pd.DataFrame):
+        graph = CompiledGraph.from_df(graph)
+    if stats is not None:
+        stats["build_time"] = time.perf_counter() - start
+    constrained = any(options.get(name) for name in CONSTRAINT_OPTIONS)
+    if backend == "auto":
+        backend = choose_backend(graph, constrained)
+    solve = load_backend(backend)
+    if constrained and backend not in CONSTRAINED_BACKENDS:
+        raise ValueError(f"Backend {backend} does not support path constraints")
+    # Any backend would return a path plus cycles run around for their negative cost
+    if not constrained and graph.has_negative_cycle:
+        raise ValueError(NEGATIVE_CYCLE)
+
+    start = time.perf_counter()
+    # Constrained queries are not cached, the key does not cover their constraints
+    cache = None
+    if use_cache and backend in CACHED_BACKENDS and not cross_check and not constrained and graph.key is not None:
+        cache = get_result_cache()
+    if cache is not None:
+        cached = cache.get(graph.key, source_node, target_node, backend)
+        if cached is not None:
+            metrics.inc("result_cache_hits_total", backend=backend)
+            if stats is not None:
+                stats.update(backend=backend, cached=True, solve_time=time.perf_counter() - start)
+            return cached
+
+    run_stats = {} if stats is None else stats
+    with metrics.timer("solve", backend=backend):
+        path, total_weight = solve(graph, source_node, target_node, run_stats, **options)
+    if stats is not None:
+        stats["backend"] = backend
+        stats.setdefault("solve_time", time.perf_counter() - start)
+    # Results cut short by a time limit are not final
+    if cache is not None and run_stats.get("status") not in ("FEASIBLE", "UNKNOWN"):
+        cache.put(graph.key, source_node, target_node, backend, path, total_weight)
+
+    # Verify the result against the CP-SAT formulation, meant for tests and debugging
+    if cross_check and backend != "ortools" and not constrained:
+        _, expected = _solve_ortools(graph, source_node, target_node)
+        if (total_weight is None) != (expected is None) or (
+            total_weight is not None and not np.isclose(total_weight, expected)
+        ):
+            raise AssertionError(
+                f"{backend} returned {total_weight}, ortools returned {expected} "
+                f"for {source_node} -> {target_node}"
+            )
+    return path, total_weight
+
+def _search_tree(graph, root_ids, backward=False):
+    # Dijkstra from every root at once (a virtual super source joined to each root by a zero
+    # weight edge). Per node: distance, tree edge (-1 for roots and unreached nodes) and the index
+    # into root_ids of the root it hangs from (-1 when unreached). backward searches along reversed
+    # edges, i.e. distances to the roots
+    indptr, heads, weights, edge_ids = graph.backward if backward else graph.forward
+    dist = [float("inf")] * graph.n_nodes
+    pred = [-1] * graph.n_nodes
+    root = [-1] * graph.n_nodes
+    heap = []
+    for i, root_id in enumerate(root_ids):
+        if dist[root_id] > 0.0:
+            dist[root_id] = 0.0
+            root[root_id] = i
+            heap.append((0.0, root_id))
+    heapq.heapify(heap)
+    while heap:
+        d, u = heapq.heappop(heap)
+        if d > dist[u]:
+            continue
+        for k in range(indptr[u], indptr[u + 1]):
+            v = heads[k]
+            nd = d + weights[k]
+            if nd < dist[v]:
+                dist[v] = nd
+                pred[v] = edge_ids[k]
+                root[v] = root[u]
+                heapq.heappush(heap, (nd, v))
+    return np.array(dist), np.array(pred, dtype=np.int64), np.array(root, dtype=np.int64)
+
+def dijkstra_tree(graph, source_id):
+    # Full single-source search: distance (inf when unreachable) and predecessor edge (-1) per node
+    dist, pred, _ = _search_tree(graph, [source_id])
+    return dist, pred
+
+def _tree_nodes(graph, tree_edges, backward):
+    # Tree edges as node ids: the previous node on the path from the root, or the next node on the
+    # path to the root for backward trees (-1 for roots and unreached nodes)
+    nodes = np.full(graph.n_nodes, -1, dtype=np.int32)
+    reached = tree_edges >= 0
+    nodes[reached] = (graph.dst if backward else graph.src)[tree_edges[reached]]
+    return nodes
+
+def _check_batch(graph):
+    if graph.has_negative_weights:
+        raise ValueError("Batch queries need non-negative edge weights")
+
+def distances_to(graph, target_id, weights=None):
+    # Reverse search: distance from every node to the target (inf when it cannot reach it),
+    # along the edge weights or along weights given per edge id
+    indptr, tails, costs, edge_ids = graph.backward
+    if weights is not None:
+        costs = np.asarray(weights, dtype=np.float64)[graph.in_order].tolist()
+    dist = [float("inf")] * graph.n_nodes
+    dist[target_id] = 0.0
+    heap = [(0.0, target_id)]
+    while heap:
+        d, v = heapq.heappop(heap)
+        if d > dist[v]:
+            continue
+        for k in range(indptr[v], indptr[v + 1]):
+            u = tails[k]
+            nd = d + costs[k]
+            if nd < dist[u]:
+                dist[u] = nd
+                heapq.heappush(heap, (nd, u))
+    return dist
+
+# Graph of the current pool worker, shipped once through the pool initializer
+_worker_graph = None
+
+def _init_worker(graph):
+    global _worker_graph
+    _worker_graph = graph
+
+def _tree_task(source_id):
+    return dijkstra_tree(_worker_graph, source_id)
+
+# Pool kept between batches as (pid, graph key, workers, executor, graph). Its workers hold the
+# graph from the initializer, so it is replaced only for another graph or pool size, or after a
+# fork. Batches take turns on it, each one already uses every worker
+_pool = None
+_pool_lock = threading.Lock()
+
+def _worker_pool(graph, workers):
+    global _pool
+    token = (os.getpid(), graph.key if graph.key is not None else id(graph), workers)
+    if _pool is not None and _pool[:3] == token:
+        return _pool[3]
+    if _pool is not None and _pool[0] == os.getpid():
+        _pool[3].shutdown()
+    executor = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(graph,))
+    # The graph is kept so its id is not reused while the pool stands for it
+    _pool = (*token, executor, graph)
+    return executor
+
+def _trees(graph, source_ids, workers=None):
+    # Run one shortest path tree per source, fanned out over a process pool for larger batches
+    _check_batch(graph)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(source_ids) < 2 * workers:
+        return [dijkstra_tree(graph, s) for s in source_ids]
+    chunksize = max(1, len(source_ids) // (workers * 4))
+    with _pool_lock:
+        return list(_worker_pool(graph, workers).map(_tree_task, source_ids, chunksize=chunksize))
+
+def _as_graph(graph):
+    return CompiledGraph.from_df(graph) if isinstance(graph, pd.DataFrame) else graph
+
+def solve_many(graph, pairs, workers=None, return_paths=False):
+    # Distances for a list of (source, target) label pairs, inf when there is no path.
+    # Pairs sharing a source share one search tree
+    graph = _as_graph(graph)
+    sources = sorted({graph.node_id[s] for s, _ in pairs if s in graph.node_id})
+    trees = dict(zip(sources, _trees(graph, sources, workers)))
+
+    distances = np.full(len(pairs), np.inf)
+    paths = []
+    for i, (source_node, target_node) in enumerate(pairs):
+        source_id, target_id = lookup_nodes(graph, source_node, target_node)
+        path = None
+        if source_id is not None and target_id is not None:
+            dist, pred = trees[source_id]
+            distances[i] = dist[target_id]
+            if return_paths and np.isfinite(dist[target_id]):
+                path = graph.edge_path(_trace_tree(graph, pred, target_id))
+        paths.append(path)
+    return (distances, paths) if return_paths else distances
+
+def all_pairs(graph, workers=None, predecessors=False):
+    # Dense distance matrix indexed like graph.labels; optionally the predecessor node of every
+    # target on the path from each source (-1 for the source itself and unreachable nodes)
+    graph = _as_graph(graph)
+    trees = _trees(graph, list(range(graph.n_nodes)), workers)
+    dist = np.vstack([d for d, _ in trees]) if trees else np.zeros((0, 0))
+    if not predecessors:
+        return dist
+    pred = np.full((graph.n_nodes, graph.n_nodes), -1, dtype=np.int32)
+    for row, (_, pred_edges) in enumerate(trees):
+        pred[row] = _tree_nodes(graph, pred_edges, False)
+    return dist, pred
+
+def one_to_many(graph, source_node, reverse=False):
+    # Distances from source_node to every node with one search, arrays indexed like graph.labels:
+    # distance (inf when unreachable) and predecessor node id (-1 for the source and unreachable
+    # nodes). reverse=True gives many-to-one instead: distances to source_node, with the next
+    # node toward it in place of the predecessor
+    graph = _as_graph(graph)
+    _check_batch(graph)
+    dist, pred, _ = _search_tree(graph, [graph.node_id[source_node]], backward=reverse)
+    return dist, _tree_nodes(graph, pred, reverse)
+
+def nearest_facility(graph, facilities, reverse=False):
+    # Nearest of several facility nodes for every node with one search from all of them:
+    # distance from the nearest facility, predecessor node id and the index into facilities of
+    # that facility (-1 when none reaches the node). reverse=True measures the distance from each
+    # node to its nearest facility (e.g. every city to its closest depot)
+    graph = _as_graph(graph)
+    _check_batch(graph)
+    dist, pred, nearest = _search_tree(graph, [graph.node_id[node] for node in facilities], backward=reverse)
+    return dist, _tree_nodes(graph, pred, reverse), nearest
 
 # # Example usage:
 # df = pd.DataFrame({
@@ -0,0 +1,10 @@
+import zlib
+
+# Helpers for streamed Flask responses, shared by the /api and /export blueprints
+
+def gzip_stream(stream):
+    # Flushed after every part so the client can decode each chunk as soon as it arrives
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for part in stream:
+        yield compressor.compress(part.encode() if isinstance(part, str) else part) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
@@ -0,0 +1,30 @@
+import os
+import sys
+import tempfile
+
+import pandas as pd
+import pytest
+
+# Run from the repo root like the app (relative data/ paths), with caches and metrics in a
+# throwaway directory so tests neither read nor leave behind cache/
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+_scratch = tempfile.mkdtemp(prefix="spath-tests-")
+os.environ.setdefault("RESULT_CACHE_DB", "")
+os.environ.setdefault("METRICS_DIR", "")
+os.environ.setdefault("SPT_CACHE_DIR", os.path.join(_scratch, "trees"))
+os.environ.setdefault("JOB_CACHE_DIR", os.path.join(_scratch, "jobs"))
+
+EXAMPLE_FILES = ["data/example_1_dg.csv", "data/example_2_dg.csv", "data/example_3_dg.csv"]
+
+@pytest.fixture(params=EXAMPLE_FILES, ids=lambda path: os.path.basename(path).split("_dg")[0])
+def example(request):
+    from solver import CompiledGraph
+    return CompiledGraph.from_df(pd.read_csv(request.param))
+
+@pytest.fixture
+def client():
+    # Test client of the app's Flask server (the /api and /export blueprints)
+    from app import server
+    return server.test_client()
@@ -0,0 +1,41 @@
+import pytest
+
+import api
+
+NEGATIVE_CYCLE = [["a", "b", 1], ["b", "a", -2], ["b", "c", 1]]
+
+def test_paths(client):
+    response = client.post("/api/paths", json={"edges": [["a", "b", 1], ["b", "c", 2], ["a", "c", 5]],
+                                               "queries": [["a", "c"], ["c", "a"]]})
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert [r["weight"] for r in results] == [3.0, None]
+    assert results[0]["path"] == [["a", "b"], ["b", "c"]]
+
+@pytest.mark.parametrize("backend", ["min_cost_flow", "dijkstra", "bidirectional", "ch"])
+def test_backend_errors_are_reported_before_streaming(client, backend):
+    response = client.post("/api/paths", json={"edges": NEGATIVE_CYCLE, "queries": [["a", "c"]], "backend": backend})
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+@pytest.mark.parametrize("backend", ["auto", "ortools"])
+def test_negative_cycles_are_refused(client, backend):
+    response = client.post("/api/paths", json={"edges": [["a", "b", 1], ["b", "a", -2], ["a", "c", 1]],
+                                               "queries": [["a", "c"]], "backend": backend, "format": "ndjson"})
+    assert response.status_code == 400
+    assert "negative cycle" in response.get_json()["error"]
+
+def test_unknown_backend(client):
+    response = client.post("/api/paths", json={"edges": NEGATIVE_CYCLE, "queries": [], "backend": "nope"})
+    assert response.status_code == 400
+
+def test_query_cap(client, monkeypatch):
+    monkeypatch.setattr(api, "MAX_QUERIES", 2)
+    response = client.post("/api/paths", json={"edges": [["a", "b", 1]], "queries": [["a", "b"]] * 3})
+    assert response.status_code == 413
+
+@pytest.mark.parametrize("edges", [[["a", "b"]], [["a", "b", "heavy"]], "abc", [["a", "b", True]], [{"a": 1}]])
+def test_malformed_edges(client, edges):
+    response = client.post("/api/paths", json={"edges": edges, "queries": [["a", "b"]]})
+    assert response.status_code == 400
+    assert "error" in response.get_json()
@@ -0,0 +1,96 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import metrics
+import solver
+from solver import BACKEND_MODULES, BACKENDS, CompiledGraph, load_backend, shortest_path
+
+# Every backend is checked against the CP-SAT formulation (cross_check=True) on every node pair
+for _name in BACKEND_MODULES:
+    load_backend(_name)
+ALL_BACKENDS = sorted(BACKENDS)
+
+@pytest.mark.parametrize("backend", ALL_BACKENDS)
+def test_backends_agree_on_examples(example, backend):
+    for source, target in itertools.product(example.labels, repeat=2):
+        path, weight = shortest_path(example, source, target, backend=backend, cross_check=True, use_cache=False)
+        if weight is None:
+            assert path is None
+            continue
+        # The path is a chain of graph edges from source to target with the reported weight
+        assert [u for u, _ in path[1:]] == [v for _, v in path[:-1]]
+        if path:
+            assert path[0][0] == source and path[-1][1] == target
+        edges = {(example.labels[u], example.labels[v]): w
+                 for u, v, w in zip(example.src, example.dst, example.weight)}
+        assert np.isclose(sum(edges[edge] for edge in path), weight)
+
+def test_unknown_nodes_have_no_path(example):
+    assert shortest_path(example, "nowhere", example.labels[0], use_cache=False) == (None, None)
+
+def test_cross_check_catches_a_wrong_backend(example, monkeypatch):
+    def wrong(graph, source_node, target_node, stats=None, **options):
+        path, weight = BACKENDS["dijkstra"](graph, source_node, target_node, stats)
+        return path, None if weight is None else weight + 1
+    monkeypatch.setitem(BACKENDS, "wrong", wrong)
+    u, v = example.labels[example.src[0]], example.labels[example.dst[0]]
+    with pytest.raises(AssertionError):
+        shortest_path(example, u, v, backend="wrong", cross_check=True, use_cache=False)
+
+def test_negative_weights_choose_an_exact_backend():
+    graph = CompiledGraph.from_records([
+        {"source": "a", "target": "b", "weight": 4}, {"source": "a", "target": "c", "weight": 1},
+        {"source": "c", "target": "b", "weight": -2},
+    ])
+    assert solver.choose_backend(graph) == "min_cost_flow"
+    assert shortest_path(graph, "a", "b", cross_check=True, use_cache=False) == ([("a", "c"), ("c", "b")], -1.0)
+
+def test_unknown_backend():
+    graph = CompiledGraph.from_records([{"source": "a", "target": "b", "weight": 1}])
+    with pytest.raises(ValueError):
+        shortest_path(graph, "a", "b", backend="nope")
+
+def test_reduced_cpsat_model_agrees(example):
+    for source, target in itertools.product(example.labels, repeat=2):
+        _, expected = shortest_path(example, source, target, backend="dijkstra", use_cache=False)
+        path, weight = shortest_path(example, source, target, backend="ortools", use_cache=False, reduce=True)
+        assert weight == expected
+        if path:
+            assert path[0][0] == source and path[-1][1] == target
+
+def test_unsolved_queries_are_counted():
+    graph = CompiledGraph.from_df(pd.DataFrame({"source": ["a", "c"], "target": ["b", "d"], "weight": [1, 1]}))
+    key = metrics._key("unsolved_total", {"backend": "min_cost_flow", "status": "INFEASIBLE"})
+    before = metrics._counters.get(key, 0)
+    assert shortest_path(graph, "a", "d", backend="min_cost_flow") == (None, None)
+    assert metrics._counters[key] == before + 1
+
+def test_negative_cycles_have_no_shortest_path():
+    import app
+    import graph_store
+
+    df = pd.DataFrame({"source": ["a", "b", "a"], "target": ["b", "a", "c"], "weight": [1, -2, 1]})
+    graph = CompiledGraph.from_df(df)
+    for backend in ("auto", "ortools", "min_cost_flow"):
+        with pytest.raises(ValueError, match="negative cycle"):
+            shortest_path(graph, "a", "c", backend=backend, use_cache=False)
+    # Constrained paths are simple, a negative cycle does not make them undefined
+    assert shortest_path(graph, "a", "c", max_hops=3)[1] == 1.0
+    data = graph_store.edit(None, [("replace", graph)])
+    assert "negative cycle" in app.find_shortest_path(None, 1, "a", "c", data)[0]
+
+def test_time_limited_solutions_drop_off_path_cycles():
+    # A FEASIBLE CP-SAT solution may carry flow around a cycle away from the path
+    df = pd.DataFrame({"source": ["a", "b", "c", "d"], "target": ["b", "c", "d", "c"], "weight": [1, 1, 2, 2]})
+    graph = CompiledGraph.from_df(df)
+
+    class Model:
+        def solve(self, *args, **options):
+            return "FEASIBLE", np.array([0, 1, 2, 3]), 6.0
+
+    graph.__dict__["flow_model"] = Model()
+    path, weight = shortest_path(graph, "a", "c", backend="ortools", use_cache=False)
+    assert path == [("a", "b"), ("b", "c")] and weight == 2.0
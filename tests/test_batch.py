@@ -0,0 +1,35 @@
+import numpy as np
+
+import solver
+from solver import all_pairs, shortest_path, solve_many
+
+def test_solve_many_matches_single_queries(example):
+    pairs = [(s, t) for s in example.labels for t in example.labels]
+    weights = {(u, v): w for (u, v), w in zip(example.edge_path(range(example.n_edges)), example.weight.tolist())}
+    distances, paths = solve_many(example, pairs, workers=1, return_paths=True)
+    for (s, t), distance, path in zip(pairs, distances, paths):
+        _, expected = shortest_path(example, s, t, backend="dijkstra")
+        if expected is None:
+            assert np.isinf(distance) and path is None
+        else:
+            assert np.isclose(distance, expected)
+            assert np.isclose(sum(weights[tuple(edge)] for edge in path), expected)
+
+def test_the_process_pool_is_reused(example):
+    first = all_pairs(example, workers=2)
+    pool = solver._pool[3]
+    assert np.array_equal(all_pairs(example, workers=2), first)
+    assert solver._pool[3] is pool
+    assert np.array_equal(first, all_pairs(example, workers=1))
+
+def test_the_distance_matrix_callback_stays_in_process(example, monkeypatch):
+    import app
+    import graph_store
+
+    def no_pool(*args):
+        raise AssertionError("web callbacks must not start a process pool")
+
+    monkeypatch.setattr(solver, "_worker_pool", no_pool)
+    monkeypatch.setattr(solver.os, "cpu_count", lambda: 4)
+    data = graph_store.edit(None, [("replace", example)])
+    assert app.display_distance_matrix(1, data).data
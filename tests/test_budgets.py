@@ -0,0 +1,22 @@
+import pandas as pd
+import pytest
+
+import app
+import graph_store
+from solver import CompiledGraph
+
+def test_parse_budgets():
+    assert app.parse_budgets("time=90, toll<=5") == {"time": 90.0, "toll": 5.0}
+    assert app.parse_budgets(None) == {} == app.parse_budgets(" ")
+    with pytest.raises(ValueError):
+        app.parse_budgets("time")
+
+def test_budget_field_constrains_the_path():
+    df = pd.DataFrame({"source": ["a", "b", "a"], "target": ["b", "c", "c"], "weight": [1, 1, 5],
+                       "time": [10, 10, 1]})
+    data = graph_store.edit(None, [("replace", CompiledGraph.from_df(df))])
+    fastest = app.find_shortest_path(None, 1, "a", "c", data)[0]
+    assert "Total Weight: 2" in fastest
+    within = app.find_shortest_path(None, 1, "a", "c", data, budgets="time=5")[0]
+    assert "Total Weight: 5" in within
+    assert "Unknown resource toll" in app.find_shortest_path(None, 1, "a", "c", data, budgets="toll=5")[0]
@@ -0,0 +1,54 @@
+import itertools
+
+import pytest
+
+import dynamic_spt
+import graph_store
+from graph_cache import get_graph
+from solver import shortest_path
+
+@pytest.fixture(autouse=True)
+def tree_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(dynamic_spt, "TREE_DIR", str(tmp_path))
+    monkeypatch.setattr(dynamic_spt, "_trees", type(dynamic_spt._trees)())
+    # The example graphs are so small that any repair would pass the share of a large graph
+    monkeypatch.setattr(dynamic_spt, "REPAIR_LIMIT", 1.0)
+
+def _check(data, graph, source):
+    # Every answer from the tree matches a fresh search; returns the mode of the first query
+    modes = []
+    for target in graph.labels:
+        stats = {}
+        result = dynamic_spt.shortest_path(data, graph, source, target, stats)
+        modes.append(stats["backend"])
+        assert result is not None
+        expected = shortest_path(graph, source, target, backend="dijkstra", use_cache=False)
+        assert result[1] == expected[1]
+    assert set(modes[1:]) <= {"dynamic (cached)"}
+    return modes[0]
+
+def test_loaded_graphs_are_left_to_the_solver(example):
+    data = graph_store.edit(None, [("replace", example)])
+    graph = get_graph(data)
+    assert dynamic_spt.shortest_path(data, graph, example.labels[0], example.labels[1]) is None
+
+def test_edited_sessions_are_repaired(example):
+    data = graph_store.edit(None, [("replace", example)])
+    source = example.labels[0]
+    data = graph_store.edit(data, [("add_node", "extra")])
+    assert _check(data, get_graph(data), source) == "dynamic (full)"
+    assert _check(data, get_graph(data), source) == "dynamic (cached)"
+    for u, v in itertools.islice(zip(example.src, example.dst), 3):
+        data = graph_store.edit(data, [("remove_edges", [(example.labels[u], example.labels[v])])])
+        assert _check(data, get_graph(data), source) == "dynamic (repaired)"
+    data = graph_store.edit(data, [("add_edge", source, "extra", 1)])
+    assert _check(data, get_graph(data), source) == "dynamic (repaired)"
+
+def test_tree_is_tagged_with_the_graph_version(example):
+    data = graph_store.edit(None, [("replace", example)])
+    data = graph_store.edit(data, [("add_node", "extra")])
+    graph = get_graph(data)
+    # Another request edits the session after this graph was compiled
+    graph_store.edit(data, [("add_node", "later")])
+    dynamic_spt.shortest_path(data, graph, example.labels[0], example.labels[1])
+    assert dynamic_spt._load(data["session"], example.labels[0])["version"] == graph.version == data["version"]
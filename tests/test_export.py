@@ -0,0 +1,31 @@
+import zlib
+
+import pandas as pd
+
+import export
+import graph_store
+from solver import CompiledGraph
+
+def _session(rows):
+    return graph_store.edit(None, [("replace", CompiledGraph.from_df(pd.DataFrame(rows)))])["session"]
+
+def test_edges_csv(client):
+    handle = _session({"source": ["a", "b"], "target": ["b", "c"], "weight": [1, 2]})
+    response = client.get(f"/export/{handle}/edges.csv")
+    assert response.status_code == 200
+    assert response.get_data(as_text=True).splitlines() == ["source,target,weight", "a,b,1", "b,c,2"]
+
+def test_distances_csv_gzip(client):
+    handle = _session({"source": ["a", "b"], "target": ["b", "c"], "weight": [1, 2]})
+    response = client.get(f"/export/{handle}/distances.csv?gzip=1")
+    assert response.mimetype == "application/gzip"
+    rows = zlib.decompress(response.get_data(), wbits=31).decode().splitlines()
+    assert rows == ["source,a,b,c", "a,0.0,1.0,3.0", "b,,0.0,2.0", "c,,,0.0"]
+
+def test_distances_csv_size_cap(client, monkeypatch):
+    monkeypatch.setattr(export, "MAX_DISTANCE_NODES", 2)
+    handle = _session({"source": ["a", "b"], "target": ["b", "c"], "weight": [1, 2]})
+    assert client.get(f"/export/{handle}/distances.csv").status_code == 413
+
+def test_unknown_handle(client):
+    assert client.get("/export/nope/edges.csv").status_code == 404
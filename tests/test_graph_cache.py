@@ -0,0 +1,29 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from graph_cache import GraphCache
+
+def test_one_build_per_key_and_keys_build_in_parallel():
+    cache = GraphCache()
+    calls = []
+    started = threading.Barrier(2, timeout=5)
+
+    def build(key):
+        def run():
+            calls.append(key)
+            if key in ("a", "b"):
+                # Both keys are inside their build at once, a global lock would time out here
+                started.wait()
+            time.sleep(0.05)
+            return SimpleNamespace(name=key, n_nodes=0, n_edges=0)
+        return run
+
+    threads = [threading.Thread(target=cache.get_or_build, args=(key, build(key))) for key in ["a", "b", "a", "a"]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(calls) == ["a", "b"]
+    assert cache.get_or_build("a", build("c")).name == "a"
+    assert cache._building == {}
@@ -0,0 +1,105 @@
+import pandas as pd
+import pytest
+
+import ch_index
+import graph_store
+from graph_cache import get_graph
+from ingest import compile_edges, graph_key
+from solver import CompiledGraph
+
+@pytest.fixture(params=["memory", "sqlite"])
+def sessions(request, tmp_path, monkeypatch):
+    backend = graph_store.MemoryBackend() if request.param == "memory" else graph_store.SQLiteBackend(
+        str(tmp_path / "sessions.sqlite"))
+    monkeypatch.setattr(graph_store, "sessions", backend)
+    return backend
+
+def test_every_way_of_loading_a_graph_gets_the_same_key(example):
+    records = example.df.to_dict("records")
+    session = get_graph(graph_store.edit(None, [("replace", example)]))
+    assert session.key == graph_key(example) == get_graph(records).key
+
+def test_offline_index_serves_the_app_graph(tmp_path):
+    # The key ch_index.py saves an index under is the key of the session graph the app queries
+    path = "data/example_3_dg.csv"
+    graph = CompiledGraph.from_records(pd.read_csv(path).to_dict("records"))
+    graph.key = graph_key(graph)
+    ch_index.CHIndex.build(graph).save(str(tmp_path / f"{graph.key}.npz"))
+    ch_index.load_indexes(str(tmp_path))
+    uploaded = get_graph(graph_store.edit(None, [("replace", compile_edges(path))]))
+    example = get_graph(graph_store.edit(None, [("replace", CompiledGraph.from_df(pd.read_csv(path)))]))
+    assert ch_index.has_index(uploaded) and ch_index.has_index(example)
+
+def test_edits_bump_the_version(sessions, example):
+    data = graph_store.edit(None, [("replace", example)])
+    data = graph_store.edit(data, [("add_node", "new"), ("add_edge", example.labels[0], "new", 3)])
+    assert data["version"] == 2
+    graph = get_graph(data)
+    assert graph.n_edges == example.n_edges + 1
+    assert (example.labels[0], "new") in [tuple(edge) for edge in graph.edge_path(range(graph.n_edges))]
+    assert sessions.changes(data["session"], 1) == [("add_node", "new"), ("add_edge", example.labels[0], "new", 3)]
+
+def test_unknown_session_is_an_error(sessions, example):
+    stale = {"session": "gone", "version": 3}
+    with pytest.raises(KeyError):
+        graph_store.edit(stale, [("add_node", "a")])
+    # A replace does not need the old graph, it starts a new session
+    data = graph_store.edit(stale, [("replace", example)])
+    assert data["session"] != "gone" and get_graph(data).n_edges == example.n_edges
+
+def test_resources_survive_upload_and_edits(sessions, tmp_path):
+    path = tmp_path / "edges.csv"
+    path.write_text("source,target,weight,time,note\na,b,1,5,x\nb,c,2,7,y\na,c,9,1,z\n")
+    graph = compile_edges(str(path))
+    assert sorted(graph.resources) == ["time"]
+    data = graph_store.edit(None, [("replace", graph)])
+    assert get_graph(data).resources["time"].tolist() == [5.0, 7.0, 1.0]
+    data = graph_store.edit(data, [("add_node", "d"), ("add_edge", "c", "d", 1), ("remove_edges", [("a", "b")])])
+    assert get_graph(data).resources["time"].tolist() == [7.0, 1.0, 0.0]
+
+def test_a_failing_batch_leaves_the_session_unchanged(sessions, example):
+    data = graph_store.edit(None, [("replace", example)])
+    before = get_graph(data)
+    u, v = before.edge_path([0])[0]
+    batch = [("add_node", "new"), ("add_edge", u, "new", 1), ("remove_nodes", [u]), ("add_edge", u, v, 1)]
+    with pytest.raises(ValueError):
+        graph_store.edit(data, batch)
+    assert sessions.version(data["session"]) == data["version"]
+    after = sessions.compile(data["session"])
+    assert after.key == before.key and "new" not in after.node_id
+    # The session still takes edits, on the restored state
+    data = graph_store.edit(data, [("add_node", "new"), ("add_edge", u, "new", 1)])
+    assert get_graph(data).n_edges == example.n_edges + 1
+    with pytest.raises(ValueError):
+        graph_store.edit(data, [("add_edge", u, "new", 2)])
+
+def test_rejected_edits_are_reported(example):
+    import app
+
+    data = graph_store.edit(None, [("replace", example)])
+    u, v = example.edge_path([0])[0]
+    new_data, message = app.add_edge(1, u, v, 5, data)
+    assert new_data is app.no_update and message.startswith("Edit rejected")
+
+def test_fractional_weights_keep_their_key_and_precision(tmp_path):
+    path = tmp_path / "edges.csv"
+    path.write_text("source,target,weight\na,b,2.7\nb,c,0.1\n")
+    uploaded = compile_edges(str(path))
+    session = get_graph(graph_store.edit(None, [("replace", uploaded)]))
+    offline = CompiledGraph.from_df(pd.read_csv(path))
+    assert uploaded.key == session.key == graph_key(offline)
+    assert uploaded.weight.tolist() == session.weight.tolist() == [2.7, 0.1]
+
+def test_sqlite_sessions_are_evicted(tmp_path, monkeypatch, example):
+    backend = graph_store.SQLiteBackend(str(tmp_path / "sessions.sqlite"), maxsize=2)
+    monkeypatch.setattr(graph_store, "sessions", backend)
+    first = graph_store.edit(None, [("replace", example)])
+    second = graph_store.edit(None, [("replace", example)])
+    # Editing the first makes the second the least recently used
+    first = graph_store.edit(first, [("add_node", "new")])
+    third = graph_store.edit(None, [("replace", example)])
+    assert backend.version(second["session"]) is None
+    assert backend.version(first["session"]) == 2 and backend.version(third["session"]) == 1
+    db = backend._connect()
+    assert db.execute("SELECT COUNT(*) FROM edges WHERE session = ?", (second["session"],)).fetchone()[0] == 0
+    assert db.execute("SELECT COUNT(DISTINCT session) FROM nodes").fetchone()[0] == 2
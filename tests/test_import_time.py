@@ -0,0 +1,12 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_app_import_stays_within_budget():
+    # benchmarks/import_time.py fails when importing the app takes longer than its budget or
+    # loads a module that should be imported lazily
+    result = subprocess.run([sys.executable, os.path.join("benchmarks", "import_time.py"), "--repeat", "3"],
+                            cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout + result.stderr
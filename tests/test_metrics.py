@@ -0,0 +1,19 @@
+import os
+
+import metrics
+
+def test_requests_do_not_write_the_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_DIR", str(tmp_path))
+    monkeypatch.setattr(metrics, "FLUSH_SECONDS", 3600)
+    monkeypatch.setattr(metrics, "_flusher", None)
+    metrics.begin_request()
+    metrics.end_request("test", 10)
+    assert metrics._flusher is not None
+    assert os.listdir(tmp_path) == []
+    metrics.flush()
+    assert os.listdir(tmp_path) == [f"{metrics._process}.json"]
+
+def test_render_reads_its_own_values_from_memory(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_DIR", "")
+    metrics.inc("result_cache_hits_total", backend="test-render")
+    assert 'shortest_path_result_cache_hits_total{backend="test-render"} 1' in metrics.render()
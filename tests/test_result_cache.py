@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+
+import solver
+from solver import ResultCache, shortest_path
+
+def test_hits_are_read_only_until_the_batch_is_full(tmp_path, monkeypatch):
+    monkeypatch.setattr(solver, "TOUCH_BATCH", 2)
+    cache = ResultCache(str(tmp_path / "results.sqlite"))
+    cache.put("g", "a", "b", "ortools", [("a", "b")], 1.0)
+    cache.put("g", "b", "a", "ortools", None, None)
+    db = cache._connect()
+    changes = db.total_changes
+    assert cache.get("g", "a", "b", "ortools") == ([("a", "b")], 1.0)
+    assert db.total_changes == changes and len(cache._touched) == 1
+    assert cache.get("g", "x", "y", "ortools") is None
+    assert cache.get("g", "b", "a", "ortools") == (None, None)
+    assert cache._touched == {} and db.total_changes == changes + 2
+
+def test_only_exact_backends_use_the_cache(example, tmp_path, monkeypatch):
+    monkeypatch.setenv("RESULT_CACHE_DB", str(tmp_path / "results.sqlite"))
+    monkeypatch.setattr(solver, "_result_cache", None)
+    example.key = "test-graph"
+    source, target = example.labels[0], example.labels[-1]
+    shortest_path(example, source, target, backend="bidirectional")
+    assert solver._result_cache is None
+    expected = shortest_path(example, source, target, backend="min_cost_flow")
+    cache = solver._result_cache
+    assert cache.get("test-graph", source, target, "min_cost_flow") is not None
+    assert shortest_path(example, source, target, backend="min_cost_flow") == expected
+
+def test_import_creates_no_cache_file(tmp_path):
+    env = {**os.environ, "RESULT_CACHE_DB": str(tmp_path / "results.sqlite")}
+    subprocess.run([sys.executable, "-c", "import solver"], check=True, env=env)
+    assert not os.path.exists(tmp_path / "results.sqlite")
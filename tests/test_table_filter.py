@@ -0,0 +1,29 @@
+import pandas as pd
+import pytest
+
+from app import filter_mask, split_filter_part
+
+@pytest.mark.parametrize("part, expected", [
+    ("{weight} ge 100", ("weight", "ge", 100.0)),
+    ("{weight} >= 100", ("weight", "ge", 100.0)),
+    ("{weight} < 5", ("weight", "lt", 5.0)),
+    ('{source} contains "Pine Bluff"', ("source", "contains", "Pine Bluff")),
+    ("{source} contains Pine Bluff", ("source", "contains", "Pine Bluff")),
+    ('{source} = "a=b<c"', ("source", "eq", "a=b<c")),
+    ('{target} ne "x ne y"', ("target", "ne", "x ne y")),
+    ("{source} scontains Hou", ("source", "contains", "Hou")),
+    ("{source} icontains hou", ("source", "icontains", "hou")),
+    ("{source} datestartswith 2024", ("source", "datestartswith", 2024.0)),
+    ("weight ge 100", (None, None, None)),
+    ("{weight} between 1", (None, None, None)),
+])
+def test_split_filter_part(part, expected):
+    assert split_filter_part(part) == expected
+
+def test_filter_mask():
+    df = pd.DataFrame({"source": ["Pine Bluff", "Houston", "a=b<c"], "target": ["Bluff", "Dallas", "x"],
+                       "weight": [1, 200, 50]})
+    assert filter_mask(df, '{source} contains "Pine Bluff"').tolist() == [True, False, False]
+    assert filter_mask(df, '{source} = "a=b<c"').tolist() == [False, False, True]
+    assert filter_mask(df, "{weight} ge 50 && {source} icontains HOU").tolist() == [False, True, False]
+    assert filter_mask(df, "{nope} eq 1").tolist() == [True, True, True]